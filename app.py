@@ -8,48 +8,44 @@ import os
 import sys
 import json
 import shutil
-import subprocess
+import time
+import zipfile
+from contextlib import nullcontext
 from pathlib import Path
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from urllib.parse import urlsplit
+from flask import Flask, Request, Response, g, render_template, request, jsonify, send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import torch
-from PIL import Image
+import cv2
+import numpy as np
 
 # Add yolov5 to path
 BASE_DIR = Path(__file__).parent
 sys.path.insert(0, str(BASE_DIR / 'yolov5'))
 
+from inference import ModelRegistry, OutputWriter, load_image, save_detection_outputs
+from batching import MicroBatcher
+from jobs import JobManager
+from result_cache import ResultCache, hash_bytes, hash_file
+from detection_index import DetectionIndex
+from tracking import Tracker
+from video_pipeline import run_video_detection
+from bulk import IMAGE_EXTENSIONS, iter_images, run_bulk
+from tiling import run_tiled
+from live import LiveManager, LiveStream
+from storage import StorageManager
+from media import MediaCache, make_streamable
+from detections import (CLASS_NAMES, COCO_CLASS_NAMES, format_detections, get_weights_catalog, is_coco_weights,
+                        model_names, resolve_weights_path)
+from startup import SNAPSHOT_DIR, Warmup, process_started_at, snapshot_path
+from metrics import MetricsRegistry, Trace, process_stats, worker_processes
+from ingest import VIDEO_FORMATS, BufferPool, PooledFile, UploadStore, decode_image, sniff_format
+import backends
+
 app = Flask(__name__)
 CORS(app)
 
-# Class names for 2-class detection (Fish, notFish)
-CLASS_NAMES = {
-    0: 'Fish',
-    1: 'notFish'
-}
-
-# COCO class names (for mapping COCO detections to Fish/notFish)
-COCO_CLASS_NAMES = {
-    0: 'person', 1: 'bicycle', 2: 'car', 3: 'motorcycle', 4: 'airplane', 5: 'bus',
-    6: 'train', 7: 'truck', 8: 'boat', 9: 'traffic light', 10: 'fire hydrant',
-    11: 'stop sign', 12: 'parking meter', 13: 'bench', 14: 'bird', 15: 'cat',
-    16: 'dog', 17: 'horse', 18: 'sheep', 19: 'cow', 20: 'elephant', 21: 'bear',
-    22: 'zebra', 23: 'giraffe', 24: 'backpack', 25: 'umbrella', 26: 'handbag',
-    27: 'tie', 28: 'suitcase', 29: 'frisbee', 30: 'skis', 31: 'snowboard',
-    32: 'sports ball', 33: 'kite', 34: 'baseball bat', 35: 'baseball glove',
-    36: 'skateboard', 37: 'surfboard', 38: 'tennis racket', 39: 'bottle',
-    40: 'wine glass', 41: 'cup', 42: 'fork', 43: 'knife', 44: 'spoon',
-    45: 'bowl', 46: 'banana', 47: 'apple', 48: 'sandwich', 49: 'orange',
-    50: 'broccoli', 51: 'carrot', 52: 'hot dog', 53: 'pizza', 54: 'donut',
-    55: 'cake', 56: 'chair', 57: 'couch', 58: 'potted plant', 59: 'bed',
-    60: 'dining table', 61: 'toilet', 62: 'tv', 63: 'laptop', 64: 'mouse',
-    65: 'remote', 66: 'keyboard', 67: 'cell phone', 68: 'microwave', 69: 'oven',
-    70: 'toaster', 71: 'sink', 72: 'refrigerator', 73: 'book', 74: 'clock',
-    75: 'vase', 76: 'scissors', 77: 'teddy bear', 78: 'hair drier', 79: 'toothbrush'
-}
-
 def map_coco_to_fish_notfish(class_id, class_name=None):
     """
     Map COCO class detections to Fish/notFish
@@ -94,84 +90,204 @@ def convert_coco_detections_to_fish_notfish(detections):
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 app.config['UPLOAD_FOLDER'] = BASE_DIR / 'uploads'
 app.config['RESULTS_FOLDER'] = BASE_DIR / 'results'
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'mov', 'mkv'}
+app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'heic', 'heif', 'mp4', 'avi', 'mov', 'mkv'}
+app.config['PERSIST_UPLOADS'] = os.environ.get('IKAN_PERSIST_UPLOADS', '1') == '1'  # keep image originals on disk
+app.config['UPLOAD_STORE_BYTES'] = int(os.environ.get('IKAN_UPLOAD_STORE_MB', 512)) * 1024 * 1024
+app.config['MODEL_CACHE_SIZE'] = int(os.environ.get('IKAN_MODEL_CACHE_SIZE', 2))  # warm models kept in memory
+app.config['DEVICE'] = os.environ.get('IKAN_DEVICE', '')  # '' = auto (cuda:0 if available, else cpu)
+app.config['BACKEND'] = os.environ.get('IKAN_BACKEND', backends.PYTORCH)  # pytorch, torchscript, onnx, onnx-int8
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('IKAN_BATCH_MAX_SIZE', 8))  # images per forward pass
+app.config['BATCH_MAX_WAIT_MS'] = float(os.environ.get('IKAN_BATCH_MAX_WAIT_MS', 10))  # max wait to fill a batch
+app.config['JOB_WORKERS'] = int(os.environ.get('IKAN_JOB_WORKERS', 1))  # concurrent video jobs
+# Shared job snapshots, needed when several server processes answer polls (set by gunicorn.conf.py)
+app.config['JOB_STATE_FOLDER'] = os.environ.get('IKAN_JOB_STATE_DIR') or None
+app.config['BULK_MAX_EXTRACT_BYTES'] = int(os.environ.get('IKAN_BULK_MAX_EXTRACT_MB', 2048)) * 1024 * 1024
+app.config['TILE_SIZE'] = int(os.environ.get('IKAN_TILE_SIZE', 640))  # tiled mode: tile edge in pixels
+app.config['TILE_OVERLAP'] = float(os.environ.get('IKAN_TILE_OVERLAP', 0.2))  # fraction shared by neighbouring tiles
+app.config['MAX_TILES_PER_BATCH'] = int(os.environ.get('IKAN_MAX_TILES_PER_BATCH', 8))
+app.config['CACHE_FOLDER'] = BASE_DIR / 'cache'
+app.config['CACHE_MEMORY_ENTRIES'] = int(os.environ.get('IKAN_CACHE_MEMORY_ENTRIES', 256))
+app.config['CACHE_DISK_BYTES'] = int(os.environ.get('IKAN_CACHE_DISK_MB', 256)) * 1024 * 1024
+app.config['INDEX_PATH'] = Path(os.environ.get('IKAN_INDEX_PATH', BASE_DIR / 'cache' / 'detections.sqlite'))
+app.config['LIVE_MAX_STREAMS'] = int(os.environ.get('IKAN_LIVE_MAX_STREAMS', 2))  # concurrent live sources per worker
+# Hosts live rtsp/http(s) URLs may point at (comma-separated, * = any); none by default, the
+# server would otherwise fetch any address a client names
+app.config['LIVE_ALLOWED_HOSTS'] = {h.strip().lower() for h in os.environ.get('IKAN_LIVE_ALLOWED_HOSTS', '').split(',')
+                                    if h.strip()}
+# Serving processes (set by gunicorn.conf.py); live streams are only offered with a single one
+app.config['SERVER_WORKERS'] = int(os.environ.get('IKAN_SERVER_WORKERS', 1))
+# Where server processes share metrics snapshots (set by gunicorn.conf.py; None = this process only)
+app.config['METRICS_FOLDER'] = os.environ.get('IKAN_METRICS_DIR') or None
+# uploads/ + results/ retention (0 disables a limit)
+app.config['STORAGE_MAX_BYTES'] = int(os.environ.get('IKAN_STORAGE_MAX_MB', 10240)) * 1024 * 1024
+app.config['UPLOAD_MAX_AGE'] = float(os.environ.get('IKAN_UPLOAD_MAX_AGE_DAYS', 7)) * 86400
+app.config['RESULT_MAX_AGE'] = float(os.environ.get('IKAN_RESULT_MAX_AGE_DAYS', 30)) * 86400
+app.config['COMPACT_AFTER'] = float(os.environ.get('IKAN_COMPACT_AFTER_HOURS', 24)) * 3600  # archive unused results
+app.config['STORAGE_SWEEP_INTERVAL'] = float(os.environ.get('IKAN_STORAGE_SWEEP_SECONDS', 300))
+app.config['MEDIA_CACHE_BYTES'] = int(os.environ.get('IKAN_MEDIA_CACHE_MB', 256)) * 1024 * 1024  # thumbnails / previews
+app.config['MEDIA_MAX_AGE'] = int(os.environ.get('IKAN_MEDIA_MAX_AGE', 3600))  # browser cache seconds for media
+app.config['FFMPEG'] = os.environ.get('IKAN_FFMPEG', 'ffmpeg')  # '' = no H.264 transcode, faststart only
+# Fused models saved at image build time (python startup.py snapshot ...), loaded instead of the .pt
+app.config['SNAPSHOT_FOLDER'] = SNAPSHOT_DIR
+# Loaded during warm-up: comma-separated weights, or auto (most used in the detection index)
+app.config['PRELOAD_WEIGHTS'] = [w for w in os.environ.get('IKAN_PRELOAD_WEIGHTS', 'auto').split(',') if w]
 
 # Create necessary directories
 app.config['UPLOAD_FOLDER'].mkdir(exist_ok=True)
 app.config['RESULTS_FOLDER'].mkdir(exist_ok=True)
 
+# Loaded models stay warm between requests
+model_registry = ModelRegistry(max_models=app.config['MODEL_CACHE_SIZE'], device=app.config['DEVICE'])
+# Concurrent single-image requests are batched per (weights, imgsz)
+batcher = MicroBatcher(model_registry,
+                       max_batch_size=app.config['BATCH_MAX_SIZE'],
+                       max_wait_ms=app.config['BATCH_MAX_WAIT_MS'])
+# Video detection runs on a bounded background pool
+job_manager = JobManager(max_workers=app.config['JOB_WORKERS'], state_dir=app.config['JOB_STATE_FOLDER'])
+# Uploads are read into reusable buffers and kept decoded for the following detect
+upload_buffers = BufferPool()
+upload_store = UploadStore(max_bytes=app.config['UPLOAD_STORE_BYTES'])
+
+class UploadRequest(Request):
+    """Multipart image parts are parsed into pooled buffers, not Werkzeug's spooled temp files (>500 KB on disk)"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and Path(filename).suffix.lower() in IMAGE_EXTENSIONS | {'.heic', '.heif'}:
+            return upload_buffers.open()
+        # Videos and archives are large and end up on disk anyway
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+app.request_class = UploadRequest
+# Annotated images / labels are written off the request path
+output_writer = OutputWriter()
+# Repeated detections of the same content are served from here
+result_cache = ResultCache(app.config['CACHE_FOLDER'],
+                           max_memory_entries=app.config['CACHE_MEMORY_ENTRIES'],
+                           max_disk_bytes=app.config['CACHE_DISK_BYTES'])
+# Every detection is also written to a queryable SQLite index
+detection_index = DetectionIndex(app.config['INDEX_PATH'])
+# Live camera / stream sources (held in memory, so only offered with a single server worker)
+live_manager = LiveManager(max_streams=app.config['LIVE_MAX_STREAMS'])
+
+def referenced_storage():
+    """uploads/ and results/ entries the storage sweeper must keep"""
+    names = result_cache.referenced_dirs() | job_manager.referenced_files()
+    names.update(Path(s.source).name for s in live_manager.list() if s.running)
+    return names
+
+# Discovered weights with class names / imgsz / params read once from each checkpoint
+weights_catalog = get_weights_catalog()
+# Thumbnails and web-sized previews of results and uploads
+media_cache = MediaCache(app.config['CACHE_FOLDER'] / 'media', max_bytes=app.config['MEDIA_CACHE_BYTES'])
+
+# uploads/ and results/ stay within quota and age limits, old results are archived
+storage_manager = StorageManager(app.config['UPLOAD_FOLDER'], app.config['RESULTS_FOLDER'],
+                                 app.config['CACHE_FOLDER'] / 'storage.lock',
+                                 max_bytes=app.config['STORAGE_MAX_BYTES'],
+                                 upload_max_age=app.config['UPLOAD_MAX_AGE'],
+                                 result_max_age=app.config['RESULT_MAX_AGE'],
+                                 compact_after=app.config['COMPACT_AFTER'],
+                                 interval=app.config['STORAGE_SWEEP_INTERVAL'],
+                                 referenced=referenced_storage)
+
+# Heavy imports, model loads and a first forward pass happen here, off the request path
+# (the gunicorn master runs it before forking, see gunicorn.conf.py)
+warmup = Warmup(started_at=process_started_at(os.environ.get('IKAN_MASTER_PID', 'self')))
+
+def preload_weights():
+    """Weights loaded during warm-up"""
+    if app.config['PRELOAD_WEIGHTS'] == ['auto']:
+        return most_used_weights(app.config['MODEL_CACHE_SIZE'])
+    return [resolve_weights_path(w) for w in app.config['PRELOAD_WEIGHTS']]
+
+def warmup_imports():
+    import torch  # noqa: F401
+    from models.common import DetectMultiBackend  # noqa: F401
+    from utils.augmentations import letterbox  # noqa: F401
+    from utils.general import non_max_suppression  # noqa: F401
+
+def warmup_models():
+    for weights in preload_weights():
+        model_registry.get(backend_weights(weights))
+
+def warmup_inference():
+    # First forward pass allocates buffers and picks kernels; do it before the first request does
+    if os.environ.get('IKAN_MASTER_PID') == str(os.getpid()):
+        return  # not in the pre-fork master (thread pools don't survive fork), workers run it after forking
+    dummy = np.zeros((640, 640, 3), dtype=np.uint8)
+    for model_path in model_registry.loaded_paths():
+        model_registry.infer(model_path, [dummy])
+
+warmup.stage('imports', warmup_imports)
+warmup.stage('weights_catalog', lambda: weights_catalog.entries(), required=False)
+warmup.stage('models', warmup_models, required=False)
+warmup.stage('first_inference', warmup_inference, required=False)
+
+# Prometheus-style metrics, scraped from /metrics; with several server processes they exchange
+# snapshots in METRICS_FOLDER: counters / histograms are summed, per-process gauges get a pid label
+metrics = MetricsRegistry(shared_dir=app.config['METRICS_FOLDER'])
+REQUEST_SECONDS = metrics.histogram('ikan_request_seconds', 'HTTP request latency', ('endpoint', 'status'))
+STAGE_SECONDS = metrics.histogram('ikan_stage_seconds', 'Latency of each stage of upload and detect',
+                                  ('endpoint', 'stage'))
+DETECT_CACHE = metrics.counter('ikan_detect_cache_total', 'Image detections by result cache outcome', ('result',))
+metrics.gauge('ikan_batch_queue_depth', 'Images waiting for the micro-batcher', batcher.queue_depth, per_process=True)
+metrics.gauge('ikan_jobs_active', 'Queued or running background jobs', job_manager.active_count, per_process=True)
+metrics.gauge('ikan_output_writes_pending', 'Annotated outputs not yet written', output_writer.pending_count,
+              per_process=True)
+metrics.gauge('ikan_models_loaded', 'Models kept warm in memory', lambda: len(model_registry.loaded_paths()),
+              per_process=True)
+metrics.gauge('ikan_result_cache_hit_rate', 'Result cache hit rate since start', lambda: result_cache.stats()['hit_rate'],
+              per_process=True)
+metrics.gauge('ikan_result_cache_lookups', 'Result cache lookups by outcome',
+              lambda: {(k,): v for k, v in result_cache.stats().items()
+                       if k in ('memory_hits', 'disk_hits', 'refilter_hits', 'misses')}, ('result',), per_process=True)
+metrics.gauge('ikan_index_pending_writes', 'Detection batches waiting for the index writer', detection_index.pending,
+              per_process=True)
+metrics.gauge('ikan_live_streams', 'Running live streams', lambda: sum(1 for s in live_manager.list() if s.running),
+              per_process=True)
+metrics.gauge('ikan_live_drop_rate', 'Fraction of captured live frames skipped as stale',
+              lambda: {(s.id,): s.stats()['drop_rate'] for s in live_manager.list()}, ('stream',), per_process=True)
+metrics.gauge('ikan_storage_bytes', 'Disk used by uploads, results and archives at the last sweep',
+              lambda: {(area,): (storage_manager.stats()['usage'] or {}).get(area, {}).get('bytes')
+                       for area in ('uploads', 'results', 'archive')}, ('area',))
+metrics.gauge('ikan_ready', 'Warm-up finished (1) or still running / failed (0)', lambda: int(warmup.ready),
+              per_process=True)
+metrics.gauge('ikan_warmup_stage_seconds', 'Duration of each warm-up stage',
+              lambda: {(name,): seconds for name, seconds in warmup.timings.items()}, ('stage',), per_process=True)
+metrics.gauge('ikan_time_to_ready_seconds', 'Process start to warm-up finished',
+              lambda: warmup.status()['time_to_ready_seconds'], per_process=True)
+metrics.gauge('ikan_time_to_first_detection_seconds', 'Process start to the first completed image detection',
+              warmup.time_to_first_detection, per_process=True)
+metrics.gauge('ikan_upload_store_bytes', 'Decoded uploads held in memory', lambda: upload_store.stats()['bytes'],
+              per_process=True)
+metrics.gauge('ikan_process_resident_memory_bytes', 'Resident set size', lambda: process_stats()['rss_bytes'],
+              per_process=True)
+metrics.gauge('ikan_process_cpu_seconds', 'User + system CPU time', lambda: process_stats()['cpu_seconds'],
+              per_process=True)
+metrics.gauge('ikan_workers', 'Serving worker processes',
+              lambda: sum(1 for w in worker_processes() if w['role'] != 'master'))
+metrics.gauge('ikan_worker_resident_memory_bytes', 'Resident set size of each serving process',
+              lambda: {(w['pid'], w['role']): w['rss_bytes'] for w in worker_processes()}, ('pid', 'role'))
+metrics.gauge('ikan_worker_proportional_memory_bytes', 'PSS of each serving process (shared pages split)',
+              lambda: {(w['pid'], w['role']): w.get('pss_bytes') for w in worker_processes()}, ('pid', 'role'))
+# Endpoints whose stages are traced (trace ids are optional, stage histograms always recorded)
+TRACED_ENDPOINTS = {'upload_file', 'detect'}
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 def is_image_file(filename):
     """Check if file is an image"""
-    return filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
+    return filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif', 'heic', 'heif'}
 
 def is_video_file(filename):
     """Check if file is a video"""
     return filename.rsplit('.', 1)[1].lower() in {'mp4', 'avi', 'mov', 'mkv'}
 
-def convert_heif_to_png(filepath):
-    """Convert HEIF/HEIC files to PNG format"""
-    try:
-        # Check if file is actually HEIF/HEIC
-        result = subprocess.run(
-            ['file', str(filepath)],
-            capture_output=True,
-            text=True
-        )
-        
-        if 'HEIF' in result.stdout or 'HEIC' in result.stdout:
-            # Convert using sips (macOS) or pillow-heif
-            output_path = filepath.with_suffix('.png')
-            
-            # Try sips first (macOS)
-            result = subprocess.run(
-                ['sips', '-s', 'format', 'png', str(filepath), '--out', str(output_path)],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode == 0 and output_path.exists():
-                # Remove original and rename converted file
-                filepath.unlink()
-                return output_path
-            
-            # Try PIL with pillow-heif if available
-            try:
-                img = Image.open(filepath)
-                output_path = filepath.with_suffix('.png')
-                img.save(output_path, 'PNG')
-                filepath.unlink()
-                return output_path
-            except Exception:
-                pass
-        
-        return filepath
-    except Exception as e:
-        # If conversion fails, return original filepath
-        return filepath
-
 def get_available_weights():
-    """Get list of available model weights"""
-    weights = []
-    
-    # Check for pre-trained weights
-    pretrained = BASE_DIR / 'yolov5s.pt'
-    if pretrained.exists():
-        weights.append({'name': 'YOLOv5s (Pre-trained)', 'path': str(pretrained)})
-    
-    # Check for custom trained weights
-    custom_path = BASE_DIR / 'yolov5' / 'runs' / 'train'
-    if custom_path.exists():
-        for exp_dir in custom_path.iterdir():
-            weights_file = exp_dir / 'weights' / 'best.pt'
-            if weights_file.exists():
-                weights.append({
-                    'name': f'Custom Model ({exp_dir.name})',
-                    'path': str(weights_file)
-                })
+    """Get list of available model weights (from the catalog, rescanned only when folders change)"""
+    weights = weights_catalog.entries()
     
     # Default yolov5s if no weights found
     if not weights:
@@ -179,24 +295,281 @@ def get_available_weights():
     
     return weights
 
+def backend_weights(weights_path, backend=None, imgsz=640):
+    """Model file to load for a backend, exported and cached next to the weights on first use"""
+    backend = backend or app.config['BACKEND']
+    if backend == backends.PYTORCH:
+        return warm_snapshot(weights_path) or weights_path
+    return str(backends.export(weights_path, backend, imgsz))
+
+def request_flag(data, key, default=False):
+    """On/off option of a JSON body or form: JSON booleans, or '1' / 'true' / 'yes' and '0' / 'false' / 'no'"""
+    value = data.get(key, default)
+    if isinstance(value, str):
+        return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+    return bool(value)
+
+def requested_backend(data):
+    """Backend named in a request (None: the configured default), ValueError for unknown names"""
+    backend = data.get('backend') or None
+    return backends.validate_backend(backend) if backend else None
+
+def warm_snapshot(weights_path):
+    """Pre-fused snapshot of these exact weights (matched by sha256), if one was built"""
+    entry = weights_catalog.get(weights_path)
+    if entry is None:
+        return None
+    path = snapshot_path(app.config['SNAPSHOT_FOLDER'], entry['sha256'])
+    return str(path) if path.exists() else None
+
+def most_used_weights(limit):
+    """Weights with the most indexed sources, for pre-warming (yolov5s.pt when nothing is recorded)"""
+    chosen = []
+    for row in detection_index.weights_usage():
+        path = resolve_weights_path(row['weights'])
+        if Path(path).exists() and path not in chosen:
+            chosen.append(path)
+        if len(chosen) >= limit:
+            break
+    return chosen or [resolve_weights_path('yolov5s.pt')]
+
+def weights_label(weights_path):
+    """Weights as recorded in the detection index (relative to the app when possible)"""
+    try:
+        return str(Path(weights_path).resolve().relative_to(BASE_DIR.resolve()))
+    except ValueError:
+        return str(weights_path)
+
+def submit_video_job(filepath, weights_path, imgsz, conf_thres, vid_stride=1, detect_every=1, save_labels=False,
+                     backend=None, track=True, track_iou=0.3, track_max_age=30, track_min_hits=3):
+    """Queue video detection on the job pool, results go to results/detect_<timestamp>_<job>"""
+    is_coco_model = is_coco_weights(weights_path)
+    names = model_names(weights_path)
+    params = {'filename': filepath.name, 'weights': weights_path, 'imgsz': imgsz, 'conf_thres': conf_thres,
+              'vid_stride': vid_stride, 'detect_every': detect_every, 'backend': backend, 'track': track}
+    weights = weights_label(weights_path)
+
+    def run(job):
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        dir_name = f"detect_{timestamp}_{job.id[:6]}"
+        result_dir = app.config['RESULTS_FOLDER'] / dir_name
+        # Cancelled jobs don't leave partial output (or index rows) behind
+        job.on_cancel(lambda: shutil.rmtree(result_dir, ignore_errors=True))
+        job.on_cancel(lambda: detection_index.remove_source(filepath.name, weights))
+        job.uses(dir_name)
+        detection_index.begin_source(filepath.name, weights, 'video')
+
+        def formatter(det, shape, frame):
+            rows = format_detections(det, shape, is_coco_model, frame, names)
+            detection_index.add(filepath.name, rows, weights)
+            return rows
+
+        tracker = None
+        if track:
+            # COCO weights: every class is reported as Fish, so match tracks across classes
+            tracker = Tracker(iou_thres=track_iou, max_age=track_max_age, min_hits=track_min_hits,
+                              names={c: 'Fish' for c in COCO_CLASS_NAMES} if is_coco_model else names,
+                              class_aware=not is_coco_model)
+
+        video = run_video_detection(
+            job, model_registry, backend_weights(weights_path, backend, imgsz), filepath, result_dir / 'result',
+            imgsz=imgsz, conf_thres=conf_thres, vid_stride=vid_stride, detect_every=detect_every,
+            save_labels=save_labels, formatter=formatter, tracker=tracker
+        )
+        # Moov atom first (and H.264 with ffmpeg) so the browser can play while downloading
+        streamable = make_streamable(video['save_path'], app.config['FFMPEG'])
+        result_file = video['save_path'].name
+        result = {
+            'success': True,
+            'result_file': result_file,
+            'result_path': f"{dir_name}/result/{result_file}",
+            'type': 'video',
+            'frames': video['frames'],
+            'output_fps': video['output_fps'],
+            'streamable': streamable,
+            'detection_count': job.detections_dropped + len(job.detections),
+            'summary': job.summarize(),
+            'model_type': 'coco' if is_coco_model else 'fish'
+        }
+        if 'tracking' in video:
+            # detection_count counts a fish again on every frame, unique_count once per track
+            result['unique_count'] = video['tracking']['unique_count']
+            result['unique_counts'] = video['tracking']['unique_counts']
+            result['tracks'] = video['tracking']['tracks']
+            result['tracks_truncated'] = video['tracking']['tracks_truncated']
+        return result
+
+    return job_manager.submit('video_detect', run, params, files=(filepath.name,))
+
+def video_job_options(data):
+    """Optional video job settings from a /api/detect or /api/jobs body"""
+    return {
+        'vid_stride': int(data.get('vid_stride', 1)),
+        'detect_every': int(data.get('detect_every', 1)),
+        'save_labels': request_flag(data, 'save_labels'),
+        'backend': requested_backend(data),
+        'track': request_flag(data, 'track', True),
+        'track_iou': float(data.get('track_iou', 0.3)),
+        'track_max_age': int(data.get('track_max_age', 30)),
+        'track_min_hits': int(data.get('track_min_hits', 3)),
+    }
+
+def unique_upload_path(target_dir, name):
+    """target_dir/<name> made safe (each directory kept), numbered when a different file already took it"""
+    parts = [secure_filename(part) for part in Path(name.replace('\\', '/')).parts]
+    parts = [part for part in parts if part]
+    if not parts:
+        return None
+    path = target_dir.joinpath(*parts)
+    n = 1
+    while path.exists():
+        path = path.with_name(f'{Path(parts[-1]).stem}_{n}{Path(parts[-1]).suffix}')
+        n += 1
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+def extract_bulk_upload(files, target_dir):
+    """Save uploaded images and image members of zip archives into target_dir, returns the count"""
+    target_dir.mkdir(parents=True, exist_ok=True)
+    saved = 0
+    extracted_bytes = 0
+    for file in files:
+        filename = secure_filename(file.filename or '')
+        if filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or Path(member.filename).suffix.lower() not in IMAGE_EXTENSIONS:
+                        continue
+                    extracted_bytes += member.file_size
+                    if extracted_bytes > app.config['BULK_MAX_EXTRACT_BYTES']:
+                        raise ValueError('Archive too large when extracted')
+                    # The archive's folders are kept (results are reported per relative path);
+                    # names that collide after sanitizing, or across archives, are numbered
+                    target = unique_upload_path(target_dir, member.filename)
+                    if target is None:
+                        continue
+                    with archive.open(member) as src, open(target, 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+                    saved += 1
+        elif Path(filename).suffix.lower() in IMAGE_EXTENSIONS:
+            file.save(unique_upload_path(target_dir, filename))
+            saved += 1
+    return saved
+
+def submit_bulk_job(source_dir, weights_path, imgsz, conf_thres, batch_size=16, backend=None):
+    """Queue bulk detection of every image in source_dir, output goes to results/<source_dir name>/"""
+    is_coco_model = is_coco_weights(weights_path)
+    names = model_names(weights_path)
+    dir_name = source_dir.name
+    output = app.config['RESULTS_FOLDER'] / dir_name / 'detections.jsonl'
+    params = {'source': dir_name, 'weights': weights_path, 'imgsz': imgsz, 'conf_thres': conf_thres,
+              'backend': backend}
+
+    weights = weights_label(weights_path)
+
+    def index_record(record):
+        name = f"{dir_name}/{record['source']}"
+        detection_index.begin_source(name, weights, 'image', record.get('width'), record.get('height'))
+        detection_index.add(name, record.get('detections'), weights)
+
+    def run(job):
+        summary = run_bulk(
+            iter_images(source_dir), model_registry, backend_weights(weights_path, backend, imgsz), output,
+            root=source_dir,
+            imgsz=imgsz, conf_thres=conf_thres, batch_size=batch_size,
+            formatter=lambda det, shape: format_detections(det, shape, is_coco_model, names=names), job=job,
+            on_record=index_record
+        )
+        return {
+            'success': True,
+            'type': 'bulk',
+            'result_file': output.name,
+            'result_path': f"{dir_name}/{output.name}",
+            'images': summary['images'],
+            'skipped_done': summary['skipped_done'],
+            'detection_count': sum(summary['class_counts'].values()),
+            'summary': job.summarize(),
+            'model_type': 'coco' if is_coco_model else 'fish'
+        }
+
+    # The bulk id names both the extracted upload and the results directory
+    return job_manager.submit('bulk_detect', run, params, files=(dir_name,))
+
+@app.before_request
+def start_warmup():
+    # No-op once warm (also in workers forked from a master that ran it)
+    warmup.start()
+
+@app.before_request
+def start_storage_sweeper():
+    # Started on first use so it runs in each serving process (threads don't survive the pre-fork)
+    storage_manager.start()
+
+@app.before_request
+def start_metrics_flusher():
+    # Idle workers keep their snapshot current for whichever worker answers /metrics
+    metrics.start()
+
+@app.before_request
+def start_trace():
+    g.request_started = time.perf_counter()
+    if request.endpoint in TRACED_ENDPOINTS:
+        g.trace = Trace(request.endpoint, request.headers.get('X-Trace-Id'))
+
+def trace_stage(name):
+    """Time a stage of the current request (no-op outside traced endpoints)"""
+    trace = g.get('trace')
+    return trace.stage(name) if trace is not None else nullcontext()
+
+def trace_requested():
+    if 'X-Trace-Id' in request.headers or request.args.get('trace') in ('1', 'true'):
+        return True
+    body = request.get_json(silent=True) if request.is_json else None
+    return isinstance(body, dict) and bool(body.get('trace'))
+
+@app.after_request
+def finish_trace(response):
+    started = g.get('request_started')
+    if started is not None and request.endpoint not in (None, 'static', 'get_metrics'):
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint,
+                                status=response.status_code)
+    trace = g.get('trace')
+    if trace is not None:
+        trace.finish(STAGE_SECONDS)
+        if trace_requested():
+            # Stage breakdown in the response, the id lets logs be correlated with the client
+            response.headers['X-Trace-Id'] = trace.id
+            payload = response.get_json(silent=True) if response.is_json else None
+            if isinstance(payload, dict):
+                payload['trace'] = trace.to_dict()
+                response.set_data(json.dumps(payload))
+    return response
+
 @app.route('/')
 def index():
     """Main page"""
-    return render_template('index.html')
+    # Live streams are held in one worker's memory, see /api/live
+    return render_template('index.html', live_enabled=app.config['SERVER_WORKERS'] == 1)
 
 @app.route('/api/weights', methods=['GET'])
 def get_weights():
-    """Get available model weights"""
+    """Get available model weights with class names, input size, parameter count and usage"""
     weights = get_available_weights()
-    return jsonify({'weights': weights})
+    usage = {resolve_weights_path(row['weights']): row['sources'] for row in detection_index.weights_usage()}
+    for entry in weights:
+        entry['sources_detected'] = usage.get(entry['path'], 0)
+    return jsonify({'weights': weights, 'catalog': weights_catalog.stats()})
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """Handle file upload"""
-    if 'file' not in request.files:
+    # Parsing the body streams image parts into pooled buffers (UploadRequest)
+    with trace_stage('read'):
+        files = request.files
+    if 'file' not in files:
         return jsonify({'error': 'No file provided'}), 400
     
-    file = request.files['file']
+    file = files['file']
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
@@ -206,26 +579,67 @@ def upload_file():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         name, ext = filename.rsplit('.', 1)
         filename = f"{name}_{timestamp}.{ext}"
-        
-        # Save file
         filepath = app.config['UPLOAD_FOLDER'] / filename
-        file.save(filepath)
         
-        # Convert HEIF/HEIC files to PNG
-        if is_image_file(filename):
-            converted_path = convert_heif_to_png(filepath)
-            if converted_path != filepath:
-                # Update filename if converted
-                filename = converted_path.name
-                filepath = converted_path
+        # Videos are decoded from disk by OpenCV, stream them straight to a file
+        if is_video_file(filename):
+            with trace_stage('save'):
+                file.save(filepath)
+            return jsonify({
+                'success': True,
+                'filename': filename,
+                'filepath': str(filepath),
+                'type': 'video'
+            })
         
-        file_type = 'image' if is_image_file(filename) else 'video'
+        # Images: already in a pooled buffer (UploadRequest), sniff and decode in memory
+        persist = request_flag(request.form, 'persist', app.config['PERSIST_UPLOADS'])
+        # The decoded upload only lives in this worker's memory: with several workers the detect
+        # may land on another one, so the original is always written to the shared uploads folder
+        persist = persist or app.config['SERVER_WORKERS'] > 1
+        buf = None
+        try:
+            if isinstance(file.stream, PooledFile):
+                view = file.stream.getbuffer()
+            else:
+                buf = upload_buffers.acquire()
+                buf, size = upload_buffers.read_stream(file.stream, buf)
+                view = memoryview(buf)[:size]
+            with view as data:
+                with trace_stage('sniff'):
+                    fmt = sniff_format(data[:16])
+                if fmt in VIDEO_FORMATS or (fmt is None and len(data) == 0):
+                    return jsonify({'error': 'Invalid file type'}), 400
+                try:
+                    with trace_stage('decode'):
+                        img0 = decode_image(data, fmt)
+                except ValueError as e:
+                    return jsonify({'error': f'Image file not readable: {str(e)}'}), 400
+                
+                # HEIF/HEIC is stored as PNG so browsers and OpenCV can read it back
+                with trace_stage('persist'):
+                    if fmt == 'heif':
+                        filename = f"{name}_{timestamp}.png"
+                        filepath = filepath.with_name(filename)
+                        if persist:
+                            cv2.imwrite(str(filepath), img0)
+                    elif persist:
+                        with open(filepath, 'wb') as f:
+                            f.write(data)
+                with trace_stage('hash'):
+                    content_hash = hash_bytes(data)
+                upload_store.put(filename, img0, content_hash, fmt)
+        finally:
+            if buf is not None:
+                upload_buffers.release(buf)
         
         return jsonify({
             'success': True,
             'filename': filename,
-            'filepath': str(filepath),
-            'type': file_type
+            'filepath': str(filepath) if persist else None,
+            'format': fmt,
+            'persisted': persist,
+            'type': 'image'
         })
     
     return jsonify({'error': 'Invalid file type'}), 400
@@ -242,242 +656,568 @@ def detect():
         
         if not filename:
             return jsonify({'error': 'No filename provided'}), 400
+        try:
+            backend = requested_backend(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Get file path
+        # Get file path (images may only exist decoded in memory)
         filepath = app.config['UPLOAD_FOLDER'] / filename
-        if not filepath.exists():
+        stored = upload_store.get(filename)
+        if stored is None and not filepath.exists():
             return jsonify({'error': 'File not found'}), 404
         
         # Determine if image or video
         is_image = is_image_file(filename)
         
-        # Create unique result directory
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        result_dir = app.config['RESULTS_FOLDER'] / f"detect_{timestamp}"
-        result_dir.mkdir(exist_ok=True)
-        
         # Resolve weights path
-        if not Path(weights_path).is_absolute():
-            # Try relative paths
-            if Path(weights_path).exists():
-                weights_path = str(Path(weights_path).resolve())
-            elif (BASE_DIR / weights_path).exists():
-                weights_path = str((BASE_DIR / weights_path).resolve())
-            else:
-                # Use yolov5 default
-                weights_path = str(BASE_DIR / 'yolov5' / weights_path)
+        weights_path = resolve_weights_path(weights_path)
+        
+        # Videos run as a background job, poll /api/jobs/<job_id> for progress
+        if not is_image:
+            job = submit_video_job(filepath, weights_path, imgsz, conf_thres, **video_job_options(data))
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/api/jobs/{job.id}',
+                'type': 'video'
+            }), 202
         
-        # Run YOLOv5 detection using subprocess
+        # Exported TorchScript/ONNX model for the selected backend (cached next to the weights)
         try:
-            yolov5_dir = BASE_DIR / 'yolov5'
-            detect_script = yolov5_dir / 'detect.py'
-            
-            # Build command
-            # Check if custom data.yaml exists for 2-class detection
-            data_yaml = BASE_DIR / 'data_fish_notfish.yaml'
-            cmd = [
-                sys.executable,
-                str(detect_script),
-                '--weights', weights_path,
-                '--source', str(filepath),
-                '--img', str(imgsz),
-                '--conf', str(conf_thres),
-                '--project', str(result_dir),
-                '--name', 'result',
-                '--exist-ok',
-                '--save-conf',
-                '--save-txt',  # Save label files for parsing detections
-                '--hide-labels'  # Hide COCO labels on image (we'll show Fish/notFish in UI)
-            ]
-            # Add data.yaml if it exists
-            if data_yaml.exists():
-                cmd.extend(['--data', str(data_yaml)])
-            
-            # Run detection
-            result = subprocess.run(
-                cmd,
-                cwd=str(yolov5_dir),
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
-            )
-            
-            if result.returncode != 0:
-                error_msg = result.stderr or result.stdout
-                # Provide more helpful error messages
-                if 'Image Not Found' in error_msg:
-                    return jsonify({
-                        'error': f'Image file not readable. The file might be corrupted or in an unsupported format. Error: {error_msg[:300]}'
-                    }), 500
-                return jsonify({'error': f'Detection failed: {error_msg[:500]}'}), 500
-                
-        except subprocess.TimeoutExpired:
-            return jsonify({'error': 'Detection timeout - file mungkin terlalu besar'}), 500
+            with trace_stage('backend'):
+                model_path = backend_weights(weights_path, backend, imgsz)
         except Exception as e:
-            return jsonify({'error': f'Detection failed: {str(e)}'}), 500
-        
-        # Find result file
-        result_file = None
-        # YOLOv5 saves to: project/name/ (not project/name/result/)
-        # So result_path should be result_dir itself when --name is used
-        result_path = result_dir / 'result'
-        # But YOLOv5 might save directly to result_dir if structure is different
-        # Check both locations
-        alt_result_path = result_dir
-        
-        # Get source image name (YOLOv5 uses original filename, not uploaded filename)
-        source_image_name = Path(filepath).name
-        
-        if is_image:
-            # For images, look for the processed image in both locations
-            search_paths = [result_path, alt_result_path]
-            for search_path in search_paths:
-                for ext in ['.jpg', '.jpeg', '.png']:
-                    base_name = source_image_name.rsplit('.', 1)[0]
-                    test_file = search_path / f"{base_name}{ext}"
-                    if test_file.exists():
-                        result_file = test_file
-                        break
-                    test_file = search_path / source_image_name
-                    if test_file.exists():
-                        result_file = test_file
-                        break
-                if result_file:
-                    break
-            # Also check uploaded filename
-            if not result_file:
-                for search_path in [result_path, alt_result_path]:
-                    for ext in ['.jpg', '.jpeg', '.png']:
-                        base_name = filename.rsplit('.', 1)[0]
-                        test_file = search_path / f"{base_name}{ext}"
-                        if test_file.exists():
-                            result_file = test_file
-                            break
-                    if result_file:
-                        break
-        else:
-            # For videos, look for processed video
-            for ext in ['.mp4', '.avi', '.mov']:
-                base_name = source_image_name.rsplit('.', 1)[0]
-                test_file = result_path / f"{base_name}{ext}"
-                if test_file.exists():
-                    result_file = test_file
-                    break
-                if not result_file and (result_path / source_image_name).exists():
-                    result_file = result_path / source_image_name
+            return jsonify({'error': f'Backend export failed: {str(e)}'}), 500
         
-        # Fallback: check if any file exists in result directories
-        if not result_file:
-            for search_path in [result_path, alt_result_path]:
-                if search_path.exists():
-                    files = list(search_path.glob('*'))
-                    # Filter out directories
-                    files = [f for f in files if f.is_file()]
-                    if files:
-                        result_file = files[0]
-                        break
+        # Same file + weights + imgsz + NMS settings: serve from the result cache
+        iou_thres = float(data.get('iou_thres', 0.45))
+        max_det = int(data.get('max_det', 1000))
+        # Tiled mode: overlapping full-resolution tiles for large frames with small fish
+        tiled = request_flag(data, 'tiled')
+        tile_size = int(data.get('tile_size', app.config['TILE_SIZE']))
+        tile_overlap = float(data.get('tile_overlap', app.config['TILE_OVERLAP']))
+        max_tiles_per_batch = int(data.get('max_tiles_per_batch', app.config['MAX_TILES_PER_BATCH']))
+        if tiled and not (0 <= tile_overlap < 1 and tile_size >= 32 and max_tiles_per_batch >= 1):
+            return jsonify({'error': 'tile_overlap must be in [0, 1), tile_size >= 32, max_tiles_per_batch >= 1'}), 400
+        with trace_stage('hash'):
+            content_hash = stored.content_hash if stored else hash_file(filepath)
+        with trace_stage('cache_lookup'):
+            cache_key = result_cache.make_key(content_hash, model_path, imgsz, iou_thres, max_det,
+                                              mode=f'tiled:{tile_size}:{tile_overlap}' if tiled else '')
+            cached = result_cache.get(cache_key, conf_thres)
         
-        if not result_file or not result_file.exists():
-            return jsonify({'error': 'Result file not found after detection'}), 500
+        # Annotated media is written by default (the UI shows it), labels only on request
+        save_media = request_flag(data, 'save_media', True)
+        save_labels = request_flag(data, 'save_labels')
+        name = filepath.name if filepath.suffix.lower() in ('.jpg', '.jpeg', '.png') else filepath.stem + '.jpg'
         
-        # Get relative path for serving
-        result_filename = result_file.name
-        result_relative_path = f"detect_{timestamp}/result/{result_filename}"
-        
-        # Parse detection results if available
-        # YOLOv5 saves labels with SOURCE filename, not uploaded filename!
-        detections = []
-        
-        # Try multiple possible locations for label files
-        # YOLOv5 structure: project/name/labels/source_filename.txt
-        possible_label_paths = [
-            result_path / 'labels' / (Path(source_image_name).stem + '.txt'),
-            alt_result_path / 'labels' / (Path(source_image_name).stem + '.txt'),
-            result_path / 'labels' / (Path(filename).stem + '.txt'),
-            alt_result_path / 'labels' / (Path(filename).stem + '.txt'),
-        ]
-        
-        txt_file = None
-        for path in possible_label_paths:
-            if path.exists():
-                txt_file = path
-                break
+        try:
+            if cached:
+                # Only the threshold changed (or nothing did): re-filter cached predictions
+                det = cached.filter(conf_thres)
+                timings = {'cache': 'hit' if conf_thres in cached.result_dirs else 'refilter'}
+                img0 = stored.image if stored else None
+            else:
+                # Images run in-process on a warm model
+                with trace_stage('load_image'):
+                    img0 = stored.image if stored else load_image(filepath)
+                floor = min(conf_thres, result_cache.conf_floor)
+                if tiled:
+                    # Tiles are already a batch, they bypass the micro-batcher
+                    # Traced TorchScript only takes imgsz: tiles are scaled to it
+                    det, timings = run_tiled(model_registry, model_path, img0, tile_size=tile_size,
+                                             overlap=tile_overlap, max_tiles_per_batch=max_tiles_per_batch,
+                                             conf_thres=floor, iou_thres=iou_thres, max_det=max_det,
+                                             imgsz=imgsz,
+                                             input_size=backends.fixed_input_size(backend or app.config['BACKEND'],
+                                                                                  imgsz))
+                else:
+                    det, timings = batcher.detect(model_path, img0, imgsz=imgsz, conf_thres=floor,
+                                                  iou_thres=iou_thres, max_det=max_det)
+                if g.get('trace') is not None:
+                    g.trace.record_timings(timings)
+                with trace_stage('cache_store'):
+                    cached = result_cache.put(cache_key, det, floor, img0.shape)
+                # Indexed at the floor threshold so index queries can filter on confidence
+                detection_index.begin_source(filename, weights_label(weights_path), 'image',
+                                             img0.shape[1], img0.shape[0])
+                detection_index.add(filename, format_detections(det, img0.shape, is_coco_weights(weights_path),
+                                                                names=model_names(weights_path)),
+                                    weights_label(weights_path))
+                det = cached.filter(conf_thres)
+                timings['cache'] = 'miss'
+            DETECT_CACHE.inc(result=timings['cache'])
+        except ValueError as e:
+            return jsonify({
+                'error': f'Image file not readable. The file might be corrupted or in an unsupported format. Error: {str(e)[:300]}'
+            }), 500
+        except Exception as e:
+            return jsonify({'error': f'Detection failed: {str(e)}'}), 500
         
-        # Check if we're using COCO model (yolov5s.pt) or custom fish model
-        is_coco_model = 'yolov5s.pt' in str(weights_path).lower() or 'yolov5' in str(weights_path).lower()
+        result_relative_path = None
+        if save_media or save_labels:
+            # Same threshold as before and its output still exists: reuse the result directory
+            result_dir_name = cached.result_dirs.get(conf_thres)
+            if not result_dir_name or not (app.config['RESULTS_FOLDER'] / result_dir_name).exists():
+                # Create unique result directory
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                result_dir_name = f"detect_{timestamp}"
+                result_dir = app.config['RESULTS_FOLDER'] / result_dir_name / 'result'
+                result_dir.mkdir(parents=True, exist_ok=True)
+                # From checkpoint metadata: a cache hit must not load an evicted model just for its names
+                names = model_names(weights_path)
+                # Written in the background, /api/results waits for pending writes
+                with trace_stage('output_submit'):
+                    output_writer.submit(
+                        result_dir / name, save_detection_outputs,
+                        img0 if img0 is not None else filepath, det, names, result_dir, name,
+                        save_media=save_media, save_labels=save_labels
+                    )
+                if save_media:
+                    cached.result_dirs[conf_thres] = result_dir_name
+            result_relative_path = f"{result_dir_name}/result/{name}"
         
-        if txt_file.exists():
-            # Parse YOLO format: class x_center y_center width height confidence
-            with open(txt_file, 'r') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) >= 5:
-                        class_id = int(parts[0])
-                        confidence = float(parts[5]) if len(parts) > 5 else float(parts[4])
-                        
-                        if is_coco_model:
-                            # Using COCO model - convert all to Fish (potential fish)
-                            # All objects are considered potential fish
-                            coco_class_name = COCO_CLASS_NAMES.get(class_id, f'class_{class_id}')
-                            detections.append({
-                                'class': 0,  # Map to Fish (potential fish)
-                                'class_name': 'Fish',
-                                'original_detection': coco_class_name,
-                                'original_coco_id': class_id,
-                                'confidence': confidence,
-                                'bbox': [float(x) for x in parts[1:5]],
-                                'is_coco': True
-                            })
-                        else:
-                            # Using custom fish model
-                            detections.append({
-                                'class': class_id,
-                                'class_name': CLASS_NAMES.get(class_id, f'Class_{class_id}'),
-                                'confidence': confidence,
-                                'bbox': [float(x) for x in parts[1:5]],
-                                'is_coco': False
-                            })
+        is_coco_model = is_coco_weights(weights_path)
+        with trace_stage('format'):
+            detections = format_detections(det, cached.shape, is_coco_model, names=model_names(weights_path))
         
+        warmup.mark_first_detection()
         return jsonify({
             'success': True,
-            'result_file': result_filename,
-            'result_path': result_relative_path,
-            'type': 'image' if is_image else 'video',
+            'result_file': name if save_media else None,
+            'result_path': result_relative_path if save_media else None,
+            'type': 'image',
             'detections': detections,
             'detection_count': len(detections),
-            'model_type': 'coco' if is_coco_model else 'fish'
+            'model_type': 'coco' if is_coco_model else 'fish',
+            'timings': timings
         })
     
     except Exception as e:
         import traceback
         return jsonify({'error': f'Server error: {str(e)}\n{traceback.format_exc()}'}), 500
 
+def send_media(directory, filename, max_age=None):
+    """File response with ETag / If-None-Match and Range support (video seeking)"""
+    return send_from_directory(str(directory), filename, conditional=True, etag=True,
+                               max_age=app.config['MEDIA_MAX_AGE'] if max_age is None else max_age)
+
+def send_variant(path):
+    """?size=thumb|preview of an image or video file, None when no size was asked for"""
+    size = request.args.get('size')
+    if not size:
+        return None
+    try:
+        variant = media_cache.variant_of_file(path, size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if variant is None:
+        return jsonify({'error': 'Preview not available'}), 415
+    # Names change with the source's size / mtime, so they can be cached for long
+    return send_media(variant.parent, variant.name, max_age=86400)
+
 @app.route('/api/results/<path:filename>')
 def get_result(filename):
-    """Serve result files"""
+    """Serve result files (?size=thumb|preview for a downscaled JPEG)"""
     # Security: only allow files from results folder
     result_path = app.config['RESULTS_FOLDER'] / filename
+    # The annotated file may still be in the background writer
+    output_writer.wait(result_path, timeout=30)
+    # ...or compacted into results/archive by the storage sweeper
+    if not result_path.exists() and Path(filename).parts:
+        storage_manager.restore(Path(filename).parts[0])
+    # ...or in the writer of another worker process that ran the detection (missing files 404 right away)
+    deadline = time.monotonic() + 10
+    while not result_path.exists() and output_writer.in_progress(result_path) and time.monotonic() < deadline:
+        time.sleep(0.05)
     if result_path.exists() and app.config['RESULTS_FOLDER'] in result_path.parents:
-        return send_from_directory(str(result_path.parent), result_path.name)
+        storage_manager.touch(result_path)
+        variant = send_variant(result_path)
+        return variant if variant is not None else send_media(result_path.parent, result_path.name)
     return jsonify({'error': 'File not found'}), 404
 
 @app.route('/api/uploads/<filename>')
 def get_upload(filename):
-    """Serve uploaded files"""
+    """Serve uploaded files (?size=thumb|preview for a downscaled JPEG)"""
     filepath = app.config['UPLOAD_FOLDER'] / filename
     if filepath.exists():
-        return send_from_directory(str(app.config['UPLOAD_FOLDER']), filename)
+        storage_manager.touch(filepath)
+        variant = send_variant(filepath)
+        return variant if variant is not None else send_media(app.config['UPLOAD_FOLDER'], filename)
+    # Not persisted: encode the in-memory copy
+    stored = upload_store.get(secure_filename(filename))
+    if stored is not None:
+        size = request.args.get('size')
+        if size:
+            try:
+                variant = media_cache.variant_of_array(stored.image, stored.content_hash, size)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if variant is not None:
+                return send_media(variant.parent, variant.name, max_age=86400)
+        ok, encoded = cv2.imencode('.png', stored.image)
+        if ok:
+            response = Response(encoded.tobytes(), mimetype='image/png')
+            response.set_etag(stored.content_hash)
+            return response.make_conditional(request)
     return jsonify({'error': 'File not found'}), 404
 
+@app.route('/api/models', methods=['GET'])
+def get_models():
+    """Loaded models with cold (first load + inference) vs warm latency"""
+    return jsonify(model_registry.stats())
+
+@app.route('/api/models/warm', methods=['POST'])
+def warm_model():
+    """Load a model into the registry ahead of the first detection"""
+    data = request.get_json(silent=True) or {}
+    weights_path = resolve_weights_path(data.get('weights', 'yolov5s.pt'))
+    try:
+        model_registry.get(weights_path)
+    except Exception as e:
+        return jsonify({'error': f'Failed to load model: {str(e)}'}), 500
+    return jsonify(model_registry.stats())
+
+@app.route('/api/backends', methods=['GET', 'POST'])
+def inference_backends():
+    """Exported backends and the last accuracy/latency report; POST exports a backend"""
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    weights_path = resolve_weights_path(data.get('weights', 'yolov5s.pt'))
+    imgsz = int(data.get('imgsz', 640))
+    if request.method == 'POST':
+        try:
+            backend = requested_backend(data) or backends.ONNX
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            backend_weights(weights_path, backend, imgsz)
+        except Exception as e:
+            return jsonify({'error': f'Backend export failed: {str(e)}'}), 500
+    return jsonify({
+        'default_backend': app.config['BACKEND'],
+        'backends': list(backends.BACKENDS),
+        'imgsz': imgsz,
+        'exported': backends.available_artifacts(weights_path, imgsz),
+        'report': backends.load_report(weights_path)
+    })
+
+@app.route('/api/batching', methods=['GET', 'POST'])
+def batching_stats():
+    """Micro-batching throughput / p99 latency; POST changes batch size and max wait"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        batcher.configure(max_batch_size=data.get('max_batch_size'), max_wait_ms=data.get('max_wait_ms'))
+        if data.get('reset_stats'):
+            batcher.reset_stats()
+    return jsonify(batcher.stats())
+
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    """Result cache hit/miss counters and sizes, plus the thumbnail / preview cache"""
+    return jsonify({**result_cache.stats(), 'media': media_cache.stats()})
+
+def index_filters(args):
+    """Detection index filters from query parameters"""
+    frame_min = args.get('frame_min', type=int)
+    frame_max = args.get('frame_max', type=int)
+    region = args.get('bbox')
+    if region:
+        region = [float(v) for v in region.split(',')]
+        if len(region) != 4:
+            raise ValueError('bbox must be x1,y1,x2,y2 (normalized)')
+    return {
+        'sources': args.getlist('source') or None,
+        'class_name': args.get('class'),
+        'min_conf': args.get('min_conf', type=float),
+        'max_conf': args.get('max_conf', type=float),
+        'frame_min': frame_min,
+        'frame_max': frame_max,
+        'region': region,
+        'weights': args.get('weights'),
+    }
+
+@app.route('/api/index/detections', methods=['GET'])
+def index_detections():
+    """Indexed detections, e.g. ?class=Fish&min_conf=0.7&source=a.mp4&source=b.mp4&frame_min=100&frame_max=500"""
+    try:
+        filters = index_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(request.args.get('limit', 100, type=int), 10000)
+    offset = request.args.get('offset', 0, type=int)
+    detection_index.flush(timeout=5)  # include detections of the request that just finished
+    t0 = time.perf_counter()
+    rows = detection_index.query(limit=limit, offset=offset, order=request.args.get('order', 'source'), **filters)
+    return jsonify({'detections': rows, 'count': len(rows), 'limit': limit, 'offset': offset,
+                    'next_offset': offset + len(rows) if len(rows) == limit else None,
+                    'query_ms': (time.perf_counter() - t0) * 1000})
+
+@app.route('/api/index/aggregate', methods=['GET'])
+def index_aggregate():
+    """Counts and mean confidence, ?group_by=source,class|frame_bucket&bucket_size=100 plus the same filters"""
+    try:
+        filters = index_filters(request.args)
+        group_by = [field for field in request.args.get('group_by', 'class').split(',') if field]
+        detection_index.flush(timeout=5)
+        t0 = time.perf_counter()
+        groups = detection_index.aggregate(group_by, request.args.get('bucket_size', 100, type=int), **filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'groups': groups, 'total': sum(group['count'] for group in groups),
+                    'query_ms': (time.perf_counter() - t0) * 1000})
+
+@app.route('/api/index', methods=['GET'])
+def index_stats():
+    """Indexed sources and index size"""
+    return jsonify({**detection_index.stats(),
+                    'recent_sources': detection_index.sources(request.args.get('limit', 50, type=int))})
+
+@app.route('/api/storage', methods=['GET', 'POST'])
+def storage():
+    """Disk usage of uploads / results / archives; POST runs a sweep now (dry_run=true to preview)"""
+    if request.method == 'GET':
+        return jsonify(storage_manager.stats())
+    data = request.get_json(silent=True) or {}
+    report = storage_manager.sweep(dry_run=request_flag(data, 'dry_run'))
+    if 'skipped' in report:
+        return jsonify({'error': report['skipped']}), 409
+    return jsonify(report)
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def jobs():
+    """List jobs, or start a video detection job (same body as /api/detect)"""
+    if request.method == 'GET':
+        return jsonify({'jobs': [job.to_dict(include_detections=False) for job in job_manager.list()]})
+    
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename')
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
+    filepath = app.config['UPLOAD_FOLDER'] / filename
+    if not filepath.exists():
+        return jsonify({'error': 'File not found'}), 404
+    if not is_video_file(filename):
+        return jsonify({'error': 'Jobs are only supported for video files'}), 400
+    try:
+        options = video_job_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job = submit_video_job(
+        filepath,
+        resolve_weights_path(data.get('weights', 'yolov5s.pt')),
+        int(data.get('imgsz', 640)),
+        float(data.get('conf_thres', 0.4)),
+        **options
+    )
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.status,
+                    'status_url': f'/api/jobs/{job.id}'}), 202
+
+@app.route('/api/bulk', methods=['POST'])
+def bulk_detect():
+    """
+    Bulk detection of a zip archive and/or several image files ('files' form field)
+    Send resume=<bulk_id> instead of files to continue an interrupted run
+    """
+    try:
+        backend = requested_backend(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    resume = request.form.get('resume')
+    if resume:
+        source_dir = app.config['UPLOAD_FOLDER'] / secure_filename(resume)
+        if not resume.startswith('bulk_') or not source_dir.is_dir():
+            return jsonify({'error': 'Bulk upload not found'}), 404
+    else:
+        files = request.files.getlist('files') or request.files.getlist('file')
+        if not files:
+            return jsonify({'error': 'No file provided'}), 400
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        source_dir = app.config['UPLOAD_FOLDER'] / f"bulk_{timestamp}_{os.urandom(3).hex()}"
+        try:
+            count = extract_bulk_upload(files, source_dir)
+        except (zipfile.BadZipFile, ValueError) as e:
+            shutil.rmtree(source_dir, ignore_errors=True)
+            return jsonify({'error': f'Invalid archive: {str(e)}'}), 400
+        if not count:
+            shutil.rmtree(source_dir, ignore_errors=True)
+            return jsonify({'error': 'No images found in upload'}), 400
+    
+    job = submit_bulk_job(
+        source_dir,
+        resolve_weights_path(request.form.get('weights', 'yolov5s.pt')),
+        int(request.form.get('imgsz', 640)),
+        float(request.form.get('conf_thres', 0.4)),
+        batch_size=int(request.form.get('batch_size', 16)),
+        backend=backend
+    )
+    return jsonify({'success': True, 'bulk_id': source_dir.name, 'job_id': job.id, 'status': job.status,
+                    'status_url': f'/api/jobs/{job.id}'}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """Job progress (frames done, FPS, detections from ?since=N); DELETE cancels"""
+    if request.method == 'DELETE':
+        job = job_manager.cancel(job_id)
+    else:
+        job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    since = request.args.get('since', 0, type=int)
+    return jsonify(job.to_dict(since=since))
+
+def live_source(value):
+    """Device index, uploaded video played back as a stand-in camera, or rtsp/http(s) URL of an allowed host"""
+    value = str(value or '').strip()
+    if value.isdigit():
+        return value
+    if '://' in value:
+        url = urlsplit(value)
+        allowed = app.config['LIVE_ALLOWED_HOSTS']
+        if url.scheme.lower() not in ('rtsp', 'rtsps', 'http', 'https') or not url.hostname:
+            raise ValueError('Live URLs must be rtsp:// or http(s)://')
+        if '*' not in allowed and url.hostname.lower() not in allowed:
+            raise ValueError(f"Live source host '{url.hostname}' is not allowed (IKAN_LIVE_ALLOWED_HOSTS)")
+        return value
+    filepath = app.config['UPLOAD_FOLDER'] / secure_filename(value)
+    if value and is_video_file(value) and filepath.exists():
+        return str(filepath)
+    raise ValueError('Source must be a camera index, an uploaded video or a URL of an allowed host')
+
+def live_stream_or_404(stream_id):
+    stream = live_manager.get(stream_id)
+    if stream is None:
+        return None, (jsonify({'error': 'Live stream not found'}), 404)
+    return stream, None
+
+@app.route('/api/live', methods=['GET', 'POST'])
+def live_streams():
+    """List live streams, or start one on a camera / RTSP / MJPEG URL / uploaded video"""
+    if request.method == 'GET':
+        return jsonify({'streams': [s.stats() for s in live_manager.list()]})
+
+    if app.config['SERVER_WORKERS'] > 1:
+        # The stream lives in this worker's memory; MJPEG / events / latency requests would reach other workers
+        return jsonify({'error': f"Live streams need a single server worker (running up to "
+                                 f"{app.config['SERVER_WORKERS']}), start gunicorn with IKAN_LIVE=1 "
+                                 f"(or IKAN_WORKERS=1 and IKAN_AUTOSCALE=0)"}), 409
+    data = request.get_json(silent=True) or {}
+    try:
+        source = live_source(data.get('source'))
+        backend = requested_backend(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    weights_path = resolve_weights_path(data.get('weights', 'yolov5s.pt'))
+    imgsz = int(data.get('imgsz', 640))
+    conf_thres = float(data.get('conf_thres', 0.4))
+    is_coco_model = is_coco_weights(weights_path)
+    model_path = backend_weights(weights_path, backend, imgsz)
+
+    def detect(img0):
+        # Shares the micro-batcher with /api/detect, so live frames batch with image requests
+        return batcher.detect(model_path, img0, imgsz=imgsz, conf_thres=conf_thres)[0]
+
+    names = model_names(weights_path)
+
+    def formatter(det, shape, frame):
+        return format_detections(det, shape, is_coco_model, frame, names)
+
+    tracker = None
+    if request_flag(data, 'track', True):
+        tracker = Tracker(iou_thres=float(data.get('track_iou', 0.3)), max_age=int(data.get('track_max_age', 30)),
+                          min_hits=int(data.get('track_min_hits', 3)),
+                          names={c: 'Fish' for c in COCO_CLASS_NAMES} if is_coco_model else names,
+                          class_aware=not is_coco_model)
+    try:
+        stream = live_manager.start(LiveStream(source, detect, model_registry.get(model_path).names, formatter=formatter, tracker=tracker,
+                                               loop=request_flag(data, 'loop', True)))
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 429
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'stream_id': stream.id,
+                    'mjpeg_url': f'/api/live/{stream.id}/mjpeg',
+                    'events_url': f'/api/live/{stream.id}/events',
+                    'status_url': f'/api/live/{stream.id}'}), 201
+
+@app.route('/api/live/<stream_id>', methods=['GET', 'DELETE'])
+def live_stream_status(stream_id):
+    """Latency, FPS and drop rate of a live stream; DELETE stops it"""
+    stream, error = live_stream_or_404(stream_id)
+    if error:
+        return error
+    if request.method == 'DELETE':
+        stream.stop()
+    return jsonify(stream.stats())
+
+@app.route('/api/live/<stream_id>/mjpeg')
+def live_stream_mjpeg(stream_id):
+    """Annotated frames as multipart MJPEG (usable directly as an <img> src)"""
+    stream, error = live_stream_or_404(stream_id)
+    if error:
+        return error
+    return Response(stream.mjpeg(), mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-store'})
+
+@app.route('/api/live/<stream_id>/events')
+def live_stream_events(stream_id):
+    """Per-frame detections as server-sent events"""
+    stream, error = live_stream_or_404(stream_id)
+    if error:
+        return error
+    return Response(stream.events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/live/<stream_id>/latency', methods=['POST'])
+def live_stream_latency(stream_id):
+    """Client-measured event latency (capture -> detection event painted), in milliseconds"""
+    stream, error = live_stream_or_404(stream_id)
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    try:
+        stream.report_client_latency(float(data['latency_ms']))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'latency_ms required'}), 400
+    return jsonify({'success': True})
+
+@app.route('/api/workers', methods=['GET'])
+def get_workers():
+    """Serving processes with RSS / PSS / USS, shows how much model memory is shared"""
+    workers = worker_processes()
+    return jsonify({
+        'pid': os.getpid(),
+        'workers': workers,
+        'worker_count': sum(1 for w in workers if w['role'] != 'master'),
+        'torch_threads': sys.modules['torch'].get_num_threads() if 'torch' in sys.modules else None,
+        'models_loaded': model_registry.loaded_paths(),
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of request/stage latency, queues, cache and process stats"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Liveness: the process serves requests (doesn't wait for, or trigger, torch imports)"""
+    torch = sys.modules.get('torch')
     return jsonify({
         'status': 'healthy',
-        'pytorch': torch.__version__,
-        'cuda_available': torch.cuda.is_available()
+        'ready': warmup.ready,
+        'pytorch': torch.__version__ if torch else None,
+        'cuda_available': torch.cuda.is_available() if torch else None
     })
 
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness: warm-up done (torch imported, models loaded); 503 until then"""
+    status = warmup.status()
+    status['models_loaded'] = model_registry.loaded_paths()
+    return jsonify(status), 200 if status['ready'] else 503
+
 if __name__ == '__main__':
     import socket
     
@@ -505,4 +1245,7 @@ if __name__ == '__main__':
     print(f"📁 Upload folder: {app.config['UPLOAD_FOLDER']}")
     print(f"📁 Results folder: {app.config['RESULTS_FOLDER']}")
     print(f"🌐 Server running at http://0.0.0.0:{port}")
+    # Warm up in the background, the server accepts requests meanwhile
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warmup.start()
     app.run(debug=debug, host='0.0.0.0', port=port)
@@ -0,0 +1,193 @@
+"""
+Optimized CPU inference backends for IKAN Fish Detection
+Exports .pt weights to TorchScript or ONNX (optionally with dynamic INT8
+quantization), caches the artifacts next to the weights and measures the
+mAP / latency delta of each backend against the original weights
+
+Usage:
+    python backends.py export --weights yolov5s.pt --backend onnx-int8
+    python backends.py compare --weights runs/train/exp/weights/best.pt --data data_fish_notfish.yaml
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+
+from inference import YOLOV5_DIR
+
+PYTORCH = 'pytorch'
+TORCHSCRIPT = 'torchscript'
+ONNX = 'onnx'
+ONNX_INT8 = 'onnx-int8'
+BACKENDS = (PYTORCH, TORCHSCRIPT, ONNX, ONNX_INT8)
+
+# One export at a time, exports are CPU and memory heavy (re-entrant: INT8 exports ONNX first)
+_export_lock = threading.RLock()
+
+
+def validate_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend} (choose from {", ".join(BACKENDS)})')
+    return backend
+
+
+def fixed_input_size(backend, imgsz):
+    """
+    Input size a backend's artifact is locked to, None if it takes any size
+    TorchScript is traced at imgsz; ONNX (and INT8, quantized from it) is exported with dynamic axes
+    """
+    return imgsz if validate_backend(backend) == TORCHSCRIPT else None
+
+
+def artifact_path(weights_path, backend, imgsz=640):
+    """
+    Where the exported artifact for a backend lives (next to the weights)
+    The image size is part of the name: a trace is only valid at the size it was made at
+    """
+    weights_path = Path(weights_path)
+    validate_backend(backend)
+    if backend == PYTORCH:
+        return weights_path
+    if backend == TORCHSCRIPT:
+        return weights_path.with_suffix(f'.{imgsz}.torchscript')
+    if backend == ONNX:
+        return weights_path.with_suffix(f'.{imgsz}.onnx')
+    return weights_path.with_suffix(f'.{imgsz}.int8.onnx')
+
+
+def report_path(weights_path):
+    return Path(weights_path).with_suffix('.backends.json')
+
+
+def is_fresh(artifact, weights_path):
+    """Artifact exists and was exported after the weights last changed"""
+    artifact, weights_path = Path(artifact), Path(weights_path)
+    return artifact.exists() and (not weights_path.exists()
+                                  or artifact.stat().st_mtime >= weights_path.stat().st_mtime)
+
+
+def export(weights_path, backend, imgsz=640):
+    """
+    Export weights for a backend unless a fresh artifact is cached
+    Returns the artifact path the model registry should load
+    """
+    target = artifact_path(weights_path, backend, imgsz)
+    if backend == PYTORCH or is_fresh(target, weights_path):
+        return target
+
+    with _export_lock:
+        if is_fresh(target, weights_path):
+            return target
+        if backend == ONNX_INT8:
+            fp32 = export(weights_path, ONNX, imgsz)
+            quantize_onnx(fp32, target)
+            return target
+
+        import export as yolov5_export  # yolov5/export.py
+        include = (TORCHSCRIPT,) if backend == TORCHSCRIPT else (ONNX,)
+        # Dynamic axes let the ONNX model run micro-batches and any imgsz
+        yolov5_export.run(weights=str(weights_path), imgsz=(imgsz, imgsz), include=include,
+                          device='cpu', dynamic=backend == ONNX)
+        # export.py names the file after the weights only
+        exported = Path(weights_path).with_suffix(f'.{backend}')
+        if not exported.exists():
+            raise RuntimeError(f'Export to {backend} failed for {weights_path}')
+        os.replace(exported, target)
+        return target
+
+
+def quantize_onnx(fp32_path, int8_path):
+    """Dynamic INT8 weight quantization with onnxruntime, keeping YOLOv5 metadata (stride, names)"""
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QUInt8)
+    source, quantized = onnx.load(str(fp32_path)), onnx.load(str(int8_path))
+    if not quantized.metadata_props:
+        for prop in source.metadata_props:
+            meta = quantized.metadata_props.add()
+            meta.key, meta.value = prop.key, prop.value
+        onnx.save(quantized, str(int8_path))
+    return Path(int8_path)
+
+
+def available_artifacts(weights_path, imgsz=640):
+    """Backends with a fresh exported artifact for these weights at this image size"""
+    return {backend: str(artifact_path(weights_path, backend, imgsz)) for backend in BACKENDS
+            if backend == PYTORCH or is_fresh(artifact_path(weights_path, backend, imgsz), weights_path)}
+
+
+def load_report(weights_path):
+    path = report_path(weights_path)
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def compare(weights_path, data_yaml, backends=BACKENDS, imgsz=640, batch_size=16):
+    """
+    Validate every backend on the dataset in data_yaml and report mAP and
+    CPU latency deltas against the original PyTorch weights
+    The report is also written next to the weights (<name>.backends.json)
+    """
+    import val as yolov5_val  # yolov5/val.py
+
+    rows = {}
+    for backend in backends:
+        try:
+            artifact = export(weights_path, backend, imgsz)
+            results = yolov5_val.run(data=str(data_yaml), weights=str(artifact), imgsz=imgsz,
+                                     batch_size=batch_size, device='cpu', half=False, plots=False,
+                                     project=str(YOLOV5_DIR / 'runs' / 'val'), name=f'backend_{backend}',
+                                     exist_ok=True)
+            metrics, speeds = results[0], results[-1]
+            rows[backend] = {
+                'artifact': str(artifact),
+                'size_bytes': Path(artifact).stat().st_size,
+                'precision': float(metrics[0]),
+                'recall': float(metrics[1]),
+                'map50': float(metrics[2]),
+                'map50_95': float(metrics[3]),
+                'inference_ms_per_image': float(speeds[1]),
+            }
+        except Exception as e:
+            rows[backend] = {'error': str(e)}
+
+    baseline = rows.get(PYTORCH, {})
+    for backend, row in rows.items():
+        if 'error' in row or 'error' in baseline or not baseline:
+            continue
+        row['map50_delta'] = row['map50'] - baseline['map50']
+        row['map50_95_delta'] = row['map50_95'] - baseline['map50_95']
+        if baseline['inference_ms_per_image']:
+            row['speedup'] = baseline['inference_ms_per_image'] / row['inference_ms_per_image']
+
+    report = {'weights': str(weights_path), 'data': str(data_yaml), 'imgsz': imgsz, 'backends': rows}
+    with open(report_path(weights_path), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export and compare CPU inference backends')
+    parser.add_argument('command', choices=['export', 'compare'])
+    parser.add_argument('--weights', default='yolov5s.pt')
+    parser.add_argument('--backend', default=ONNX, choices=BACKENDS, help='export: backend to export')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='compare: backends to validate')
+    parser.add_argument('--data', default=str(Path(__file__).parent / 'data_fish_notfish.yaml'))
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--batch-size', type=int, default=16)
+    opt = parser.parse_args()
+
+    from detections import resolve_weights_path
+
+    weights_path = resolve_weights_path(opt.weights)
+    if opt.command == 'export':
+        print(export(weights_path, opt.backend, opt.imgsz))
+    else:
+        print(json.dumps(compare(weights_path, opt.data, opt.backends.split(','), opt.imgsz, opt.batch_size),
+                         indent=2))
@@ -0,0 +1,234 @@
+"""
+Dynamic micro-batching for IKAN Fish Detection
+Concurrent single-image detect calls for the same weights and imgsz
+are collected into one batch and run with a single forward pass
+
+Sweep batch size / max wait and report throughput vs latency:
+    python batching.py --weights yolov5s.pt --batch-sizes 1,4,8 --waits-ms 0,5,20
+"""
+
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from inference import percentile
+
+# Number of completed requests kept for latency/throughput stats
+STATS_WINDOW = 2000
+
+
+class BatchItem:
+    """One image waiting in the batch queue"""
+
+    def __init__(self, array, shape, conf_thres, iou_thres, max_det):
+        self.array = array
+        self.shape = shape
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.max_det = max_det
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Request queue in front of the model registry
+    Images are grouped by (weights, imgsz, iou_thres, max_det); a batch is
+    dispatched once it reaches max_batch_size or its oldest image has
+    waited max_wait_ms
+    """
+
+    def __init__(self, registry, max_batch_size=8, max_wait_ms=10):
+        self.registry = registry
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='ikan-batcher', daemon=True)
+            self._worker.start()
+
+    def configure(self, max_batch_size=None, max_wait_ms=None):
+        """Change batching settings at runtime"""
+        with self._cond:
+            if max_batch_size is not None:
+                self.max_batch_size = max(1, int(max_batch_size))
+            if max_wait_ms is not None:
+                self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+            self._cond.notify_all()
+
+    def queue_depth(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def submit(self, weights_path, img0, imgsz=640, conf_thres=0.25, iou_thres=0.45, max_det=1000):
+        """Queue one BGR image, returns a Future of (detections, timings)"""
+        loaded = self.registry.get(weights_path)
+        # Letterbox in the caller's thread so preprocessing runs in parallel
+        array, imgsz = self.registry.prepare(loaded, img0, imgsz)
+        item = BatchItem(array, img0.shape, conf_thres, iou_thres, max_det)
+        key = (str(weights_path), imgsz, iou_thres, max_det)
+        with self._cond:
+            self._queues.setdefault(key, deque()).append(item)
+            self._ensure_worker()
+            self._cond.notify_all()
+        return item.future
+
+    def detect(self, weights_path, img0, imgsz=640, conf_thres=0.25, iou_thres=0.45, max_det=1000, timeout=None):
+        """Blocking single-image detection through the batch queue"""
+        cold = str(weights_path) not in self.registry.loaded_paths()
+        t0 = time.perf_counter()
+        self.registry.get(weights_path)
+        model_load = time.perf_counter() - t0 if cold else 0.0
+        future = self.submit(weights_path, img0, imgsz, conf_thres, iou_thres, max_det)
+        det, timings = future.result(timeout=timeout)
+        timings['cold'] = cold
+        timings['model_load'] = model_load
+        timings['total'] = time.perf_counter() - t0
+        return det, timings
+
+    def _next_batch(self):
+        """Wait for a ready batch, returns (key, items)"""
+        with self._cond:
+            while True:
+                now = time.perf_counter()
+                timeout = None
+                # Oldest queue first so no key starves
+                for key, queue in self._queues.items():
+                    remaining = self.max_wait - (now - queue[0].enqueued_at)
+                    if len(queue) >= self.max_batch_size or remaining <= 0:
+                        items = [queue.popleft() for _ in range(min(self.max_batch_size, len(queue)))]
+                        del self._queues[key]
+                        if queue:
+                            # Leftovers go to the back behind other keys
+                            self._queues[key] = queue
+                        return key, items
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                self._cond.wait(timeout=timeout)
+
+    def _run(self):
+        while True:
+            key, items = self._next_batch()
+            weights_path = key[0]
+            try:
+                loaded = self.registry.get(weights_path)
+                dispatched = time.perf_counter()
+                t0 = time.perf_counter()
+                im, pred = self.registry.forward(loaded, np.stack([item.array for item in items]))
+                forward_seconds = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                dets = self.registry.postprocess(
+                    pred, im.shape[2:], [item.shape for item in items],
+                    [item.conf_thres for item in items], key[2], key[3])
+                nms_seconds = time.perf_counter() - t0
+            except Exception as e:
+                for item in items:
+                    item.future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for item, det in zip(items, dets):
+                item.future.set_result((det, {
+                    'queue_wait': dispatched - item.enqueued_at,
+                    'inference': forward_seconds,
+                    'nms': nms_seconds,
+                    'batch_size': len(items),
+                }))
+            self._record(items, done)
+
+    def _record(self, items, done):
+        with self._stats_lock:
+            self._batch_sizes.append(len(items))
+            for item in items:
+                self._completed.append((done, done - item.enqueued_at))
+            self._images += len(items)
+            self._batches += 1
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._completed = deque(maxlen=STATS_WINDOW)
+            self._batch_sizes = deque(maxlen=STATS_WINDOW)
+            self._images = 0
+            self._batches = 0
+
+    def stats(self):
+        """Throughput (images/sec) and latency percentiles over the recent window"""
+        with self._stats_lock:
+            completed = list(self._completed)
+            batch_sizes = list(self._batch_sizes)
+            images, batches = self._images, self._batches
+        latencies = [lat for _, lat in completed]
+        throughput = None
+        if len(completed) > 1:
+            span = completed[-1][0] - (completed[0][0] - completed[0][1])
+            throughput = len(completed) / span if span > 0 else None
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue_depth': self.queue_depth(),
+            'images': images,
+            'batches': batches,
+            'mean_batch_size': float(np.mean(batch_sizes)) if batch_sizes else None,
+            'images_per_sec': throughput,
+            'latency_p50_seconds': percentile(latencies, 50),
+            'latency_p99_seconds': percentile(latencies, 99),
+        }
+
+
+def sweep(batcher, weights_path, imgsz, batch_sizes, waits_ms, requests=64, concurrency=16, image_size=(720, 1280)):
+    """Run synthetic load for every (batch size, wait) pair, returns a list of stats dicts"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 255, (*image_size, 3), dtype=np.uint8) for _ in range(min(requests, 8))]
+    batcher.detect(weights_path, images[0], imgsz)  # load + warm the model
+    results = []
+    for batch_size in batch_sizes:
+        for wait_ms in waits_ms:
+            batcher.configure(max_batch_size=batch_size, max_wait_ms=wait_ms)
+            batcher.reset_stats()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(lambda i: batcher.detect(weights_path, images[i % len(images)], imgsz),
+                              range(requests)))
+            results.append(batcher.stats())
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from inference import ModelRegistry
+
+    parser = argparse.ArgumentParser(description='Micro-batching throughput vs latency sweep')
+    parser.add_argument('--weights', default='yolov5s.pt')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--batch-sizes', default='1,2,4,8')
+    parser.add_argument('--waits-ms', default='0,5,10,20')
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--device', default='')
+    parser.add_argument('--json', action='store_true', help='print raw JSON instead of a table')
+    opt = parser.parse_args()
+
+    batcher = MicroBatcher(ModelRegistry(max_models=1, device=opt.device))
+    rows = sweep(batcher, opt.weights, opt.imgsz,
+                 [int(x) for x in opt.batch_sizes.split(',')],
+                 [float(x) for x in opt.waits_ms.split(',')],
+                 requests=opt.requests, concurrency=opt.concurrency)
+    if opt.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'batch':>6} {'wait_ms':>8} {'mean_bs':>8} {'img/s':>8} {'p50_ms':>8} {'p99_ms':>8}")
+        for r in rows:
+            print(f"{r['max_batch_size']:>6} {r['max_wait_ms']:>8.1f} {r['mean_batch_size']:>8.2f} "
+                  f"{r['images_per_sec']:>8.2f} {r['latency_p50_seconds'] * 1000:>8.1f} "
+                  f"{r['latency_p99_seconds'] * 1000:>8.1f}")
@@ -0,0 +1,380 @@
+"""
+Benchmark of the upload -> detect -> serve path for IKAN Fish Detection
+Generates synthetic images and short videos at several resolutions,
+drives the app through the Flask test client or over real HTTP at a
+given concurrency and writes throughput, p50/p95/p99 latency and peak
+memory as JSON that can be compared against a stored baseline
+
+Usage:
+    python benchmark.py --mode client --output bench.json
+    python benchmark.py --mode http --url http://localhost:5001 --concurrency 8
+    python benchmark.py --baseline bench_baseline.json --output bench.json
+"""
+
+import io
+import json
+import platform
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from inference import percentile
+
+IMAGE_RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080), (3840, 2160))
+VIDEO_RESOLUTIONS = ((640, 480), (1280, 720))
+# Latency / throughput changes smaller than this are treated as noise when comparing
+DEFAULT_TOLERANCE = 0.10
+
+
+def synthetic_frame(width, height, seed):
+    """Blue-green background with a few fish-shaped ellipses, deterministic per seed"""
+    rng = np.random.default_rng(seed)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = (rng.integers(90, 140), rng.integers(70, 110), rng.integers(10, 40))  # BGR, underwater tint
+    frame = cv2.add(frame, rng.integers(0, 25, (height, width, 3), dtype=np.uint8))
+    for _ in range(rng.integers(3, 9)):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(width // 40 + 2, width // 10 + 3)), int(rng.integers(height // 60 + 2, height // 20 + 3)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.ellipse(frame, center, axes, float(rng.integers(0, 180)), 0, 360, color, -1)
+    return frame
+
+
+def synthetic_image(width, height, seed):
+    """JPEG bytes of a synthetic frame (a unique seed gives a unique content hash)"""
+    ok, encoded = cv2.imencode('.jpg', synthetic_frame(width, height, seed), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise RuntimeError('JPEG encoding failed')
+    return encoded.tobytes()
+
+
+def synthetic_video(path, width, height, frames=60, fps=30, seed=0):
+    """Short mp4 of a frame drifting sideways, returns the file bytes"""
+    base = synthetic_frame(width, height, seed)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        for i in range(frames):
+            writer.write(np.roll(base, i * max(1, width // frames // 2), axis=1))
+    finally:
+        writer.release()
+    return Path(path).read_bytes()
+
+
+class PeakMemory:
+    """Samples RSS of this process (client mode) or the server's /metrics (http mode)"""
+
+    def __init__(self, sample, interval=0.1):
+        self.sample = sample
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ikan-bench-memory', daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._update()
+            self._stop.wait(self.interval)
+
+    def _update(self):
+        try:
+            value = self.sample()
+        except Exception:
+            return
+        if value is not None:
+            self.peak = value if self.peak is None else max(self.peak, value)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._update()
+
+
+def local_rss():
+    from metrics import process_stats
+    return process_stats()['rss_bytes']
+
+
+class ClientTransport:
+    """Requests through app.test_client(), in-process"""
+    name = 'client'
+
+    def __init__(self):
+        from app import app
+        self.app = app
+
+    def post_file(self, path, filename, data):
+        with self.app.test_client() as client:
+            r = client.post(path, data={'file': (io.BytesIO(data), filename)}, content_type='multipart/form-data')
+            return r.status_code, r.get_json()
+
+    def post_json(self, path, payload):
+        with self.app.test_client() as client:
+            r = client.post(path, json=payload)
+            return r.status_code, r.get_json()
+
+    def get(self, path):
+        with self.app.test_client() as client:
+            r = client.get(path)
+            return r.status_code, r.get_json() if r.is_json else r.data
+
+    def peak_memory_sampler(self):
+        return local_rss
+
+
+class HttpTransport:
+    """Requests over real HTTP to a running server"""
+    name = 'http'
+
+    def __init__(self, url, timeout=600):
+        import requests
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def post_file(self, path, filename, data):
+        r = self.session.post(self.url + path, files={'file': (filename, data)}, timeout=self.timeout)
+        return r.status_code, r.json()
+
+    def post_json(self, path, payload):
+        r = self.session.post(self.url + path, json=payload, timeout=self.timeout)
+        return r.status_code, r.json()
+
+    def get(self, path):
+        r = self.session.get(self.url + path, timeout=self.timeout)
+        is_json = r.headers.get('Content-Type', '').startswith('application/json')
+        return r.status_code, r.json() if is_json else r.content
+
+    def server_rss(self):
+        status, body = self.get('/metrics')
+        if status != 200:
+            return None
+        for line in body.decode().splitlines():
+            if line.startswith('ikan_process_resident_memory_bytes '):
+                return float(line.split()[1])
+        return None
+
+    def peak_memory_sampler(self):
+        return self.server_rss
+
+
+def image_request(transport, filename, data, params):
+    """Upload, detect and fetch the annotated result, returns per-phase seconds"""
+    t0 = time.perf_counter()
+    status, body = transport.post_file('/api/upload', filename, data)
+    if status != 200:
+        raise RuntimeError(f'upload failed ({status}): {body}')
+    t1 = time.perf_counter()
+    status, result = transport.post_json('/api/detect', {'filename': body['filename'], **params})
+    if status != 200:
+        raise RuntimeError(f'detect failed ({status}): {result}')
+    t2 = time.perf_counter()
+    if result.get('result_path'):
+        status, _ = transport.get(f"/api/results/{result['result_path']}")
+        if status != 200:
+            raise RuntimeError(f'result fetch failed ({status})')
+    t3 = time.perf_counter()
+    return {'upload': t1 - t0, 'detect': t2 - t1, 'serve': t3 - t2, 'total': t3 - t0,
+            'detections': result.get('detection_count', 0)}
+
+
+def video_request(transport, filename, data, params, poll_interval=0.2):
+    """Upload a video, run the detection job to completion, returns per-phase seconds"""
+    t0 = time.perf_counter()
+    status, body = transport.post_file('/api/upload', filename, data)
+    if status != 200:
+        raise RuntimeError(f'upload failed ({status}): {body}')
+    t1 = time.perf_counter()
+    status, job = transport.post_json('/api/detect', {'filename': body['filename'], **params})
+    if status != 202:
+        raise RuntimeError(f'detect failed ({status}): {job}')
+    job_id, since = job['job_id'], 0
+    while job['status'] in ('queued', 'running'):
+        time.sleep(poll_interval)
+        status, job = transport.get(f'/api/jobs/{job_id}?since={since}')
+        since = job.get('detections_next', since)
+    if job['status'] != 'done':
+        raise RuntimeError(f"video job {job['status']}: {job.get('error')}")
+    t2 = time.perf_counter()
+    return {'upload': t1 - t0, 'detect': t2 - t1, 'total': t2 - t0, 'frames': job.get('frames_done', 0)}
+
+
+def run_scenario(transport, name, requests, concurrency):
+    """Run callables concurrently, returns the scenario summary"""
+    errors = []
+    results = []
+    lock = threading.Lock()
+
+    def call(fn):
+        try:
+            row = fn()
+            with lock:
+                results.append(row)
+        except Exception as e:
+            with lock:
+                errors.append(str(e)[:300])
+
+    with PeakMemory(transport.peak_memory_sampler()) as memory:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            list(pool.map(call, requests))
+        elapsed = time.perf_counter() - t0
+
+    summary = {
+        'scenario': name,
+        'requests': len(requests),
+        'errors': len(errors),
+        'error_samples': errors[:3],
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'throughput_per_sec': len(results) / elapsed if elapsed > 0 else None,
+        'peak_rss_bytes': memory.peak,
+    }
+    for phase in ('total', 'upload', 'detect', 'serve'):
+        values = [r[phase] for r in results if phase in r]
+        if values:
+            summary[f'{phase}_p50'] = percentile(values, 50)
+            summary[f'{phase}_p95'] = percentile(values, 95)
+            summary[f'{phase}_p99'] = percentile(values, 99)
+    frames = sum(r.get('frames', 0) for r in results)
+    if frames:
+        summary['frames_per_sec'] = frames / elapsed
+    return summary
+
+
+def run_benchmark(transport, image_resolutions=IMAGE_RESOLUTIONS, video_resolutions=VIDEO_RESOLUTIONS,
+                  images_per_resolution=16, videos_per_resolution=2, video_frames=60, concurrency=4,
+                  params=None, warmup=True, workdir=None):
+    params = dict(params or {})
+    workdir = Path(workdir or Path(__file__).parent / 'cache' / 'benchmark')
+    workdir.mkdir(parents=True, exist_ok=True)
+    scenarios = []
+
+    if warmup:
+        # First request pays model load, keep it out of the measured scenarios
+        image_request(transport, 'warmup.jpg', synthetic_image(640, 480, seed=2**31), params)
+
+    seed = 0
+    for width, height in image_resolutions:
+        payloads = []
+        for _ in range(images_per_resolution):
+            seed += 1
+            payloads.append((f'bench_{width}x{height}_{seed}.jpg', synthetic_image(width, height, seed)))
+        requests = [lambda f=f, d=d: image_request(transport, f, d, params) for f, d in payloads]
+        scenarios.append(run_scenario(transport, f'image_{width}x{height}', requests, concurrency))
+
+    for width, height in video_resolutions:
+        payloads = []
+        for _ in range(videos_per_resolution):
+            seed += 1
+            path = workdir / f'bench_{width}x{height}_{seed}.mp4'
+            payloads.append((path.name, synthetic_video(path, width, height, video_frames, seed=seed)))
+        requests = [lambda f=f, d=d: video_request(transport, f, d, params) for f, d in payloads]
+        scenarios.append(run_scenario(transport, f'video_{width}x{height}', requests, concurrency))
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'mode': transport.name,
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(),
+                     'system': platform.system()},
+        'params': params,
+        'concurrency': concurrency,
+        'client_peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'scenarios': scenarios,
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Relative change of each scenario against the baseline
+    Latency and memory regress when higher, throughput when lower
+    """
+    base = {s['scenario']: s for s in baseline.get('scenarios', [])}
+    rows = []
+    for scenario in results['scenarios']:
+        old = base.get(scenario['scenario'])
+        if old is None:
+            continue
+        row = {'scenario': scenario['scenario'], 'regressions': []}
+        for key, higher_is_worse in (('total_p50', True), ('total_p95', True), ('total_p99', True),
+                                     ('throughput_per_sec', False), ('peak_rss_bytes', True)):
+            if not old.get(key) or scenario.get(key) is None:
+                continue
+            change = (scenario[key] - old[key]) / old[key]
+            row[f'{key}_change'] = change
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                row['regressions'].append(key)
+        rows.append(row)
+    return rows
+
+
+def print_table(results, comparison=None):
+    changes = {row['scenario']: row for row in comparison or []}
+    print(f"{'scenario':<20} {'req':>4} {'err':>4} {'req/s':>7} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} "
+          f"{'peak_MB':>8} {'vs_base_p50':>11}")
+    for s in results['scenarios']:
+        def ms(key):
+            return f"{s[key] * 1000:>8.1f}" if s.get(key) is not None else f"{'-':>8}"
+        peak = f"{s['peak_rss_bytes'] / 2**20:>8.0f}" if s.get('peak_rss_bytes') else f"{'-':>8}"
+        change = changes.get(s['scenario'], {}).get('total_p50_change')
+        change = f'{change * 100:>+10.1f}%' if change is not None else f"{'-':>11}"
+        throughput = f"{s['throughput_per_sec']:>7.2f}" if s.get('throughput_per_sec') else f"{'-':>7}"
+        print(f"{s['scenario']:<20} {s['requests']:>4} {s['errors']:>4} {throughput} {ms('total_p50')} "
+              f"{ms('total_p95')} {ms('total_p99')} {peak} {change}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    def resolutions(value):
+        return tuple(tuple(int(x) for x in r.split('x')) for r in value.split(',') if r)
+
+    parser = argparse.ArgumentParser(description='Benchmark upload -> detect -> serve')
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--url', default='http://localhost:5001', help='http mode: server address')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--images', type=int, default=16, help='images per resolution')
+    parser.add_argument('--videos', type=int, default=2, help='videos per resolution')
+    parser.add_argument('--video-frames', type=int, default=60)
+    parser.add_argument('--image-resolutions', type=resolutions, default=IMAGE_RESOLUTIONS, help='e.g. 640x480,1920x1080')
+    parser.add_argument('--video-resolutions', type=resolutions, default=VIDEO_RESOLUTIONS)
+    parser.add_argument('--weights', default='yolov5s.pt')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf-thres', type=float, default=0.4)
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='earlier results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    opt = parser.parse_args()
+
+    params = {'weights': opt.weights, 'imgsz': opt.imgsz, 'conf_thres': opt.conf_thres}
+    if opt.backend:
+        params['backend'] = opt.backend
+    transport = HttpTransport(opt.url) if opt.mode == 'http' else ClientTransport()
+    results = run_benchmark(transport, opt.image_resolutions, opt.video_resolutions, opt.images, opt.videos,
+                            opt.video_frames, opt.concurrency, params)
+
+    comparison = None
+    if opt.baseline:
+        with open(opt.baseline) as f:
+            comparison = compare(results, json.load(f), opt.tolerance)
+        results['baseline'] = {'path': opt.baseline, 'tolerance': opt.tolerance, 'comparison': comparison}
+    with open(opt.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print_table(results, comparison)
+    print(f'Results written to {opt.output}')
+    if comparison and any(row['regressions'] for row in comparison):
+        print('Regressions: ' + ', '.join(f"{row['scenario']} ({', '.join(row['regressions'])})"
+                                          for row in comparison if row['regressions']))
+        sys.exit(1)
@@ -0,0 +1,259 @@
+"""
+Bulk detection for IKAN Fish Detection
+Streams a directory of stills through batched inference with a parallel
+decode pool and writes one consolidated JSONL (or Parquet) file with the
+Fish/notFish detections of every image. Reruns skip images already in
+the output, so an interrupted run can be resumed
+
+Usage:
+    python bulk.py path/to/dive_stills --weights yolov5s.pt --output dive.jsonl
+    python bulk.py path/to/dive_stills --output dive.parquet  # needs pyarrow
+"""
+
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from inference import load_image
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+# Bytes read at a time when looking back for the end of the last complete line
+READ_BACK = 64 * 1024
+# Earlier detections handed to the job at a time when a run is resumed
+RESUME_CHUNK = 10000
+
+
+def iter_images(root):
+    """All image files under root, sorted so reruns see the same order"""
+    root = Path(root)
+    if root.is_file():
+        return [root]
+    return sorted(p for p in root.rglob('*') if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def progress_log_path(output):
+    """JSONL file the run appends to; for Parquet output it is converted at the end"""
+    output = Path(output)
+    return output if output.suffix == '.jsonl' else output.with_name(output.name + '.jsonl')
+
+
+def load_done(log_path, on_record=None):
+    """Source ids already written to the progress log, on_record(record) is called with each record"""
+    done = set()
+    log_path = Path(log_path)
+    if not log_path.exists():
+        return done
+    with open(log_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                done.add(record['source'])
+            except (ValueError, KeyError):
+                continue  # partially written last line of an interrupted run
+            if on_record is not None:
+                on_record(record)
+    return done
+
+
+def drop_partial_line(log_path):
+    """Cut a last line left half-written by an interrupted run, so appended records start on a new line"""
+    try:
+        f = open(log_path, 'rb+')
+    except FileNotFoundError:
+        return
+    with f:
+        end = pos = f.seek(0, 2)
+        keep = 0
+        while pos > 0:
+            start = max(0, pos - READ_BACK)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b'\n')
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            pos = start
+        if keep < end:
+            f.truncate(keep)
+
+
+def _decode(path, registry, loaded, imgsz):
+    """Decode and letterbox one image (runs on the decode pool)"""
+    try:
+        img0 = load_image(path)
+        array, _ = registry.prepare(loaded, img0, imgsz)
+        return img0.shape, array, None
+    except Exception as e:
+        return None, None, str(e)
+
+
+def run_bulk(sources, registry, weights_path, output, root=None, imgsz=640, conf_thres=0.4, iou_thres=0.45,
+             batch_size=16, decode_workers=4, formatter=None, job=None, on_record=None):
+    """
+    Detect on every image in `sources`, appending one JSON line per image
+    formatter(det, shape) turns detections into JSON rows
+    on_record(record) is called with every record written to the log
+    Returns a summary dict
+    """
+    root = Path(root) if root else None
+    log_path = progress_log_path(output)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def source_id(path):
+        return str(path.relative_to(root)) if root else str(path)
+
+    # Detections of a resumed run's earlier records count towards the summary too
+    counts = {}
+    resumed = []
+
+    def count_done(record):
+        rows = [row for row in record.get('detections') or [] if isinstance(row, dict)]
+        for row in rows:
+            counts[row.get('class_name')] = counts.get(row.get('class_name'), 0) + 1
+        if job is not None:
+            resumed.extend(rows)
+            if len(resumed) >= RESUME_CHUNK:
+                job.progress(0, resumed)
+                resumed.clear()
+
+    drop_partial_line(log_path)
+    done = load_done(log_path, on_record=count_done)
+    todo = [p for p in sources if source_id(Path(p)) not in done]
+    if job is not None:
+        job.total_frames = len(sources)
+        job.progress(len(sources) - len(todo), resumed)
+
+    loaded = registry.get(weights_path)
+    processed = len(sources) - len(todo)
+    with ThreadPoolExecutor(max_workers=max(1, decode_workers), thread_name_prefix='ikan-decode') as pool, \
+            open(log_path, 'a') as log:
+        # Keep a bounded window of decodes in flight ahead of inference
+        pending = deque()
+        todo_iter = iter(todo)
+
+        def refill():
+            for path in todo_iter:
+                pending.append((Path(path), pool.submit(_decode, path, registry, loaded, imgsz)))
+                if len(pending) >= batch_size * 2:
+                    break
+
+        refill()
+        while pending:
+            if job is not None:
+                job.check_cancelled()
+            batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+            refill()
+
+            records = []
+            ready = []
+            for path, future in batch:
+                shape, array, error = future.result()
+                if error is not None:
+                    records.append({'source': source_id(path), 'error': error})
+                else:
+                    ready.append((path, shape, array))
+
+            rows_for_job = []
+            if ready:
+                im, pred = registry.forward(loaded, np.stack([r[2] for r in ready]))
+                dets = registry.postprocess(pred, im.shape[2:], [r[1] for r in ready], conf_thres, iou_thres)
+                for (path, shape, _), det in zip(ready, dets):
+                    rows = formatter(det, shape) if formatter else det.tolist()
+                    for row in rows:
+                        if isinstance(row, dict):
+                            counts[row.get('class_name')] = counts.get(row.get('class_name'), 0) + 1
+                    rows_for_job.extend(rows)
+                    records.append({
+                        'source': source_id(path),
+                        'width': shape[1],
+                        'height': shape[0],
+                        'detection_count': len(rows),
+                        'detections': rows,
+                    })
+
+            log.write(''.join(json.dumps(r) + '\n' for r in records))
+            log.flush()  # a crash loses at most the batch in flight
+            if on_record is not None:
+                for record in records:
+                    on_record(record)
+            processed += len(batch)
+            if job is not None:
+                job.progress(processed, [r for r in rows_for_job if isinstance(r, dict)])
+
+    output = Path(output)
+    if output.suffix == '.parquet':
+        write_parquet(log_path, output)
+    # class_counts cover the whole output, records of earlier runs included
+    return {'output': str(output), 'images': len(sources), 'processed_this_run': len(todo),
+            'skipped_done': len(sources) - len(todo), 'class_counts': counts}
+
+
+def write_parquet(log_path, output):
+    """Flatten the JSONL log to one row per detection in a Parquet file"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet output needs pyarrow (pip install pyarrow); the JSONL log is at '
+                           f'{log_path}')
+    columns = {k: [] for k in ('source', 'width', 'height', 'class', 'class_name', 'confidence',
+                               'x_center', 'y_center', 'w', 'h', 'error')}
+    with open(log_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            dets = record.get('detections') or [None]
+            for det in dets:
+                columns['source'].append(record['source'])
+                columns['width'].append(record.get('width'))
+                columns['height'].append(record.get('height'))
+                columns['error'].append(record.get('error'))
+                bbox = det['bbox'] if det else [None] * 4
+                columns['class'].append(det['class'] if det else None)
+                columns['class_name'].append(det['class_name'] if det else None)
+                columns['confidence'].append(det['confidence'] if det else None)
+                for key, value in zip(('x_center', 'y_center', 'w', 'h'), bbox):
+                    columns[key].append(value)
+    pq.write_table(pa.table(columns), output)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Bulk Fish/notFish detection over a directory of images')
+    parser.add_argument('source', help='directory (searched recursively) or single image')
+    parser.add_argument('--weights', default='yolov5s.pt')
+    parser.add_argument('--output', default='detections.jsonl', help='.jsonl or .parquet')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf-thres', type=float, default=0.4)
+    parser.add_argument('--iou-thres', type=float, default=0.45)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4, help='parallel image decoders')
+    parser.add_argument('--device', default='')
+    opt = parser.parse_args()
+
+    # Same weights resolution and Fish/notFish mapping as the web app
+    from detections import format_detections, is_coco_weights, model_names, resolve_weights_path
+    from inference import ModelRegistry
+
+    weights_path = resolve_weights_path(opt.weights)
+    is_coco_model = is_coco_weights(weights_path)
+    names = model_names(weights_path)
+    sources = iter_images(opt.source)
+    t0 = time.perf_counter()
+    summary = run_bulk(
+        sources, ModelRegistry(max_models=1, device=opt.device), weights_path, opt.output,
+        root=opt.source if Path(opt.source).is_dir() else None,
+        imgsz=opt.imgsz, conf_thres=opt.conf_thres, iou_thres=opt.iou_thres,
+        batch_size=opt.batch_size, decode_workers=opt.workers,
+        formatter=lambda det, shape: format_detections(det, shape, is_coco_model, names=names)
+    )
+    elapsed = time.perf_counter() - t0
+    summary['seconds'] = elapsed
+    summary['images_per_sec'] = summary['processed_this_run'] / elapsed if elapsed > 0 else None
+    print(json.dumps(summary, indent=2))
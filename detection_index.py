@@ -0,0 +1,422 @@
+"""
+Persistent detection index for IKAN Fish Detection
+Every detection (source file, frame, class, confidence, normalized bbox)
+is written to an embedded SQLite database by a background writer, so a
+season of footage can be filtered and counted without rescanning
+results/ directories. An R*Tree on the boxes serves region queries.
+
+Usage:
+    python detection_index.py query --class Fish --min-conf 0.7 --source dive1.mp4 --frames 100:500
+    python detection_index.py aggregate --group-by source,class
+    python detection_index.py import results/   # backfill from detections.jsonl / labels/*.txt
+"""
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    weights TEXT NOT NULL DEFAULT '',
+    kind TEXT,
+    width INTEGER,
+    height INTEGER,
+    indexed_at REAL,
+    UNIQUE (name, weights)
+);
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER NOT NULL REFERENCES sources(id),
+    frame INTEGER NOT NULL DEFAULT 0,
+    class INTEGER NOT NULL,
+    class_name TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    w REAL NOT NULL,
+    h REAL NOT NULL,
+    track_id INTEGER
+);
+-- Per-source frame ranges ("in these videos between frames X and Y")
+CREATE INDEX IF NOT EXISTS idx_detections_source_class_frame ON detections (source_id, class_name, frame, confidence);
+-- Collection-wide class / confidence filters and counts
+CREATE INDEX IF NOT EXISTS idx_detections_class_conf ON detections (class_name, confidence);
+"""
+
+RTREE_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS detections_rtree USING rtree(id, x1, x2, y1, y2)"
+
+GROUP_COLUMNS = {
+    'source': 's.name',
+    'class': 'd.class_name',
+    'frame_bucket': None,  # frame // bucket_size, see aggregate()
+}
+# Rows per executemany / transaction in the writer
+WRITE_BATCH = 5000
+# Annotated videos written next to labels/ (detect.py and the video pipeline)
+VIDEO_SUFFIXES = {'.mp4', '.avi', '.mov', '.mkv'}
+
+
+class DetectionIndex:
+    """
+    SQLite store of detections
+    Writes go through a queue to one writer thread (batched transactions),
+    reads use a connection per thread; WAL keeps readers and the writer
+    (also across server processes) from blocking each other
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.rows_written = 0
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        try:
+            conn.execute(RTREE_SCHEMA)
+            self.has_rtree = True
+        except sqlite3.OperationalError:
+            self.has_rtree = False  # sqlite built without R*Tree: region filters scan the bbox columns
+        conn.commit()
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        conn.execute('PRAGMA cache_size=-65536')  # 64 MB page cache
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # Writing
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='ikan-index-writer', daemon=True)
+                self._worker.start()
+
+    def begin_source(self, name, weights='', kind='image', width=None, height=None):
+        """Start (re)indexing a source: rows from an earlier run with the same weights are replaced"""
+        self._ensure_worker()
+        self._queue.put(('begin', (name, str(weights), kind, width, height)))
+
+    def add(self, name, rows, weights='', frame=None):
+        """Queue /api/detect-style rows (class, class_name, confidence, bbox[, frame]) of a source"""
+        if not rows:
+            return
+        self._ensure_worker()
+        self._queue.put(('rows', (name, str(weights), frame, rows)))
+
+    def remove_source(self, name, weights=''):
+        self._ensure_worker()
+        self._queue.put(('remove', (name, str(weights))))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is committed"""
+        if self._worker is None:
+            return True
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        return done.wait(timeout)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        conn = self._connect()
+        conn.isolation_level = None  # explicit BEGIN IMMEDIATE below
+        source_ids = {}
+        while True:
+            ops = [self._queue.get()]
+            # Drain what is already queued into the same transaction
+            while len(ops) < WRITE_BATCH:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            flushed = []
+            try:
+                # Take the write lock up front: ids are allocated from MAX(id) and other
+                # server processes may write to the same file
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    for op, args in ops:
+                        if op == 'flush':
+                            flushed.append(args)
+                        elif op == 'begin':
+                            source_ids[args[:2]] = self._begin(conn, *args)
+                        elif op == 'remove':
+                            self._delete_rows(conn, args)
+                            conn.execute('DELETE FROM sources WHERE name = ? AND weights = ?', args)
+                            source_ids.pop(args, None)
+                        elif op == 'rows':
+                            name, weights, frame, rows = args
+                            key = (name, weights)
+                            if key not in source_ids:
+                                source_ids[key] = self._source_id(conn, name, weights)
+                            self._insert(conn, source_ids[key], frame, rows)
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+            except Exception as e:
+                print(f'Detection index write failed: {e}')
+                source_ids.clear()
+            for event in flushed:
+                event.set()
+
+    def _source_id(self, conn, name, weights, kind=None, width=None, height=None):
+        conn.execute('INSERT OR IGNORE INTO sources (name, weights, kind, width, height, indexed_at) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', (name, weights, kind, width, height, time.time()))
+        return conn.execute('SELECT id FROM sources WHERE name = ? AND weights = ?', (name, weights)).fetchone()[0]
+
+    def _begin(self, conn, name, weights, kind, width, height):
+        self._delete_rows(conn, (name, weights))
+        source_id = self._source_id(conn, name, weights, kind, width, height)
+        conn.execute('UPDATE sources SET kind = ?, width = ?, height = ?, indexed_at = ? WHERE id = ?',
+                     (kind, width, height, time.time(), source_id))
+        return source_id
+
+    def _delete_rows(self, conn, key):
+        row = conn.execute('SELECT id FROM sources WHERE name = ? AND weights = ?', key).fetchone()
+        if row is None:
+            return
+        if self.has_rtree:
+            conn.execute('DELETE FROM detections_rtree WHERE id IN '
+                         '(SELECT id FROM detections WHERE source_id = ?)', (row[0],))
+        conn.execute('DELETE FROM detections WHERE source_id = ?', (row[0],))
+
+    def _insert(self, conn, source_id, frame, rows):
+        cur = conn.execute('SELECT COALESCE(MAX(id), 0) FROM detections')
+        first_id = cur.fetchone()[0] + 1
+        values = []
+        boxes = []
+        for i, row in enumerate(rows):
+            x, y, w, h = row['bbox']
+            values.append((first_id + i, source_id, int(row.get('frame', frame) or 0), int(row['class']),
+                           row['class_name'], float(row['confidence']), x, y, w, h, row.get('track_id')))
+            boxes.append((first_id + i, x - w / 2, x + w / 2, y - h / 2, y + h / 2))
+        conn.executemany('INSERT INTO detections (id, source_id, frame, class, class_name, confidence, x, y, w, h, '
+                         'track_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', values)
+        if self.has_rtree:
+            conn.executemany('INSERT INTO detections_rtree (id, x1, x2, y1, y2) VALUES (?, ?, ?, ?, ?)', boxes)
+        self.rows_written += len(values)
+
+    # Reading
+
+    def _where(self, sources=None, class_name=None, min_conf=None, max_conf=None, frame_min=None,
+               frame_max=None, region=None, weights=None):
+        clauses, params = [], []
+        if sources:
+            clauses.append(f"s.name IN ({','.join('?' * len(sources))})")
+            params.extend(sources)
+        if weights:
+            clauses.append('s.weights = ?')
+            params.append(str(weights))
+        if class_name is not None:
+            clauses.append('d.class_name = ?')
+            params.append(class_name)
+        if min_conf is not None:
+            clauses.append('d.confidence >= ?')
+            params.append(float(min_conf))
+        if max_conf is not None:
+            clauses.append('d.confidence <= ?')
+            params.append(float(max_conf))
+        if frame_min is not None:
+            clauses.append('d.frame >= ?')
+            params.append(int(frame_min))
+        if frame_max is not None:
+            clauses.append('d.frame <= ?')
+            params.append(int(frame_max))
+        if region is not None:
+            # Boxes intersecting the normalized region (x1, y1, x2, y2)
+            x1, y1, x2, y2 = (float(v) for v in region)
+            if self.has_rtree:
+                clauses.append('d.id IN (SELECT id FROM detections_rtree WHERE x2 >= ? AND x1 <= ? '
+                               'AND y2 >= ? AND y1 <= ?)')
+            else:
+                clauses.append('d.x + d.w / 2 >= ? AND d.x - d.w / 2 <= ? AND d.y + d.h / 2 >= ? '
+                               'AND d.y - d.h / 2 <= ?')
+            params.extend([x1, x2, y1, y2])
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, limit=100, offset=0, order='source', **filters):
+        """Detections matching the filters, one page of `limit` rows"""
+        where, params = self._where(**filters)
+        order_by = {'source': 's.name, d.frame, d.id', 'confidence': 'd.confidence DESC',
+                    'frame': 'd.frame, d.id'}.get(order, 's.name, d.frame, d.id')
+        sql = (f'SELECT s.name AS source, d.frame, d.class, d.class_name, d.confidence, d.x, d.y, d.w, d.h, '
+               f'd.track_id FROM detections d JOIN sources s ON s.id = d.source_id{where} '
+               f'ORDER BY {order_by} LIMIT ? OFFSET ?')
+        conn = self._reader()
+        rows = [{'source': r['source'], 'frame': r['frame'], 'class': r['class'], 'class_name': r['class_name'],
+                 'confidence': r['confidence'], 'bbox': [r['x'], r['y'], r['w'], r['h']], 'track_id': r['track_id']}
+                for r in conn.execute(sql, params + [int(limit), int(offset)])]
+        return rows
+
+    def aggregate(self, group_by=('class',), bucket_size=100, **filters):
+        """Count and mean confidence per group (source, class, frame_bucket)"""
+        columns = []
+        for name in group_by:
+            if name not in GROUP_COLUMNS:
+                raise ValueError(f'Unknown group_by {name!r} (choose from {", ".join(GROUP_COLUMNS)})')
+            expr = f'(d.frame / {max(1, int(bucket_size))}) * {max(1, int(bucket_size))}' \
+                if name == 'frame_bucket' else GROUP_COLUMNS[name]
+            columns.append(f'{expr} AS {name}')
+        where, params = self._where(**filters)
+        select = ', '.join(columns + ['COUNT(*) AS count', 'AVG(d.confidence) AS mean_confidence',
+                                      'COUNT(DISTINCT d.source_id) AS sources',
+                                      # distinct (source, track id) pairs in tracked videos
+                                      "COUNT(DISTINCT d.source_id || ':' || d.track_id) AS tracks"])
+        group = f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}" if group_by else ''
+        sql = f'SELECT {select} FROM detections d JOIN sources s ON s.id = d.source_id{where}{group}'
+        return [dict(r) for r in self._reader().execute(sql, params)]
+
+    def sources(self, limit=1000):
+        sql = ('SELECT s.name, s.weights, s.kind, s.width, s.height, s.indexed_at, '
+               '(SELECT COUNT(*) FROM detections d WHERE d.source_id = s.id) AS detections '
+               'FROM sources s ORDER BY s.indexed_at DESC LIMIT ?')
+        return [dict(r) for r in self._reader().execute(sql, (int(limit),))]
+
+    def weights_usage(self):
+        """Sources indexed per weights, most used first"""
+        sql = ('SELECT weights, COUNT(*) AS sources, MAX(indexed_at) AS last_used FROM sources '
+               'GROUP BY weights ORDER BY sources DESC, last_used DESC')
+        return [dict(r) for r in self._reader().execute(sql)]
+
+    def stats(self):
+        conn = self._reader()
+        return {
+            'path': str(self.path),
+            'sources': conn.execute('SELECT COUNT(*) FROM sources').fetchone()[0],
+            # MAX(id) is an index lookup, COUNT(*) would scan tens of millions of rows
+            'detections_upper_bound': conn.execute('SELECT COALESCE(MAX(id), 0) FROM detections').fetchone()[0],
+            'size_bytes': sum(p.stat().st_size for p in self.path.parent.glob(self.path.name + '*')),
+            'rtree': self.has_rtree,
+            'pending_writes': self.pending(),
+            'rows_written': self.rows_written,
+        }
+
+
+def import_results(index, results_dir, weights='imported', uploads_dir=None):
+    """
+    Backfill the index from existing outputs: bulk detections.jsonl files and
+    detect.py-style labels/*.txt (class x y w h conf), returns rows imported
+    Sources are keyed like the live path: the upload file name (looked up in
+    uploads_dir when given, else the result file name) for single images and
+    videos, <bulk dir>/<relative path> for bulk runs
+    """
+    from detections import CLASS_NAMES
+
+    results_dir = Path(results_dir)
+    uploads = {}
+    if uploads_dir is not None and Path(uploads_dir).is_dir():
+        for path in Path(uploads_dir).iterdir():
+            uploads.setdefault(path.stem, []).append(path.name)
+
+    def upload_name(media):
+        # Images are saved as .jpg unless uploaded as JPEG / PNG, videos as .mp4
+        matches = uploads.get(media.stem, [])
+        return matches[0] if len(matches) == 1 else media.name
+
+    total = 0
+    for log in sorted(results_dir.rglob('detections.jsonl')):
+        with open(log) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                name = f'{log.parent.name}/{record["source"]}'
+                index.begin_source(name, weights, 'image', record.get('width'), record.get('height'))
+                index.add(name, record.get('detections') or [], weights)
+                total += len(record.get('detections') or [])
+    # Oldest first (detect_<timestamp> names sort by time), so the latest run of a source wins
+    for labels_dir in sorted(results_dir.rglob('labels')):
+        # Image vs video is decided by the media file next to the labels, not by the label name:
+        # uploads are named <name>_<HHMMSS>.<ext>, which looks just like a video frame label
+        media = {p.stem: p for p in labels_dir.parent.iterdir() if p.is_file()}
+        by_source = {}
+        for txt in sorted(labels_dir.glob('*.txt')):
+            stem, _, frame = txt.stem.rpartition('_')
+            video = media.get(stem)
+            if (txt.stem not in media and frame.isdigit() and video is not None
+                    and video.suffix.lower() in VIDEO_SUFFIXES):
+                # Video labels are <video stem>_<frame>.txt
+                source, kind, frame = upload_name(video), 'video', int(frame)
+            elif txt.stem in media:
+                source, kind, frame = upload_name(media[txt.stem]), 'image', 0
+            else:
+                # Labels saved without the annotated image
+                matches = uploads.get(txt.stem, [])
+                source, kind, frame = (matches[0] if len(matches) == 1 else txt.stem), 'image', 0
+            rows = []
+            for line in txt.read_text().splitlines():
+                parts = line.split()
+                if len(parts) < 5:
+                    continue
+                cls = int(float(parts[0]))
+                rows.append({'class': cls, 'class_name': CLASS_NAMES.get(cls, f'Class_{cls}'),
+                             'confidence': float(parts[5]) if len(parts) > 5 else 1.0,
+                             'bbox': [float(v) for v in parts[1:5]], 'frame': frame})
+            by_source.setdefault((source, kind), []).extend(rows)
+        for (name, kind), rows in by_source.items():
+            index.begin_source(name, weights, kind)
+            index.add(name, rows, weights)
+            total += len(rows)
+    index.flush()
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Query or backfill the detection index')
+    parser.add_argument('command', choices=['query', 'aggregate', 'sources', 'stats', 'import'])
+    parser.add_argument('path', nargs='?', help='import: results directory')
+    parser.add_argument('--uploads', default=str(Path(__file__).parent / 'uploads'),
+                        help='import: uploads directory, for the original file names')
+    parser.add_argument('--db', default=str(Path(__file__).parent / 'cache' / 'detections.sqlite'))
+    parser.add_argument('--source', action='append', help='repeatable')
+    parser.add_argument('--class', dest='class_name')
+    parser.add_argument('--min-conf', type=float)
+    parser.add_argument('--frames', help='first:last frame')
+    parser.add_argument('--region', help='x1,y1,x2,y2 normalized')
+    parser.add_argument('--group-by', default='class')
+    parser.add_argument('--bucket-size', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=20)
+    opt = parser.parse_args()
+
+    index = DetectionIndex(opt.db)
+    frame_min, _, frame_max = (opt.frames or ':').partition(':')
+    filters = {'sources': opt.source, 'class_name': opt.class_name, 'min_conf': opt.min_conf,
+               'frame_min': int(frame_min) if frame_min else None, 'frame_max': int(frame_max) if frame_max else None,
+               'region': [float(v) for v in opt.region.split(',')] if opt.region else None}
+    t0 = time.perf_counter()
+    if opt.command == 'query':
+        result = index.query(limit=opt.limit, **filters)
+    elif opt.command == 'aggregate':
+        result = index.aggregate(opt.group_by.split(','), opt.bucket_size, **filters)
+    elif opt.command == 'sources':
+        result = index.sources(opt.limit)
+    elif opt.command == 'stats':
+        result = index.stats()
+    else:
+        result = {'imported_rows': import_results(index, opt.path or 'results', uploads_dir=opt.uploads)}
+    print(json.dumps(result, indent=2))
+    print(f'{(time.perf_counter() - t0) * 1000:.1f} ms')
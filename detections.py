@@ -0,0 +1,125 @@
+"""
+Detection labels for IKAN Fish Detection
+Class names, weights path resolution and the /api/detect JSON rows, shared
+by the web app and the offline CLIs (bulk.py, backends.py, startup.py,
+detection_index.py), which import this instead of the app so they don't
+start its writers, caches and sweepers.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from weights_catalog import WeightsCatalog
+
+BASE_DIR = Path(__file__).parent
+
+# Class names for 2-class detection (Fish, notFish)
+CLASS_NAMES = {
+    0: 'Fish',
+    1: 'notFish'
+}
+
+# COCO class names (for mapping COCO detections to Fish/notFish)
+COCO_CLASS_NAMES = {
+    0: 'person', 1: 'bicycle', 2: 'car', 3: 'motorcycle', 4: 'airplane', 5: 'bus',
+    6: 'train', 7: 'truck', 8: 'boat', 9: 'traffic light', 10: 'fire hydrant',
+    11: 'stop sign', 12: 'parking meter', 13: 'bench', 14: 'bird', 15: 'cat',
+    16: 'dog', 17: 'horse', 18: 'sheep', 19: 'cow', 20: 'elephant', 21: 'bear',
+    22: 'zebra', 23: 'giraffe', 24: 'backpack', 25: 'umbrella', 26: 'handbag',
+    27: 'tie', 28: 'suitcase', 29: 'frisbee', 30: 'skis', 31: 'snowboard',
+    32: 'sports ball', 33: 'kite', 34: 'baseball bat', 35: 'baseball glove',
+    36: 'skateboard', 37: 'surfboard', 38: 'tennis racket', 39: 'bottle',
+    40: 'wine glass', 41: 'cup', 42: 'fork', 43: 'knife', 44: 'spoon',
+    45: 'bowl', 46: 'banana', 47: 'apple', 48: 'sandwich', 49: 'orange',
+    50: 'broccoli', 51: 'carrot', 52: 'hot dog', 53: 'pizza', 54: 'donut',
+    55: 'cake', 56: 'chair', 57: 'couch', 58: 'potted plant', 59: 'bed',
+    60: 'dining table', 61: 'toilet', 62: 'tv', 63: 'laptop', 64: 'mouse',
+    65: 'remote', 66: 'keyboard', 67: 'cell phone', 68: 'microwave', 69: 'oven',
+    70: 'toaster', 71: 'sink', 72: 'refrigerator', 73: 'book', 74: 'clock',
+    75: 'vase', 76: 'scissors', 77: 'teddy bear', 78: 'hair drier', 79: 'toothbrush'
+}
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_weights_catalog():
+    """The process-wide weights catalog, created on first use (sidecars in cache/weights)"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = WeightsCatalog(BASE_DIR, BASE_DIR / 'cache' / 'weights',
+                                      poll_interval=float(os.environ.get('IKAN_WEIGHTS_POLL_SECONDS', 30)))
+        return _catalog
+
+
+def resolve_weights_path(weights_path):
+    """Resolve a weights path from the UI to an absolute path"""
+    if Path(weights_path).is_absolute():
+        return str(weights_path)
+    # Try relative paths
+    if Path(weights_path).exists():
+        return str(Path(weights_path).resolve())
+    if (BASE_DIR / weights_path).exists():
+        return str((BASE_DIR / weights_path).resolve())
+    # Use yolov5 default (downloaded on first load if missing)
+    return str(BASE_DIR / 'yolov5' / weights_path)
+
+
+def is_coco_weights(weights_path):
+    """Check if we're using a COCO model or a custom fish model (from the checkpoint's class names)"""
+    return get_weights_catalog().is_coco(weights_path)
+
+
+def model_names(weights_path):
+    """Class names of a custom model as trained, Fish / notFish when the checkpoint can't be read"""
+    return get_weights_catalog().names(weights_path) or CLASS_NAMES
+
+
+def format_detections(det, shape, is_coco_model, frame=None, names=None):
+    """Convert (n, 6) [x1, y1, x2, y2, conf, cls(, track_id)] detections to /api/detect JSON rows"""
+    if not len(det):
+        return []
+    h, w = shape[:2]
+    det = np.asarray(det, dtype=np.float64)
+    # Normalized x_center y_center width height (YOLO label format)
+    bboxes = np.stack([
+        (det[:, 0] + det[:, 2]) / 2 / w,
+        (det[:, 1] + det[:, 3]) / 2 / h,
+        (det[:, 2] - det[:, 0]) / w,
+        (det[:, 3] - det[:, 1]) / h,
+    ], axis=1).tolist()
+    confidences = det[:, 4].tolist()
+    class_ids = det[:, 5].astype(int).tolist()
+
+    if is_coco_model:
+        # Using COCO model - all objects are considered potential fish
+        rows = [{
+            'class': 0,
+            'class_name': 'Fish',
+            'original_detection': COCO_CLASS_NAMES.get(c, f'class_{c}'),
+            'original_coco_id': c,
+            'confidence': conf,
+            'bbox': bbox,
+            'is_coco': True
+        } for c, conf, bbox in zip(class_ids, confidences, bboxes)]
+    else:
+        names = names or CLASS_NAMES
+        rows = [{
+            'class': c,
+            'class_name': names.get(c, f'Class_{c}'),
+            'confidence': conf,
+            'bbox': bbox,
+            'is_coco': False
+        } for c, conf, bbox in zip(class_ids, confidences, bboxes)]
+    if frame is not None:
+        for row in rows:
+            row['frame'] = frame
+    if det.shape[1] > 6:
+        # Tracked video detections carry the track id in a 7th column
+        for row, track_id in zip(rows, det[:, 6].astype(int).tolist()):
+            row['track_id'] = track_id
+    return rows
@@ -0,0 +1,225 @@
+"""
+Production serving for IKAN Fish Detection
+    gunicorn -c gunicorn.conf.py app:app
+
+The app and the model weights are loaded once in the master and the
+workers are forked from it, so the weights are shared copy-on-write
+instead of loaded per worker (IKAN_STARTUP=preload, the default). With
+IKAN_STARTUP=fast the master only imports the light app module, workers
+answer /api/health within a second and warm up in the background
+(/api/ready turns 200 when done); each worker then holds its own copy. Workers are sized to the CPUs available to
+the container and each gets an equal share of torch intra-op threads.
+With IKAN_AUTOSCALE=1 the master adds a worker (TTIN) while connections
+queue up in the listen backlog and removes one (TTOU) once it stays empty.
+/api/workers and /metrics show RSS / PSS per worker.
+
+Each worker keeps its own in-memory state: decoded uploads (so uploads are
+always written to disk with several workers, IKAN_PERSIST_UPLOADS=0 is
+ignored), the result and media cache budgets (each worker enforces its
+own, so a shared cache folder may grow to workers x budget), and its
+metrics. Workers write metrics snapshots to IKAN_METRICS_DIR (cache/metrics,
+cleared at start) every few seconds and on exit; /metrics sums counters and
+histograms of all workers and reports per-process gauges with a pid label.
+
+Environment:
+    PORT                   listen port (8080)
+    IKAN_WORKERS           worker processes (default: usable cores // 2, at least 1);
+                           live streams (/api/live) need 1 and autoscaling off
+    IKAN_LIVE              1 for the live profile: a single worker, no autoscaling, so
+                           /api/live and the Live UI are available
+    IKAN_TORCH_THREADS     torch intra-op threads per worker (default: cores // workers,
+                           cores // IKAN_MAX_WORKERS with autoscaling)
+    IKAN_WORKER_THREADS    request threads per worker, feeds the micro-batcher (4)
+    IKAN_STARTUP           preload (warm up in the master, share weights) or fast (warm up per worker)
+    IKAN_PRELOAD_WEIGHTS   comma-separated weights loaded during warm-up, or auto: the most used
+                           weights in the detection index, up to IKAN_MODEL_CACHE_SIZE (auto)
+    IKAN_AUTOSCALE         1 to scale between IKAN_MIN_WORKERS and IKAN_MAX_WORKERS
+                           (capped at cores // IKAN_TORCH_THREADS)
+    IKAN_METRICS_DIR       where workers share metrics snapshots (cache/metrics)
+"""
+
+import gc
+import os
+import shutil
+import signal
+import sys
+import threading
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+
+
+def usable_cpus():
+    """CPUs this container may use: affinity mask, capped by a cgroup v2/v1 quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:
+        limit, period = Path('/sys/fs/cgroup/cpu.max').read_text().split()
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            limit = int(Path('/sys/fs/cgroup/cpu/cpu.cfs_quota_us').read_text())
+            period = int(Path('/sys/fs/cgroup/cpu/cpu.cfs_period_us').read_text())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+CPUS = usable_cpus()
+# Live profile: streams are held in one worker's memory, so serve everything from one
+LIVE = os.environ.get('IKAN_LIVE', '0') == '1'
+WORKERS = 1 if LIVE else int(os.environ.get('IKAN_WORKERS', max(1, CPUS // 2)))
+AUTOSCALE = not LIVE and os.environ.get('IKAN_AUTOSCALE', '0') == '1'
+MIN_WORKERS = int(os.environ.get('IKAN_MIN_WORKERS', 1))
+MAX_WORKERS = int(os.environ.get('IKAN_MAX_WORKERS', max(WORKERS, CPUS)))
+# Threads are fixed when a worker starts: size them for the most workers that can run at once
+PEAK_WORKERS = max(WORKERS, MAX_WORKERS) if AUTOSCALE else WORKERS
+TORCH_THREADS = int(os.environ.get('IKAN_TORCH_THREADS', max(1, CPUS // PEAK_WORKERS)))
+# ...and never scale past the point where they would oversubscribe the CPUs
+MAX_WORKERS = min(MAX_WORKERS, max(WORKERS, CPUS // TORCH_THREADS))
+AUTOSCALE_INTERVAL = float(os.environ.get('IKAN_AUTOSCALE_INTERVAL', 5))
+STARTUP = os.environ.get('IKAN_STARTUP', 'preload')
+
+# Gunicorn settings
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = WORKERS
+worker_class = 'gthread'
+threads = int(os.environ.get('IKAN_WORKER_THREADS', 4))
+preload_app = True
+timeout = 300  # cold model loads and large uploads
+graceful_timeout = 60
+keepalive = 5
+accesslog = '-'
+
+# The master never runs inference; one thread keeps OpenMP from starting a
+# thread pool before fork (a forked child can hang on the parent's pool)
+os.environ['OMP_NUM_THREADS'] = '1'
+os.environ['MKL_NUM_THREADS'] = '1'
+# Workers are separate processes: job state and result files must be visible to all of them
+os.environ.setdefault('IKAN_JOB_STATE_DIR', str(BASE_DIR / 'cache' / 'jobs'))
+# Most workers this server can run; live streams are held in one worker's memory and need a single one
+os.environ['IKAN_SERVER_WORKERS'] = str(MAX_WORKERS if AUTOSCALE else WORKERS)
+# Workers write metrics snapshots here, /metrics sums them whichever worker answers
+METRICS_DIR = Path(os.environ.setdefault('IKAN_METRICS_DIR', str(BASE_DIR / 'cache' / 'metrics')))
+
+
+def on_starting(server):
+    # Snapshots of an earlier run (their pids may be reused) would be counted again
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def when_ready(server):
+    """Master, after the app is imported and before the first fork"""
+    os.environ['IKAN_MASTER_PID'] = str(os.getpid())
+    import app as ikan_app  # already imported by preload_app
+
+    if not ikan_app.app.config['PERSIST_UPLOADS'] and ikan_app.app.config['SERVER_WORKERS'] > 1:
+        server.log.warning('IKAN_PERSIST_UPLOADS=0 ignored with several workers: a detect may land on a worker '
+                           'that never saw the upload, so uploads are written to disk')
+    if STARTUP == 'preload':
+        ikan_app.warmup.run()
+        status = ikan_app.warmup.status()
+        server.log.info('Warm-up %s in %.1fs, preloaded %s for copy-on-write sharing', status['state'],
+                        status['time_to_ready_seconds'] or 0, ikan_app.model_registry.loaded_paths())
+        for stage, error in status['errors'].items():
+            server.log.warning('Warm-up stage %s failed: %s', stage, error)
+
+    # Objects created so far (modules, model parameters) are moved out of the
+    # collector's generations so gc passes in workers don't write to, and so
+    # un-share, their pages
+    gc.collect()
+    gc.freeze()
+    server.log.info('%d workers x %d torch threads on %d CPUs (autoscale %s)', WORKERS, TORCH_THREADS, CPUS,
+                    f'{MIN_WORKERS}-{MAX_WORKERS}' if AUTOSCALE else 'off')
+    if AUTOSCALE:
+        threading.Thread(target=_autoscale, args=(server,), name='ikan-autoscale', daemon=True).start()
+
+
+def post_fork(server, worker):
+    import cv2
+    import app as ikan_app
+
+    ikan_app.metrics.reset()  # counted by the master before the fork, not by this worker
+
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(TORCH_THREADS)
+    else:
+        # Fast startup: torch is imported by the worker's warm-up and reads this then
+        os.environ['OMP_NUM_THREADS'] = os.environ['MKL_NUM_THREADS'] = str(TORCH_THREADS)
+    cv2.setNumThreads(1)  # decode/letterbox run on request threads already
+    server.log.info('Worker %s: %d torch threads', worker.pid, TORCH_THREADS)
+
+
+def post_worker_init(worker):
+    import app as ikan_app
+
+    if STARTUP == 'fast':
+        ikan_app.warmup.start()
+    else:
+        # Models came from the master; the first forward pass runs per worker, off the request path
+        threading.Thread(target=ikan_app.warmup_inference, name='ikan-warmup', daemon=True).start()
+
+
+def nworkers_changed(server, new_value, old_value):
+    if old_value is not None:
+        server.log.info('Workers scaled %s -> %s', old_value, new_value)
+
+
+def worker_exit(server, worker):
+    import app as ikan_app
+
+    # Requests since the last periodic snapshot still count once the worker is gone
+    try:
+        ikan_app.metrics.flush()
+    except OSError as e:
+        server.log.warning('Metrics flush on exit failed: %s', e)
+
+
+def child_exit(server, worker):
+    # Snapshots of jobs this worker ran stay readable; running ones will never finish
+    server.log.info('Worker %s exited', worker.pid)
+
+
+def listen_backlog(port):
+    """Connections waiting to be accepted on the listen socket (Linux /proc), None if unknown"""
+    port_hex = f':{int(port):04X}'
+    backlog = None
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            lines = Path(table).read_text().splitlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            # local_address, state 0A = LISTEN, rx_queue = accept queue length
+            if fields[1].endswith(port_hex) and fields[3] == '0A':
+                backlog = (backlog or 0) + int(fields[4].split(':')[1], 16)
+    return backlog
+
+
+def _autoscale(server):
+    """Add a worker while requests queue, drop one after a minute without queueing"""
+    port = bind.rsplit(':', 1)[1]
+    busy = idle = 0
+    while True:
+        threading.Event().wait(AUTOSCALE_INTERVAL)
+        backlog = listen_backlog(port)
+        if backlog is None:
+            server.log.warning('Autoscaling disabled: listen backlog not readable')
+            return
+        busy, idle = (busy + 1, 0) if backlog > 0 else (0, idle + 1)
+        if busy >= 2 and server.num_workers < MAX_WORKERS:
+            os.kill(os.getpid(), signal.SIGTTIN)
+            busy = 0
+        elif idle * AUTOSCALE_INTERVAL >= 60 and server.num_workers > MIN_WORKERS:
+            os.kill(os.getpid(), signal.SIGTTOU)
+            idle = 0
@@ -0,0 +1,363 @@
+"""
+In-process YOLOv5 inference for IKAN Fish Detection
+Keeps model weights loaded and warm between requests instead of
+spawning yolov5/detect.py for every detection
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+BASE_DIR = Path(__file__).parent
+YOLOV5_DIR = BASE_DIR / 'yolov5'
+if str(YOLOV5_DIR) not in sys.path:
+    sys.path.insert(0, str(YOLOV5_DIR))
+
+# Number of warm inference timings kept per model for latency stats
+LATENCY_WINDOW = 200
+
+
+def load_image(filepath):
+    """Read an image from disk as a BGR numpy array (same as detect.py)"""
+    img = cv2.imread(str(filepath))
+    if img is None:
+        # cv2 can't read GIF, fall back to PIL for the first frame
+        try:
+            from PIL import Image
+            with Image.open(filepath) as pil_img:
+                img = cv2.cvtColor(np.asarray(pil_img.convert('RGB')), cv2.COLOR_RGB2BGR)
+        except Exception:
+            raise ValueError(f'Image Not Found {filepath}')
+    return img
+
+
+def percentile(values, q):
+    """Percentile of a list of floats, None if empty"""
+    if not values:
+        return None
+    return float(np.percentile(np.asarray(values, dtype=np.float64), q))
+
+
+class LoadedModel:
+    """A YOLOv5 model held in memory together with its latency stats"""
+
+    def __init__(self, path, model, load_seconds):
+        self.path = path
+        self.model = model
+        self.names = model.names
+        self.stride = model.stride
+        # Exported TorchScript is traced at batch 1, PyTorch and dynamic ONNX take any batch
+        self.dynamic_batch = bool(getattr(model, 'pt', False) or getattr(model, 'onnx', False))
+        self.backend = ('pytorch' if getattr(model, 'pt', False) else
+                        'torchscript' if getattr(model, 'jit', False) else
+                        'onnx' if getattr(model, 'onnx', False) else 'other')
+        self.load_seconds = load_seconds
+        self.cold_inference_seconds = None
+        self.warm_inference_seconds = deque(maxlen=LATENCY_WINDOW)
+        self.inference_count = 0
+        self.last_used = time.time()
+        # Serialize forward passes per model, torch already uses all cores per call
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        """Record the latency of one forward pass"""
+        if self.cold_inference_seconds is None:
+            self.cold_inference_seconds = seconds
+        else:
+            self.warm_inference_seconds.append(seconds)
+        self.inference_count += 1
+        self.last_used = time.time()
+
+    def stats(self):
+        """Cold vs warm latency numbers for this model"""
+        warm = list(self.warm_inference_seconds)
+        return {
+            'path': self.path,
+            'backend': self.backend,
+            'classes': len(self.names),
+            'load_seconds': self.load_seconds,
+            'cold_inference_seconds': self.cold_inference_seconds,
+            'cold_total_seconds': (self.load_seconds + self.cold_inference_seconds
+                                   if self.cold_inference_seconds is not None else None),
+            'warm_inference_mean_seconds': float(np.mean(warm)) if warm else None,
+            'warm_inference_p50_seconds': percentile(warm, 50),
+            'warm_inference_p95_seconds': percentile(warm, 95),
+            'inference_count': self.inference_count,
+            'last_used': self.last_used,
+        }
+
+
+class ModelRegistry:
+    """
+    LRU registry of loaded YOLOv5 models
+    Each weights file is loaded once and reused; when more than
+    max_models are in play the least recently used one is evicted
+    """
+
+    def __init__(self, max_models=2, device=''):
+        self.max_models = max(1, int(max_models))
+        self.device_name = device
+        self.device = None
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.evictions = 0
+
+    def _select_device(self):
+        if self.device is None:
+            from utils.torch_utils import select_device
+            self.device = select_device(self.device_name)
+        return self.device
+
+    def get(self, weights_path):
+        """Return the loaded model for weights_path, loading it if needed"""
+        key = str(weights_path)
+        with self._lock:
+            loaded = self._models.get(key)
+            if loaded is not None:
+                self._models.move_to_end(key)
+                return loaded
+
+        # Only one model loads at a time, re-check after taking the lock
+        with self._load_lock:
+            with self._lock:
+                loaded = self._models.get(key)
+                if loaded is not None:
+                    self._models.move_to_end(key)
+                    return loaded
+
+            from models.common import DetectMultiBackend
+            t0 = time.perf_counter()
+            model = DetectMultiBackend(key, device=self._select_device())
+            model.eval()
+            loaded = LoadedModel(key, model, time.perf_counter() - t0)
+
+            with self._lock:
+                self._models[key] = loaded
+                while len(self._models) > self.max_models:
+                    self._models.popitem(last=False)
+                    self.evictions += 1
+        return loaded
+
+    def evict(self, weights_path):
+        """Drop a model from the registry, returns True if it was loaded"""
+        with self._lock:
+            return self._models.pop(str(weights_path), None) is not None
+
+    def loaded_paths(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def preprocess(self, img0, imgsz, stride):
+        """Letterbox a BGR image into a CHW RGB uint8 array"""
+        from utils.augmentations import letterbox
+        img = letterbox(img0, imgsz, stride=stride, auto=False)[0]
+        img = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        return np.ascontiguousarray(img)
+
+    def prepare(self, loaded, img0, imgsz):
+        """Letterbox one image for a loaded model, returns (array, checked imgsz)"""
+        from utils.general import check_img_size
+        imgsz = check_img_size(imgsz, s=loaded.stride)
+        return self.preprocess(img0, imgsz, loaded.stride), imgsz
+
+    def forward(self, loaded, batch):
+        """One forward pass over a stacked NCHW uint8 batch, returns (input tensor, raw predictions)"""
+        import torch  # imported on first use so the app starts without it
+
+        im = torch.from_numpy(batch).to(loaded.model.device)
+        im = im.half() if loaded.model.fp16 else im.float()
+        im /= 255
+        with loaded.lock, torch.no_grad():
+            t0 = time.perf_counter()
+            if loaded.dynamic_batch or len(im) == 1:
+                pred = self._first(loaded.model(im))
+            else:
+                pred = torch.cat([self._first(loaded.model(im[i:i + 1])) for i in range(len(im))])
+            loaded.record(time.perf_counter() - t0)
+        return im, pred
+
+    @staticmethod
+    def _first(pred):
+        # PyTorch models also return the per-level feature maps
+        return pred[0] if isinstance(pred, (list, tuple)) else pred
+
+    def postprocess(self, pred, input_shape, img0_shapes, conf_thres, iou_thres=0.45, max_det=1000):
+        """
+        Per-image NMS and rescale to original coordinates
+        conf_thres may be a single value or one value per image
+        """
+        from utils.general import non_max_suppression, scale_boxes
+
+        if not isinstance(conf_thres, (list, tuple)):
+            conf_thres = [conf_thres] * len(img0_shapes)
+        detections = []
+        for i, (shape, conf) in enumerate(zip(img0_shapes, conf_thres)):
+            det = non_max_suppression(pred[i:i + 1], conf, iou_thres, max_det=max_det)[0]
+            if len(det):
+                det[:, :4] = scale_boxes(input_shape, det[:, :4], shape).round()
+            detections.append(det.cpu().numpy())
+        return detections
+
+    def infer(self, weights_path, images, imgsz=640, conf_thres=0.25, iou_thres=0.45, max_det=1000):
+        """
+        Run detection on a list of BGR images
+        Returns (detections, timings) where detections is a list of
+        (n, 6) float arrays [x1, y1, x2, y2, conf, cls] in original
+        image coordinates
+        """
+        timings = {}
+        cold = str(weights_path) not in self._models
+        t0 = time.perf_counter()
+        loaded = self.get(weights_path)
+        timings['model_load'] = time.perf_counter() - t0 if cold else 0.0
+        timings['cold'] = cold
+
+        t0 = time.perf_counter()
+        batch = np.stack([self.prepare(loaded, img, imgsz)[0] for img in images])
+        timings['preprocess'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        im, pred = self.forward(loaded, batch)
+        timings['inference'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        detections = self.postprocess(pred, im.shape[2:], [img.shape for img in images],
+                                      conf_thres, iou_thres, max_det)
+        timings['nms'] = time.perf_counter() - t0
+        return detections, timings
+
+    def stats(self):
+        """Registry state plus per-model cold/warm latency"""
+        with self._lock:
+            models = [m.stats() for m in self._models.values()]
+        return {
+            'max_models': self.max_models,
+            'loaded': len(models),
+            'evictions': self.evictions,
+            'models': models,
+        }
+
+
+def draw_detections(img0, det, names, track_ids=None):
+    """
+    Draw boxes without labels on a copy of the image (detect.py --hide-labels)
+    With track_ids each box is labelled #id and coloured by track instead of class
+    """
+    from utils.plots import Annotator, colors
+    annotator = Annotator(img0.copy(), line_width=3, example=str(names))
+    for i in reversed(range(len(det))):
+        *xyxy, conf, cls = det[i, :6]
+        if track_ids is not None:
+            annotator.box_label(xyxy, f'#{int(track_ids[i])}', color=colors(int(track_ids[i]), True))
+        else:
+            annotator.box_label(xyxy, None, color=colors(int(cls), True))
+    return annotator.result()
+
+
+def format_label_lines(det, shape):
+    """Format detections as YOLO label lines: class x y w h conf (normalized)"""
+    h, w = shape[:2]
+    lines = []
+    for x1, y1, x2, y2, conf, cls in reversed(det):
+        xywh = ((x1 + x2) / 2 / w, (y1 + y2) / 2 / h, (x2 - x1) / w, (y2 - y1) / h)
+        line = (cls, *xywh, conf)
+        lines.append(('%g ' * len(line)).rstrip() % line)
+    return lines
+
+
+def in_progress_path(path):
+    """Temporary name an output is written under, its existence tells other server processes to wait"""
+    path = Path(path)
+    return path.with_name(f'.{path.name}.tmp')
+
+
+def save_detection_outputs(img0, det, names, save_dir, name, save_media=True, save_labels=True):
+    """
+    Write annotated image and/or label file in the detect.py output layout
+    img0 may be a decoded image or a path to load it from
+    """
+    save_dir = Path(save_dir)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    if not isinstance(img0, np.ndarray):
+        img0 = load_image(img0)
+    if save_media:
+        # Written under a temporary name so other server processes never serve a partial file
+        ok, encoded = cv2.imencode(Path(name).suffix or '.jpg', draw_detections(img0, det, names))
+        if not ok:
+            raise ValueError(f'Could not encode {name}')
+        tmp = in_progress_path(save_dir / name)
+        tmp.write_bytes(encoded.tobytes())
+        os.replace(tmp, save_dir / name)
+    if save_labels and len(det):
+        labels_dir = save_dir / 'labels'
+        labels_dir.mkdir(exist_ok=True)
+        with open(labels_dir / (Path(name).stem + '.txt'), 'w') as f:
+            f.write('\n'.join(format_label_lines(det, img0.shape)) + '\n')
+    return save_dir / name
+
+
+class OutputWriter:
+    """
+    Background writer for detection side outputs (annotated media, labels)
+    Readers of a file call wait(path) so they never see a half-written file
+    """
+
+    def __init__(self, max_workers=2):
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ikan-writer')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, path, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the background; `path` is the file it produces"""
+        key = str(Path(path).resolve())
+        # Marks the write as in progress for other processes until fn replaces (or we remove) it
+        marker = in_progress_path(path)
+        try:
+            marker.touch()
+        except OSError:
+            pass
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._done(key, f, marker))
+        return future
+
+    def _done(self, key, future, marker):
+        marker.unlink(missing_ok=True)
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def in_progress(self, path, max_age=60):
+        """A write of `path` is pending here or, by its recent marker, in another process"""
+        with self._lock:
+            if str(Path(path).resolve()) in self._pending:
+                return True
+        try:
+            return time.time() - in_progress_path(path).stat().st_mtime < max_age
+        except OSError:
+            return False
+
+    def wait(self, path, timeout=None):
+        """Block until a pending write of `path` finished, returns False on timeout"""
+        with self._lock:
+            future = self._pending.get(str(Path(path).resolve()))
+        if future is None:
+            return True
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            return not future.running()
+        return True
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
@@ -0,0 +1,223 @@
+"""
+In-memory upload ingest for IKAN Fish Detection
+Image uploads are parsed from the multipart body straight into reusable
+buffers (instead of Werkzeug's spooled temp files), the format is
+sniffed from magic bytes and images are decoded in-process (including
+HEIF/HEIC), so no `file`/`sips` subprocess or disk round trip is needed
+before detection
+"""
+
+import io
+import time
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+IMAGE_FORMATS = {'jpeg', 'png', 'gif', 'bmp', 'webp', 'tiff', 'heif'}
+VIDEO_FORMATS = {'mp4', 'mov', 'avi', 'mkv'}
+
+# ISO-BMFF brands (bytes 8:12) of HEIF/HEIC still images
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'hevm', b'hevs', b'mif1', b'msf1'}
+READ_CHUNK = 1024 * 1024
+
+
+def sniff_format(header):
+    """Detect the container format from the first bytes of a file, None if unknown"""
+    header = bytes(header[:16])
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if header.startswith(b'BM'):
+        return 'bmp'
+    if header.startswith((b'II*\x00', b'MM\x00*')):
+        return 'tiff'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'webp'
+    if header.startswith(b'RIFF') and header[8:12] == b'AVI ':
+        return 'avi'
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'mkv'
+    if header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand in HEIF_BRANDS:
+            return 'heif'
+        return 'mov' if brand == b'qt  ' else 'mp4'
+    return None
+
+
+class BufferPool:
+    """
+    Reusable bytearrays for reading uploads
+    Buffers grow for large uploads and are handed back after each request
+    instead of allocating a new bytes object per upload; a grown buffer is
+    shrunk back to initial_size on release so idle pools stay small
+    """
+
+    def __init__(self, initial_size=4 * 1024 * 1024, max_buffers=8):
+        self.initial_size = initial_size
+        self.max_buffers = max_buffers
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return bytearray(self.initial_size)
+
+    def release(self, buf):
+        if len(buf) > self.initial_size:
+            try:
+                del buf[self.initial_size:]
+            except BufferError:
+                return  # still exported by a memoryview, let it go
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buf)
+
+    def open(self):
+        """A writable in-memory file on a pooled buffer, for the multipart parser to stream a part into"""
+        return PooledFile(self)
+
+    def read_stream(self, stream, buf):
+        """Read a whole stream into buf (growing it if needed), returns (buf, size)"""
+        size = 0
+        while True:
+            if size == len(buf):
+                buf.extend(bytes(max(len(buf), READ_CHUNK)))
+            with memoryview(buf) as view:
+                n = stream.readinto(view[size:])
+            if not n:
+                return buf, size
+            size += n
+
+
+class PooledFile(io.RawIOBase):
+    """
+    Seekable read/write file backed by a buffer from a BufferPool
+    getbuffer() exposes the written bytes without a copy; close() hands the
+    buffer back to the pool (Werkzeug closes request files after the response)
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.buf = pool.acquire()
+        self.size = 0
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def write(self, data):
+        end = self.pos + len(data)
+        if end > len(self.buf):
+            self.buf.extend(bytes(max(end - len(self.buf), len(self.buf), READ_CHUNK)))
+        self.buf[self.pos:end] = data
+        self.pos = end
+        self.size = max(self.size, end)
+        return len(data)
+
+    def readinto(self, b):
+        n = max(0, min(len(b), self.size - self.pos))
+        with memoryview(self.buf) as view:
+            b[:n] = view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def getbuffer(self):
+        """The written bytes as a memoryview (release it before close)"""
+        return memoryview(self.buf)[:self.size]
+
+    def close(self):
+        if self.buf is not None:
+            self.pool.release(self.buf)
+            self.buf = None
+        super().close()
+
+
+def decode_image(data, fmt):
+    """Decode an in-memory image to a BGR numpy array"""
+    if fmt == 'heif':
+        try:
+            import pillow_heif
+        except ImportError:
+            raise ValueError('HEIF/HEIC uploads need pillow-heif (pip install pillow-heif)')
+        heif = pillow_heif.open_heif(io.BytesIO(data))
+        img = np.asarray(heif.to_pillow().convert('RGB'))
+        return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        # cv2 can't decode GIF, fall back to PIL for the first frame
+        try:
+            from PIL import Image
+            with Image.open(io.BytesIO(data)) as pil_img:
+                img = cv2.cvtColor(np.asarray(pil_img.convert('RGB')), cv2.COLOR_RGB2BGR)
+        except Exception:
+            raise ValueError(f'Image Not Found: cannot decode {fmt or "unknown"} data')
+    return img
+
+
+class StoredUpload:
+    """A decoded upload kept in memory for the following /api/detect"""
+
+    def __init__(self, image, content_hash, fmt):
+        self.image = image
+        self.content_hash = content_hash
+        self.format = fmt
+        self.nbytes = image.nbytes
+        self.created_at = time.time()
+
+
+class UploadStore:
+    """LRU of decoded uploads bounded by total decoded bytes"""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, name, image, content_hash, fmt):
+        item = StoredUpload(image, content_hash, fmt)
+        with self._lock:
+            old = self._items.pop(name, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            if item.nbytes > self.max_bytes:
+                return item
+            self._items[name] = item
+            self._bytes += item.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return item
+
+    def get(self, name):
+        with self._lock:
+            item = self._items.get(name)
+            if item is not None:
+                self._items.move_to_end(name)
+            return item
+
+    def stats(self):
+        with self._lock:
+            return {'uploads': len(self._items), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,317 @@
+"""
+Background job subsystem for IKAN Fish Detection
+Long-running work (video detection) is submitted to a bounded worker
+pool; clients poll the job for progress instead of holding a request open
+With a state_dir, job snapshots are shared between server processes so
+any worker can answer a poll or cancel for a job another worker runs
+"""
+
+import json
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = {DONE, FAILED, CANCELLED}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function when the job has been cancelled"""
+
+
+# Partial detections kept per job; older rows are summarized and dropped
+MAX_JOB_DETECTIONS = 5000
+# Minimum seconds between two shared snapshots of a running job
+SNAPSHOT_INTERVAL = 0.5
+
+
+class Job:
+    """
+    State of one background job, updated by its worker and read by the API
+    Only the latest max_detections rows are kept, a per-class summary
+    covers everything seen so memory stays flat on long videos
+    """
+
+    def __init__(self, kind, params=None, max_detections=MAX_JOB_DETECTIONS):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.frames_done = 0
+        self.total_frames = None
+        self.detections = []
+        self.detections_dropped = 0
+        self.max_detections = max_detections
+        self.summary = {}
+        self.result = None
+        self.error = None
+        self.future = None
+        # uploads/ and results/ entries the job reads or writes (kept by the storage manager)
+        self.files = set()
+        self._cancel = threading.Event()
+        self._cleanup = []
+        self._lock = threading.Lock()
+        self._on_update = None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Call between units of work; raises JobCancelled once cancel() was requested"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def uses(self, *names):
+        """Mark uploads/ or results/ entries as in use until the job finishes"""
+        self.files.update(str(name) for name in names)
+
+    def on_cancel(self, fn):
+        """Register a cleanup callback run when the job is cancelled"""
+        self._cleanup.append(fn)
+
+    def progress(self, frames_done, detections=None):
+        """Report progress from the worker"""
+        with self._lock:
+            self.frames_done = frames_done
+            if detections:
+                self.detections.extend(detections)
+                for det in detections:
+                    entry = self.summary.setdefault(det.get('class_name'), {'count': 0, 'confidence_sum': 0.0})
+                    entry['count'] += 1
+                    entry['confidence_sum'] += det.get('confidence', 0)
+                # Trim in chunks so the list isn't copied on every frame
+                overflow = len(self.detections) - self.max_detections
+                if overflow > self.max_detections // 2:
+                    del self.detections[:overflow]
+                    self.detections_dropped += overflow
+        if self._on_update is not None:
+            self._on_update(self)
+
+    def summarize(self):
+        """Per-class count and mean confidence over all detections so far"""
+        with self._lock:
+            return {name: {'count': e['count'], 'mean_confidence': e['confidence_sum'] / e['count']}
+                    for name, e in self.summary.items()}
+
+    def fps(self):
+        if not self.started_at or not self.frames_done:
+            return None
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.frames_done / elapsed if elapsed > 0 else None
+
+    def to_dict(self, since=0, include_detections=True):
+        """
+        JSON view of the job; detections are returned from absolute index
+        `since` on (rows already dropped from the window are skipped)
+        """
+        with self._lock:
+            start = max(0, since - self.detections_dropped)
+            partial = self.detections[start:] if include_detections else []
+            detections_total = self.detections_dropped + len(self.detections)
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'frames_done': self.frames_done,
+            'total_frames': self.total_frames,
+            'progress': (self.frames_done / self.total_frames) if self.total_frames else None,
+            'fps': self.fps(),
+            'detections_total': detections_total,
+            'detections_next': detections_total,
+            'detections': partial,
+            'summary': self.summarize(),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'files': sorted(self.files),
+        }
+        if self.result is not None:
+            data['result'] = self.result
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+
+class SharedJob:
+    """Read-only view of a job run by another server process, from its snapshot"""
+
+    def __init__(self, data):
+        self.data = data
+        self.id = data['job_id']
+        self.kind = data.get('kind')
+        self.status = data.get('status')
+        self.created_at = data.get('created_at') or 0
+        self.files = set(data.get('files') or [])
+
+    def to_dict(self, since=0, include_detections=True):
+        data = dict(self.data)
+        detections = data.get('detections') or []
+        dropped = data.get('detections_total', len(detections)) - len(detections)
+        data['detections'] = detections[max(0, since - dropped):] if include_detections else []
+        return data
+
+
+class JobManager:
+    """
+    Bounded worker pool for jobs
+    Only the most recent max_jobs jobs are remembered; older finished
+    jobs are forgotten together with their partial detections
+    state_dir (optional) holds <job_id>.json snapshots and .cancel markers
+    shared by all server processes
+    """
+
+    def __init__(self, max_workers=2, max_jobs=100, state_dir=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_jobs = max(1, int(max_jobs))
+        self.state_dir = Path(state_dir) if state_dir else None
+        if self.state_dir is not None:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ikan-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, params=None, files=()):
+        """Queue fn(job) on the worker pool, returns the Job immediately"""
+        job = Job(kind, params)
+        job.uses(*files)
+        if self.state_dir is not None:
+            job._snapshot_at = 0.0
+            job._on_update = self._snapshot
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.future = self._executor.submit(self._run, job, fn)
+        self._snapshot(job, force=True)
+        return job
+
+    def _snapshot(self, job, force=False):
+        """Publish the job's state for other processes and pick up their cancel requests"""
+        if self.state_dir is None:
+            return
+        now = time.monotonic()
+        if not force and now - job._snapshot_at < SNAPSHOT_INTERVAL:
+            return
+        job._snapshot_at = now
+        if not job.cancelled and (self.state_dir / f'{job.id}.cancel').exists():
+            job._cancel.set()
+        path = self.state_dir / f'{job.id}.json'
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(job.to_dict(), f, default=str)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # sharing is best effort, the owning process still has the job
+
+    def _load_shared(self, job_id):
+        if self.state_dir is None or not job_id.isalnum():
+            return None
+        try:
+            with open(self.state_dir / f'{job_id}.json') as f:
+                return SharedJob(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _run(self, job, fn):
+        if self.state_dir is not None and (self.state_dir / f'{job.id}.cancel').exists():
+            job._cancel.set()  # cancelled through another process while queued
+        if job.cancelled:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            self._release(job)
+            self._snapshot(job, force=True)
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._snapshot(job, force=True)
+        try:
+            job.result = fn(job)
+            job.status = CANCELLED if job.cancelled else DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            if job.status == CANCELLED:
+                self._release(job)
+            self._snapshot(job, force=True)
+
+    def _release(self, job):
+        """Run cleanup callbacks and drop partial results of a cancelled job"""
+        for fn in job._cleanup:
+            try:
+                fn()
+            except Exception:
+                pass
+        job._cleanup = []
+        with job._lock:
+            job.detections = []
+            job.summary = {}
+
+    def _prune(self):
+        # Forget the oldest finished jobs beyond max_jobs
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].status in FINISHED_STATES:
+                del self._jobs[job_id]
+                if self.state_dir is not None:
+                    for suffix in ('.json', '.cancel'):
+                        (self.state_dir / f'{job_id}{suffix}').unlink(missing_ok=True)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load_shared(job_id)
+
+    def list(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if self.state_dir is not None:
+            local = {job.id for job in jobs}
+            snapshots = sorted(self.state_dir.glob('*.json'), key=lambda p: p.stat().st_mtime)[-self.max_jobs:]
+            shared = (self._load_shared(p.stem) for p in snapshots if p.stem not in local)
+            jobs = sorted(jobs + [job for job in shared if job is not None], key=lambda job: job.created_at)
+        return jobs
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job, returns the Job or None"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if isinstance(job, SharedJob):
+            # Owned by another process, it picks the marker up with its next snapshot
+            if job.status not in FINISHED_STATES:
+                (self.state_dir / f'{job_id}.cancel').touch()
+            return job
+        if job.status in FINISHED_STATES:
+            return job
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            # Never started, nothing is holding resources yet
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            self._release(job)
+        return job
+
+    def referenced_files(self):
+        """uploads/ and results/ entries used by queued or running jobs of any process"""
+        return {name for job in self.list() if job.status not in FINISHED_STATES for name in job.files}
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
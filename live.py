@@ -0,0 +1,407 @@
+"""
+Live stream detection for IKAN Fish Detection
+Reads an RTSP / HTTP MJPEG URL, a local camera device or (as a stand-in)
+a video file played back in real time. Only the newest frame is kept
+between capture and inference, stale frames are dropped so latency stays
+bounded; annotated frames are served as MJPEG and per-frame detections
+as server-sent events.
+
+Stand-in camera from a video file (MJPEG over HTTP, loops forever):
+    python live.py standin dive.mp4 --port 8090
+    -> source http://localhost:8090/stream.mjpg (the app needs IKAN_LIVE_ALLOWED_HOSTS=localhost)
+
+Measure latency / drop rate without the web app:
+    python live.py run http://localhost:8090/stream.mjpg --seconds 30
+"""
+
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+import cv2
+
+from inference import draw_detections, percentile
+
+# Latency samples kept per stream
+LATENCY_WINDOW = 500
+# Events buffered per SSE subscriber before the oldest are dropped
+SUBSCRIBER_QUEUE = 16
+JPEG_QUALITY = 80
+# Looping file sources: consecutive failed reads (with backoff) before the stream is marked failed
+MAX_READ_FAILURES = 8
+READ_BACKOFF_MAX = 2.0
+
+
+def open_capture(source):
+    """cv2.VideoCapture for a device index ('0'), URL or file path"""
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        cap = cv2.VideoCapture(int(source))
+    else:
+        cap = cv2.VideoCapture(str(source))
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # don't let the driver queue up old frames
+    return cap
+
+
+def is_file_source(source):
+    return isinstance(source, (str, Path)) and not str(source).isdigit() and '://' not in str(source)
+
+
+class LiveStream:
+    """
+    One live source: capture -> (latest frame slot) -> detect + annotate -> subscribers
+    detect(img0) returns (n, 6) detections; formatter(det, shape, frame) JSON rows
+    """
+
+    def __init__(self, source, detect, names, formatter=None, tracker=None, realtime=None, loop=True,
+                 stream_id=None):
+        self.id = stream_id or uuid.uuid4().hex[:12]
+        self.source = source
+        self.detect = detect
+        self.names = names
+        self.formatter = formatter
+        self.tracker = tracker
+        # Files are paced at their own FPS to behave like a camera
+        self.realtime = is_file_source(source) if realtime is None else realtime
+        self.loop = loop
+        self.started_at = None
+        self.error = None
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.source_fps = None
+        self.width = self.height = None
+        self._latest = None  # (index, captured_at, frame) waiting for inference
+        self._latest_cond = threading.Condition()
+        self._jpeg = None  # (seq, bytes) newest annotated frame
+        self._jpeg_cond = threading.Condition()
+        self._subscribers = set()
+        self._sub_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pipeline_ms = deque(maxlen=LATENCY_WINDOW)
+        self._inference_ms = deque(maxlen=LATENCY_WINDOW)
+        self._client_ms = deque(maxlen=LATENCY_WINDOW)
+        self._processed_at = deque(maxlen=LATENCY_WINDOW)
+        self._threads = []
+
+    # Lifecycle
+
+    def start(self):
+        self.started_at = time.time()
+        cap = open_capture(self.source)
+        if not cap.isOpened():
+            raise ValueError(f'Cannot open live source: {self.source}')
+        self.source_fps = cap.get(cv2.CAP_PROP_FPS) or None
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or None
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None
+        self._threads = [
+            threading.Thread(target=self._guard, args=(self._capture, cap), name=f'ikan-live-capture-{self.id}',
+                             daemon=True),
+            threading.Thread(target=self._guard, args=(self._process,), name=f'ikan-live-detect-{self.id}',
+                             daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._latest_cond:
+            self._latest_cond.notify_all()
+        with self._jpeg_cond:
+            self._jpeg_cond.notify_all()
+        self._publish(None)  # ends SSE generators
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def _guard(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.stop()
+
+    # Capture: always overwrite the slot, a frame still in it was never processed -> dropped
+
+    def _capture(self, cap):
+        interval = 1 / self.source_fps if self.realtime and self.source_fps else 0
+        next_at = time.perf_counter()
+        failures = 0
+        try:
+            while not self._stop.is_set():
+                ok, frame = cap.read()
+                if not ok:
+                    if not (self.realtime and self.loop):
+                        break
+                    # End of file: rewind. A truncated / undecodable file fails again right away
+                    failures += 1
+                    if failures > MAX_READ_FAILURES:
+                        raise RuntimeError(f'Live source unreadable after {MAX_READ_FAILURES} attempts')
+                    if failures > 1:
+                        self._stop.wait(min(READ_BACKOFF_MAX, 0.05 * 2 ** (failures - 2)))
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    next_at = time.perf_counter()
+                    continue
+                failures = 0
+                if interval:
+                    # Stand-in camera: a frame "exists" only once its time has come
+                    next_at += interval
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_at = time.perf_counter()
+                captured_at = time.time()
+                self.frames_captured += 1
+                with self._latest_cond:
+                    if self._latest is not None:
+                        self.frames_dropped += 1
+                    self._latest = (self.frames_captured, captured_at, frame)
+                    self._latest_cond.notify()
+        finally:
+            cap.release()
+
+    def _take_latest(self):
+        with self._latest_cond:
+            while self._latest is None and not self._stop.is_set():
+                self._latest_cond.wait(0.5)
+            item, self._latest = self._latest, None
+            return item
+
+    def _process(self):
+        while not self._stop.is_set():
+            item = self._take_latest()
+            if item is None:
+                continue
+            index, captured_at, frame = item
+            t0 = time.perf_counter()
+            det = self.detect(frame)
+            self._inference_ms.append((time.perf_counter() - t0) * 1000)
+            track_ids = None
+            if self.tracker is not None:
+                det = self.tracker.update(det, index)
+                track_ids = det[:, 6]
+            annotated = draw_detections(frame, det, self.names, track_ids)
+            ok, jpeg = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                continue
+            ready_at = time.time()
+            pipeline_ms = (ready_at - captured_at) * 1000
+            self._pipeline_ms.append(pipeline_ms)
+            self._processed_at.append(ready_at)
+            self.frames_processed += 1
+            with self._jpeg_cond:
+                self._jpeg = (index, jpeg.tobytes())
+                self._jpeg_cond.notify_all()
+            rows = self.formatter(det, frame.shape, index) if self.formatter else det.tolist()
+            self._publish({'frame': index, 'captured_at': captured_at * 1000, 'ready_at': ready_at * 1000,
+                           'pipeline_ms': pipeline_ms, 'detections': rows})
+
+    # Subscribers
+
+    def _publish(self, event):
+        with self._sub_lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            # Slow clients lose old events, never block the detector
+            while True:
+                try:
+                    q.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def events(self, heartbeat=15):
+        """Generator of SSE messages until the stream stops or the client goes away"""
+        q = queue.Queue(SUBSCRIBER_QUEUE)
+        with self._sub_lock:
+            self._subscribers.add(q)
+        try:
+            yield f'event: stats\ndata: {json.dumps(self.stats())}\n\n'
+            while self.running:
+                try:
+                    event = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is None:
+                    break
+                # sent_at lets the client time capture -> paint without comparing clocks
+                yield f"data: {json.dumps({**event, 'sent_at': time.time() * 1000})}\n\n"
+            yield f'event: end\ndata: {json.dumps(self.stats())}\n\n'
+        finally:
+            with self._sub_lock:
+                self._subscribers.discard(q)
+
+    def mjpeg(self, boundary='frame'):
+        """Generator of multipart/x-mixed-replace parts, each newest annotated frame once"""
+        last_seq = None
+        while self.running:
+            with self._jpeg_cond:
+                while self.running and (self._jpeg is None or self._jpeg[0] == last_seq):
+                    self._jpeg_cond.wait(1.0)
+                if not self.running:
+                    break
+                last_seq, jpeg = self._jpeg
+            yield (f'--{boundary}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n').encode() \
+                + jpeg + b'\r\n'
+
+    def report_client_latency(self, event_latency_ms):
+        """Capture -> detection event painted in the browser, measured by the client"""
+        self._client_ms.append(float(event_latency_ms))
+
+    def stats(self):
+        processed = list(self._processed_at)
+        fps = None
+        if len(processed) > 1 and processed[-1] > processed[0]:
+            fps = (len(processed) - 1) / (processed[-1] - processed[0])
+        pipeline, inference, client = list(self._pipeline_ms), list(self._inference_ms), list(self._client_ms)
+        return {
+            'stream_id': self.id,
+            'source': str(self.source),
+            'running': self.running,
+            'error': self.error,
+            'started_at': self.started_at,
+            'source_fps': self.source_fps,
+            'width': self.width,
+            'height': self.height,
+            'frames_captured': self.frames_captured,
+            'frames_processed': self.frames_processed,
+            'frames_dropped': self.frames_dropped,
+            'drop_rate': self.frames_dropped / self.frames_captured if self.frames_captured else None,
+            'processed_fps': fps,
+            'pipeline_latency_ms_p50': percentile(pipeline, 50),
+            'pipeline_latency_ms_p95': percentile(pipeline, 95),
+            'inference_ms_p50': percentile(inference, 50),
+            'event_latency_ms_p50': percentile(client, 50),
+            'event_latency_ms_p95': percentile(client, 95),
+            'subscribers': len(self._subscribers),
+            'tracking': self.tracker.summary()['unique_counts'] if self.tracker is not None else None,
+        }
+
+
+class LiveManager:
+    """Running live streams, at most max_streams at a time"""
+
+    def __init__(self, max_streams=2):
+        self.max_streams = max(1, int(max_streams))
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def start(self, stream):
+        with self._lock:
+            for stream_id in [k for k, s in self._streams.items() if not s.running]:
+                del self._streams[stream_id]
+            if len(self._streams) >= self.max_streams:
+                raise RuntimeError(f'Too many live streams (max {self.max_streams}), stop one first')
+            self._streams[stream.id] = stream
+        try:
+            return stream.start()
+        except Exception:
+            with self._lock:
+                self._streams.pop(stream.id, None)
+            raise
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._streams.values())
+
+    def stop(self, stream_id):
+        stream = self.get(stream_id)
+        if stream is not None:
+            stream.stop()
+        return stream
+
+
+def serve_standin(video, port=8090, fps=None):
+    """Serve a video file as an endless real-time MJPEG stream (a stand-in IP camera)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/stream.mjpg':
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+            self.end_headers()
+            cap = cv2.VideoCapture(str(video))
+            interval = 1 / (fps or cap.get(cv2.CAP_PROP_FPS) or 25)
+            next_at = time.perf_counter()
+            try:
+                while True:
+                    ok, frame = cap.read()
+                    if not ok:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    next_at += interval
+                    time.sleep(max(0.0, next_at - time.perf_counter()))
+                    jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])[1].tobytes()
+                    self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                                     + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                cap.release()
+
+        def log_message(self, *args):
+            pass
+
+    print(f'Stand-in stream of {video} at http://localhost:{port}/stream.mjpg')
+    ThreadingHTTPServer(('0.0.0.0', port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Live stream stand-in and latency measurement')
+    sub = parser.add_subparsers(dest='command', required=True)
+    standin = sub.add_parser('standin', help='serve a video file as a live MJPEG stream')
+    standin.add_argument('video')
+    standin.add_argument('--port', type=int, default=8090)
+    standin.add_argument('--fps', type=float, default=None)
+    run = sub.add_parser('run', help='detect on a live source and report latency / drop rate')
+    run.add_argument('source', help='rtsp://, http:// MJPEG URL, device index or video file')
+    run.add_argument('--weights', default='yolov5s.pt')
+    run.add_argument('--imgsz', type=int, default=640)
+    run.add_argument('--conf-thres', type=float, default=0.4)
+    run.add_argument('--seconds', type=float, default=30)
+    run.add_argument('--device', default='')
+    opt = parser.parse_args()
+
+    if opt.command == 'standin':
+        serve_standin(opt.video, opt.port, opt.fps)
+    else:
+        from inference import ModelRegistry
+
+        registry = ModelRegistry(max_models=1, device=opt.device)
+        loaded = registry.get(opt.weights)
+
+        def detect(img0):
+            return registry.infer(opt.weights, [img0], imgsz=opt.imgsz, conf_thres=opt.conf_thres)[0][0]
+
+        stream = LiveStream(opt.source, detect, loaded.names).start()
+        try:
+            deadline = time.time() + opt.seconds
+            while time.time() < deadline and stream.running:
+                time.sleep(1)
+                s = stream.stats()
+                print(f"captured {s['frames_captured']} processed {s['frames_processed']} "
+                      f"dropped {s['drop_rate'] or 0:.1%} fps {s['processed_fps'] or 0:.1f} "
+                      f"latency p50 {s['pipeline_latency_ms_p50'] or 0:.0f} ms")
+        finally:
+            stream.stop()
+        print(json.dumps(stream.stats(), indent=2))
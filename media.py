@@ -0,0 +1,259 @@
+"""
+Result media delivery for IKAN Fish Detection
+Thumbnails and web-sized previews of images and videos are rendered
+once and kept in a bounded on-disk LRU keyed by the source's path, size
+and mtime (or content hash for uploads held only in memory). Annotated
+videos are rewritten for progressive playback: H.264 with the moov atom
+first when ffmpeg is available, otherwise the mp4 atoms are reordered
+in place so the browser can start playing before the download ends.
+"""
+
+import hashlib
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+
+# Longest edge of each variant
+VARIANTS = {'thumb': 320, 'preview': 1280}
+JPEG_QUALITY = 82
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv'}
+# Atoms that contain the chunk offset tables (stco / co64) under moov
+_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+COPY_CHUNK = 1024 * 1024
+
+
+def resize_longest(img, size):
+    """Downscale so the longest edge is at most size (never upscales)"""
+    h, w = img.shape[:2]
+    scale = size / max(h, w)
+    if scale >= 1:
+        return img
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def poster_frame(path):
+    """A representative frame of a video (10% in, past fade-ins), None if unreadable"""
+    cap = cv2.VideoCapture(str(path))
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total > 10:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, total // 10)
+        ok, frame = cap.read()
+        if not ok:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = cap.read()
+        return frame if ok else None
+    finally:
+        cap.release()
+
+
+class MediaCache:
+    """Rendered thumbnails / previews as JPEG files, LRU bounded by total bytes"""
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max(0, int(max_bytes))
+        self._files = OrderedDict()  # name -> size, LRU order
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._rendering = {}  # name -> Lock, one render per variant at a time
+        self.counters = {'hits': 0, 'renders': 0, 'evictions': 0}
+        for path in sorted(self.cache_dir.glob('*.jpg'), key=lambda p: p.stat().st_mtime):
+            self._files[path.name] = path.stat().st_size
+            self._bytes += self._files[path.name]
+
+    @staticmethod
+    def _name(source_key, variant):
+        return hashlib.sha1(f'{source_key}:{variant}:{VARIANTS[variant]}'.encode()).hexdigest()[:24] + '.jpg'
+
+    def variant_of_file(self, path, variant):
+        """Path of the cached variant of an image or video file, rendered on first use; None if unreadable"""
+        path = Path(path)
+        st = path.stat()
+        source_key = f'{path.resolve()}:{st.st_size}:{st.st_mtime_ns}'
+
+        def render():
+            if path.suffix.lower() in VIDEO_EXTENSIONS:
+                return poster_frame(path)
+            return cv2.imread(str(path))
+
+        return self._get(source_key, variant, render)
+
+    def variant_of_array(self, img, content_hash, variant):
+        """Cached variant of an in-memory image identified by its content hash"""
+        return self._get(content_hash, variant, lambda: img)
+
+    def _get(self, source_key, variant, render):
+        if variant not in VARIANTS:
+            raise ValueError(f"Unknown size '{variant}', use one of: {', '.join(VARIANTS)}")
+        name = self._name(source_key, variant)
+        path = self.cache_dir / name
+        with self._lock:
+            if name in self._files and path.exists():
+                self._files.move_to_end(name)
+                self.counters['hits'] += 1
+                return path
+            render_lock = self._rendering.setdefault(name, threading.Lock())
+        try:
+            with render_lock:
+                # Concurrent requests for the same variant wait for one render; rendered by
+                # another process (or before a restart): count it against the budget from now on
+                try:
+                    size = path.stat().st_size
+                except OSError:
+                    size = None
+                if size is not None:
+                    with self._lock:
+                        self.counters['hits'] += 1
+                        self._add(name, size)
+                    return path
+                img = render()
+                if img is None:
+                    return None
+                ok, encoded = cv2.imencode('.jpg', resize_longest(img, VARIANTS[variant]),
+                                           [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                if not ok:
+                    return None
+                tmp = path.with_name(f'{name}.{os.getpid()}.tmp')
+                tmp.write_bytes(encoded.tobytes())
+                os.replace(tmp, path)
+        finally:
+            with self._lock:
+                self._rendering.pop(name, None)
+        with self._lock:
+            self.counters['renders'] += 1
+            self._add(name, len(encoded))
+        return path
+
+    def _add(self, name, size):
+        """Record a variant as most recently used and evict down to max_bytes (caller holds the lock)"""
+        self._bytes -= self._files.pop(name, 0)
+        self._files[name] = size
+        self._bytes += size
+        while self.max_bytes and self._bytes > self.max_bytes and len(self._files) > 1:
+            old, old_size = self._files.popitem(last=False)
+            self._bytes -= old_size
+            (self.cache_dir / old).unlink(missing_ok=True)
+            self.counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'files': len(self._files), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+# Progressive video
+
+def _atoms(data_or_file, start, end):
+    """(type, offset, size, header size) of the atoms between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        if isinstance(data_or_file, (bytes, bytearray)):
+            header = bytes(data_or_file[pos:pos + 16])
+        else:
+            data_or_file.seek(pos)
+            header = data_or_file.read(16)
+        size, kind = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise ValueError(f'Corrupt mp4 atom {kind!r} at {pos}')
+        yield kind, pos, size, header_size
+        pos += size
+
+
+def _shift_chunk_offsets(moov, shift, start=0, end=None):
+    """Add shift to every stco / co64 entry inside a moov atom (in place)"""
+    end = len(moov) if end is None else end
+    for kind, pos, size, header_size in _atoms(moov, start, end):
+        if kind in _CONTAINERS:
+            _shift_chunk_offsets(moov, shift, pos + header_size, pos + size)
+        elif kind in (b'stco', b'co64'):
+            count = struct.unpack_from('>I', moov, pos + header_size + 4)[0]
+            table = pos + header_size + 8
+            fmt, width = ('>I', 4) if kind == b'stco' else ('>Q', 8)
+            for i in range(count):
+                value = struct.unpack_from(fmt, moov, table + i * width)[0] + shift
+                if kind == b'stco' and value > 0xFFFFFFFF:
+                    raise ValueError('Chunk offsets exceed 32 bits, needs co64')
+                struct.pack_into(fmt, moov, table + i * width, value)
+
+
+def faststart(path):
+    """
+    Move the moov atom of an mp4 in front of mdat (like qt-faststart)
+    Returns True if the file is fast-start afterwards
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    with open(path, 'rb') as f:
+        atoms = list(_atoms(f, 0, size))
+        kinds = [a[0] for a in atoms]
+        if b'moov' not in kinds or b'mdat' not in kinds:
+            return False
+        if kinds.index(b'moov') < kinds.index(b'mdat'):
+            return True
+        moov_atom = atoms[kinds.index(b'moov')]
+        f.seek(moov_atom[1])
+        moov = bytearray(f.read(moov_atom[2]))
+        # Everything from the first mdat on moves back by the moov size
+        _shift_chunk_offsets(moov, len(moov), moov_atom[3])
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            with open(tmp, 'wb') as out:
+                written_moov = False
+                for kind, pos, atom_size, _ in atoms:
+                    if kind == b'moov':
+                        continue
+                    if kind == b'mdat' and not written_moov:
+                        out.write(moov)
+                        written_moov = True
+                    f.seek(pos)
+                    remaining = atom_size
+                    while remaining:
+                        chunk = f.read(min(COPY_CHUNK, remaining))
+                        if not chunk:
+                            raise ValueError('Truncated mp4')
+                        out.write(chunk)
+                        remaining -= len(chunk)
+            os.replace(tmp, path)
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            raise
+    return True
+
+
+def make_streamable(path, ffmpeg=None):
+    """
+    Rewrite an annotated video for progressive playback
+    With ffmpeg: H.264 (plays in every browser, OpenCV writes mp4v) + faststart
+    Returns 'h264', 'faststart' or None if the file was left unchanged
+    """
+    path = Path(path)
+    ffmpeg = shutil.which(ffmpeg) if ffmpeg else None
+    if ffmpeg:
+        tmp = path.with_name(f'{path.stem}.{os.getpid()}.h264{path.suffix}')
+        try:
+            subprocess.run([ffmpeg, '-y', '-v', 'error', '-i', str(path), '-c:v', 'libx264', '-preset', 'veryfast',
+                            '-crf', '23', '-pix_fmt', 'yuv420p', '-movflags', '+faststart', '-an', str(tmp)],
+                           check=True, capture_output=True, timeout=3600)
+            os.replace(tmp, path)
+            return 'h264'
+        except (OSError, subprocess.SubprocessError) as e:
+            tmp.unlink(missing_ok=True)
+            print(f'ffmpeg transcode failed, falling back to faststart: {e}')
+    try:
+        return 'faststart' if faststart(path) else None
+    except (OSError, ValueError) as e:
+        print(f'Could not make {path.name} streamable: {e}')
+        return None
@@ -0,0 +1,440 @@
+"""
+Prometheus-style metrics and per-request stage tracing for IKAN Fish Detection
+Histograms, counters and callback gauges rendered in the Prometheus text
+exposition format (no prometheus_client dependency), plus a Trace that
+times the stages of one request
+
+With several server processes each one writes a snapshot of its metrics to
+a shared directory; whichever worker answers /metrics sums the counters
+and histograms of all of them (exited workers included, so totals never go
+back) and reports per-process gauges with a pid label.
+"""
+
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+# Seconds, from sub-millisecond preprocessing up to cold model loads
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def merge(total, snapshot):
+        for key, value in snapshot:
+            total[tuple(key)] = total.get(tuple(key), 0) + value
+
+    def render(self, values=None):
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        return self.header() + [f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}'
+                                for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(k), [*v[0]], v[1], v[2]] for k, v in self._series.items()]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def merge(total, snapshot):
+        for key, counts, value_sum, count in snapshot:
+            series = total.get(tuple(key))
+            if series is None:
+                total[tuple(key)] = ([*counts], value_sum, count)
+            else:
+                total[tuple(key)] = ([a + b for a, b in zip(series[0], counts)], series[1] + value_sum,
+                                     series[2] + count)
+
+    def render(self, series=None):
+        if series is None:
+            with self._lock:
+                series = {k: ([*v[0]], v[1], v[2]) for k, v in self._series.items()}
+        lines = self.header()
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Value read at scrape time from a callback
+    fn returns a number, or a dict of label-value tuples to numbers
+    per_process: the value describes this process only (queues, caches, memory); with a
+    shared directory every live process reports its own, labelled by pid
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, fn, labelnames=(), per_process=False):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+        self.per_process = per_process
+
+    def values(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return {}  # a failing collector must not break the whole scrape
+        values = value if isinstance(value, dict) else {(): value}
+        return {tuple(str(v) for v in k): v for k, v in values.items() if v is not None}
+
+    def snapshot(self):
+        return [[list(k), v] for k, v in self.values().items()]
+
+    def render(self, values=None, labelnames=None):
+        values = self.values() if values is None else values
+        labelnames = self.labelnames if labelnames is None else labelnames
+        return self.header() + [f'{self.name}{_format_labels(labelnames, k)} {_format_value(v)}'
+                                for k, v in sorted(values.items())]
+
+
+class MetricsRegistry:
+    """
+    Metrics of the app
+    shared_dir: directory the server processes exchange snapshots in (None: this process only)
+    flush_interval: seconds between snapshot writes of an idle process
+    """
+
+    EXITED = '_exited.json'
+
+    def __init__(self, shared_dir=None, flush_interval=5):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self.shared_dir = Path(shared_dir) if shared_dir else None
+        self.flush_interval = max(0.1, float(flush_interval))
+        self._thread = None
+        self._pid = None
+        if self.shared_dir is not None:
+            self.shared_dir.mkdir(parents=True, exist_ok=True)
+
+    def _add(self, metric):
+        if not re.match(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$', metric.name):
+            raise ValueError(f'Invalid metric name: {metric.name}')
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, fn, labelnames=(), per_process=False):
+        return self._add(Gauge(name, help_text, fn, labelnames, per_process))
+
+    def _list(self):
+        with self._lock:
+            return list(self._metrics)
+
+    # Sharing between server processes
+
+    def start(self):
+        """Write this process's snapshot every flush_interval (started lazily, threads don't survive fork)"""
+        if self.shared_dir is None:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name='ikan-metrics', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f'Metrics flush failed: {e}')
+
+    def reset(self):
+        """Drop counts inherited from the pre-fork master, so they aren't counted once per worker"""
+        for metric in self._list():
+            if not isinstance(metric, Gauge):
+                metric.reset()
+
+    def flush(self):
+        """Write this process's counters, histograms and per-process gauges to <shared_dir>/<pid>.json"""
+        if self.shared_dir is None:
+            return
+        snapshot = {metric.name: metric.snapshot() for metric in self._list()
+                    if not isinstance(metric, Gauge) or metric.per_process}
+        path = self.shared_dir / f'{os.getpid()}.json'
+        tmp = path.with_name(f'.{path.name}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def _snapshots(self):
+        """(live process snapshots by pid, merged snapshot of exited processes)"""
+        live = {}
+        with open(self.shared_dir / '.lock', 'a') as lock:
+            # One process at a time folds the files of exited workers into EXITED
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                exited = self._read(self.shared_dir / self.EXITED) or {}
+                folded = False
+                for path in self.shared_dir.glob('*.json'):
+                    if not path.stem.isdigit():
+                        continue
+                    snapshot = self._read(path)
+                    if snapshot is None:
+                        continue
+                    pid = int(path.stem)
+                    if pid == os.getpid() or _pid_alive(pid):
+                        live[pid] = snapshot
+                        continue
+                    for metric in self._list():
+                        if not isinstance(metric, Gauge) and metric.name in snapshot:
+                            total = _unflatten(metric, exited.get(metric.name, []))
+                            metric.merge(total, snapshot[metric.name])
+                            exited[metric.name] = _flatten(metric, total)
+                    path.unlink(missing_ok=True)
+                    folded = True
+                if folded:
+                    tmp = self.shared_dir / f'.{self.EXITED}.tmp'
+                    with open(tmp, 'w') as f:
+                        json.dump(exited, f)
+                    os.replace(tmp, self.shared_dir / self.EXITED)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return live, exited
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def render(self):
+        metrics = self._list()
+        if self.shared_dir is None:
+            return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+        self.flush()
+        live, exited = self._snapshots()
+        lines = []
+        for metric in metrics:
+            if isinstance(metric, Gauge):
+                if not metric.per_process:
+                    lines += metric.render()
+                    continue
+                values = {(str(pid), *key): value for pid, snapshot in live.items()
+                          for key, value in _unflatten(metric, snapshot.get(metric.name, [])).items()}
+                lines += metric.render(values, ('pid',) + metric.labelnames)
+                continue
+            total = _unflatten(metric, exited.get(metric.name, []))
+            for snapshot in live.values():
+                metric.merge(total, snapshot.get(metric.name, []))
+            lines += metric.render(total)
+        return '\n'.join(lines) + '\n'
+
+
+def _unflatten(metric, snapshot):
+    """Snapshot rows back to the key -> value mapping render() takes"""
+    if isinstance(metric, Histogram):
+        return {tuple(key): ([*counts], value_sum, count) for key, counts, value_sum, count in snapshot}
+    return {tuple(key): value for key, value in snapshot}
+
+
+def _flatten(metric, values):
+    if isinstance(metric, Histogram):
+        return [[list(key), *series] for key, series in values.items()]
+    return [[list(key), value] for key, value in values.items()]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def process_stats():
+    """Resident memory (bytes) and CPU time (seconds) of this process"""
+    try:
+        import psutil
+        proc = psutil.Process()
+        cpu = proc.cpu_times()
+        return {'rss_bytes': proc.memory_info().rss, 'cpu_seconds': cpu.user + cpu.system}
+    except ImportError:
+        pass
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    rss = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        rss = usage.ru_maxrss * 1024  # peak, not current, where /proc is missing
+    return {'rss_bytes': rss, 'cpu_seconds': usage.ru_utime + usage.ru_stime}
+
+
+def worker_processes():
+    """
+    Memory of the serving processes: the pre-fork master (IKAN_MASTER_PID,
+    set by gunicorn.conf.py) and its workers, or just this process under
+    the dev server. uss is memory private to a process, pss splits shared
+    pages (weights inherited copy-on-write) between the processes mapping them
+    """
+    try:
+        import psutil
+    except ImportError:
+        return [{'pid': os.getpid(), 'role': 'single', 'current': True, **process_stats()}]
+
+    master_pid = int(os.environ.get('IKAN_MASTER_PID', 0))
+    if master_pid and psutil.pid_exists(master_pid):
+        master = psutil.Process(master_pid)
+        procs = [(master, 'master')] + [(child, 'worker') for child in master.children()]
+    else:
+        procs = [(psutil.Process(), 'single')]
+
+    rows = []
+    for proc, role in procs:
+        try:
+            row = {'pid': proc.pid, 'role': role, 'current': proc.pid == os.getpid(),
+                   'rss_bytes': proc.memory_info().rss, 'cpu_seconds': sum(proc.cpu_times()[:2]),
+                   'threads': proc.num_threads()}
+            try:
+                full = proc.memory_full_info()  # reads smaps, Linux gives pss
+                row['uss_bytes'] = full.uss
+                row['pss_bytes'] = getattr(full, 'pss', None)
+                row['shared_bytes'] = getattr(full, 'shared', None)
+            except (psutil.AccessDenied, AttributeError):
+                pass
+            rows.append(row)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return rows
+
+
+class Trace:
+    """Stage timings of one request, recorded into a histogram when finished"""
+
+    def __init__(self, endpoint, trace_id=None):
+        self.endpoint = endpoint
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def record(self, name, seconds):
+        if seconds is not None:
+            self.stages.append((name, float(seconds)))
+
+    def record_timings(self, timings, names=('queue_wait', 'model_load', 'preprocess', 'inference', 'nms', 'merge')):
+        """Copy model stage timings (from the batcher / registry) into the trace"""
+        for name in names:
+            value = timings.get(name)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.record(name, value)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def finish(self, histogram):
+        for name, seconds in self.stages:
+            histogram.observe(seconds, endpoint=self.endpoint, stage=name)
+
+    def to_dict(self):
+        return {'id': self.id, 'endpoint': self.endpoint, 'total': self.elapsed(),
+                'stages': [{'stage': name, 'seconds': seconds} for name, seconds in self.stages]}
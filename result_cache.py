@@ -0,0 +1,188 @@
+"""
+Content-hash result cache for IKAN Fish Detection
+Detections are cached per (file content, weights content, imgsz, NMS
+settings). Predictions are stored at a low confidence floor so a rerun
+with only a different conf_thres is answered by re-filtering
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+# Confidence the cached predictions are computed at; any conf_thres >= this
+# is served from the cache (the UI slider starts at 0.1)
+CONF_FLOOR = 0.1
+HASH_CHUNK = 1024 * 1024
+
+
+def hash_file(path):
+    """sha256 of a file's content"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_bytes(data):
+    """sha256 of an in-memory buffer"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class CacheEntry:
+    """Cached predictions for one key"""
+
+    def __init__(self, det, conf_floor, shape):
+        self.det = det
+        self.conf_floor = conf_floor
+        self.shape = tuple(shape)
+        # conf_thres -> results/ directory already holding the annotated output
+        self.result_dirs = {}
+
+    def covers(self, conf_thres):
+        return conf_thres >= self.conf_floor
+
+    def filter(self, conf_thres):
+        """Detections at conf_thres, NMS output is monotonic in the threshold"""
+        return self.det[self.det[:, 4] >= conf_thres]
+
+
+class ResultCache:
+    """
+    Two-level LRU: decoded entries in memory, .npz files on disk
+    Both levels are bounded (entries in memory, bytes on disk)
+    """
+
+    def __init__(self, cache_dir, max_memory_entries=256, max_disk_bytes=256 * 1024 * 1024,
+                 conf_floor=CONF_FLOOR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_memory_entries = max(1, int(max_memory_entries))
+        self.max_disk_bytes = max(0, int(max_disk_bytes))
+        self.conf_floor = conf_floor
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()  # key -> size in bytes, LRU order
+        self._disk_bytes = 0
+        self._weights_hashes = {}
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'refilter_hits': 0, 'misses': 0,
+                         'stores': 0, 'memory_evictions': 0, 'disk_evictions': 0}
+        self._load_disk_index()
+
+    def _load_disk_index(self):
+        files = sorted(self.cache_dir.glob('*.npz'), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            self._disk[path.stem] = path.stat().st_size
+            self._disk_bytes += self._disk[path.stem]
+
+    def weights_hash(self, weights_path):
+        """Content hash of a weights file, recomputed only when size or mtime change"""
+        path = Path(weights_path)
+        try:
+            st = path.stat()
+        except OSError:
+            return str(weights_path)  # not downloaded yet, the name is all we have
+        stamp = (st.st_size, st.st_mtime)
+        cached = self._weights_hashes.get(str(path))
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, hash_file(path))
+            self._weights_hashes[str(path)] = cached
+        return cached[1]
+
+    def make_key(self, content_hash, weights_path, imgsz, iou_thres, max_det, mode=''):
+        """Cache key from file content, weights content and the pre-NMS settings (mode: e.g. tiling)"""
+        raw = f'{content_hash}:{self.weights_hash(weights_path)}:{imgsz}:{iou_thres}:{max_det}'
+        if mode:
+            raw += f':{mode}'
+        return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+    def get(self, key, conf_thres):
+        """Return the CacheEntry if it can answer conf_thres, else None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                source = 'memory_hits'
+            elif key in self._disk:
+                entry = self._read_disk(key)
+                source = 'disk_hits'
+            if entry is None or not entry.covers(conf_thres):
+                self.counters['misses'] += 1
+                return None
+            self.counters[source] += 1
+            if conf_thres not in entry.result_dirs:
+                self.counters['refilter_hits'] += 1
+            return entry
+
+    def put(self, key, det, conf_floor, shape):
+        """Store predictions computed at conf_floor, returns the new CacheEntry"""
+        entry = CacheEntry(np.asarray(det, dtype=np.float32).reshape(-1, 6), conf_floor, shape)
+        with self._lock:
+            self._remember(key, entry)
+            self._write_disk(key, entry)
+            self.counters['stores'] += 1
+        return entry
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.counters['memory_evictions'] += 1
+
+    def _read_disk(self, key):
+        path = self.cache_dir / f'{key}.npz'
+        try:
+            with np.load(path) as data:
+                entry = CacheEntry(data['det'], float(data['conf_floor']), data['shape'])
+            os.utime(path)  # mtime doubles as LRU order across restarts
+        except (OSError, KeyError, ValueError):
+            self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+        self._disk.move_to_end(key)
+        self._remember(key, entry)
+        return entry
+
+    def _write_disk(self, key, entry):
+        if not self.max_disk_bytes:
+            return
+        path = self.cache_dir / f'{key}.npz'
+        tmp = self.cache_dir / f'{key}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, det=entry.det, conf_floor=entry.conf_floor, shape=np.asarray(entry.shape))
+        os.replace(tmp, path)
+        self._disk_bytes -= self._disk.pop(key, 0)
+        self._disk[key] = path.stat().st_size
+        self._disk_bytes += self._disk[key]
+        while self._disk and self._disk_bytes > self.max_disk_bytes:
+            old_key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            (self.cache_dir / f'{old_key}.npz').unlink(missing_ok=True)
+            self.counters['disk_evictions'] += 1
+
+    def referenced_dirs(self):
+        """results/ directories referenced by cached entries"""
+        with self._lock:
+            return {d for entry in self._memory.values() for d in entry.result_dirs.values()}
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            memory_entries = len(self._memory)
+            disk_entries = len(self._disk)
+            disk_bytes = self._disk_bytes
+        lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+        return {
+            **counters,
+            'hit_rate': (lookups - counters['misses']) / lookups if lookups else None,
+            'memory_entries': memory_entries,
+            'max_memory_entries': self.max_memory_entries,
+            'disk_entries': disk_entries,
+            'disk_bytes': disk_bytes,
+            'max_disk_bytes': self.max_disk_bytes,
+            'conf_floor': self.conf_floor,
+        }
@@ -0,0 +1,165 @@
+"""
+Startup and warm-up for IKAN Fish Detection
+The app module imports without torch, so liveness (/api/health) and the
+static UI answer right away. The expensive steps (torch and yolov5
+imports, weights catalog, model loads, first forward pass) run as
+warm-up stages, in the background or before gunicorn forks;
+/api/ready reports when they are done.
+
+Warm snapshots: `python startup.py snapshot yolov5s.pt ...` (run at image
+build time) downloads the weights if needed and saves the fused float32
+model under snapshots/<sha>.pt, named after the sha256 of the source
+weights. Loading a snapshot skips the download, the half -> float
+conversion and the Conv+BN fusion.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Where warm snapshots are built and looked up
+SNAPSHOT_DIR = Path(os.environ.get('IKAN_SNAPSHOT_DIR', Path(__file__).parent / 'snapshots'))
+
+
+def process_started_at(pid='self'):
+    """Wall-clock start time of a process (Linux /proc), now if unknown"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the parenthesised command name; starttime is field 22, in clock ticks since boot
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as f:
+            boot = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return boot + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+class Warmup:
+    """
+    Ordered warm-up stages with timings
+    started_at: when the process began starting (time.time()), for
+    time-to-ready and time-to-first-detection
+    """
+
+    def __init__(self, started_at=None):
+        self.started_at = started_at or time.time()
+        self._stages = OrderedDict()
+        self.timings = OrderedDict()
+        self.errors = {}
+        self.state = 'pending'  # pending, running, ready, failed
+        self.ready_at = None
+        self.first_detection_at = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def stage(self, name, fn, required=True):
+        """Add a stage; a failing optional stage is recorded but doesn't block readiness"""
+        self._stages[name] = (fn, required)
+
+    def start(self):
+        """Run the stages on a background thread (once per process)"""
+        with self._lock:
+            # Ready before fork: the worker inherits the warm state. Failed: not retried per request
+            if self.state == 'ready' or (self.state != 'pending' and self._pid == os.getpid()):
+                return
+            self._pid = os.getpid()
+            self.state = 'running'
+            self._thread = threading.Thread(target=self._run, name='ikan-warmup', daemon=True)
+            self._thread.start()
+
+    def run(self):
+        """Run the stages in the calling thread (gunicorn master before forking)"""
+        with self._lock:
+            self._pid = os.getpid()
+            self.state = 'running'
+        self._run()
+
+    def _run(self):
+        failed = False
+        for name, (fn, required) in self._stages.items():
+            t0 = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                self.errors[name] = str(e)[:300]
+                failed = failed or required
+                print(f'Warm-up stage {name} failed: {e}')
+            self.timings[name] = time.perf_counter() - t0
+            if failed:
+                break
+        self.state = 'failed' if failed else 'ready'
+        self.ready_at = time.time()
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def mark_first_detection(self):
+        """Record the first completed detection of this process (only the first call counts)"""
+        if self.first_detection_at is None:
+            self.first_detection_at = time.time()
+
+    def time_to_first_detection(self):
+        return self.first_detection_at - self.started_at if self.first_detection_at else None
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'state': self.state,
+            'pid': os.getpid(),
+            'uptime_seconds': time.time() - self.started_at,
+            'time_to_ready_seconds': self.ready_at - self.started_at if self.ready_at else None,
+            'time_to_first_detection_seconds': self.time_to_first_detection(),
+            'stages': {name: self.timings.get(name) for name in self._stages},
+            'errors': self.errors,
+        }
+
+
+def snapshot_path(snapshot_dir, sha256):
+    return Path(snapshot_dir) / f'{sha256[:32]}.pt'
+
+
+def save_snapshot(weights_path, target):
+    """Load (downloading if needed), fuse and save a YOLOv5 checkpoint as a warm snapshot"""
+    import torch
+    from models.experimental import attempt_load
+
+    model = attempt_load(weights_path, device=torch.device('cpu'), inplace=True, fuse=True)
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f'{target.name}.{os.getpid()}.tmp')
+    # Same layout as a training checkpoint so DetectMultiBackend loads it unchanged;
+    # attempt_load's fuse() is a no-op on already fused layers
+    torch.save({'model': model, 'epoch': -1, 'snapshot_of': str(weights_path)}, tmp)
+    os.replace(tmp, target)
+    return target
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build warm model snapshots (run at image build time)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    snap = sub.add_parser('snapshot', help='download, fuse and snapshot weights')
+    snap.add_argument('weights', nargs='+', help='weights as accepted by /api/detect, e.g. yolov5s.pt')
+    opt = parser.parse_args()
+
+    import inference  # noqa: F401  (puts yolov5/ on sys.path)
+    from detections import get_weights_catalog, resolve_weights_path
+
+    catalog = get_weights_catalog()
+    for weights in opt.weights:
+        path = resolve_weights_path(weights)
+        t0 = time.perf_counter()
+        if not Path(path).exists():
+            from utils.downloads import attempt_download
+            path = str(attempt_download(path))
+        catalog.refresh(force=True)  # also writes the metadata sidecar
+        entry = catalog.get(path)
+        if entry is None:
+            parser.error(f'{weights}: {path} is outside the weights folders the app discovers')
+        target = save_snapshot(path, snapshot_path(SNAPSHOT_DIR, entry['sha256']))
+        print(f'{weights}: {target} ({target.stat().st_size / 1e6:.1f} MB, {time.perf_counter() - t0:.1f}s)')
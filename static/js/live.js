@@ -0,0 +1,129 @@
+// IKAN Fish Detection - Live stream view
+
+let liveStreamId = null;
+let liveEvents = null;
+let liveLatencies = [];
+let liveLatencyTimer = null;
+let liveRoundTripMs = 0;
+
+const liveSource = document.getElementById('liveSource');
+const liveStartBtn = document.getElementById('liveStartBtn');
+const liveStopBtn = document.getElementById('liveStopBtn');
+const liveImage = document.getElementById('liveImage');
+const liveStats = document.getElementById('liveStats');
+// Off when the server runs several workers (a stream lives in one worker's memory)
+const liveEnabled = document.getElementById('liveSection').dataset.enabled !== 'false';
+
+liveStartBtn.addEventListener('click', startLive);
+liveStopBtn.addEventListener('click', stopLive);
+window.addEventListener('beforeunload', stopLive);
+
+async function startLive() {
+    const source = liveSource.value.trim();
+    if (!source) {
+        alert('Masukkan sumber live terlebih dahulu');
+        return;
+    }
+    liveStartBtn.disabled = true;
+    try {
+        const response = await fetch('/api/live', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                source: source,
+                weights: weightsSelect.value,
+                imgsz: parseInt(imgszSelect.value),
+                conf_thres: parseFloat(confSlider.value)
+            })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Gagal memulai live stream');
+        }
+        liveStreamId = data.stream_id;
+        liveImage.src = data.mjpeg_url;
+        liveImage.style.display = 'block';
+        liveStopBtn.disabled = false;
+        listenLiveEvents(data.events_url);
+        liveLatencyTimer = setInterval(reportLiveLatency, 1000);
+    } catch (error) {
+        alert('Error: ' + error.message);
+        liveStartBtn.disabled = false;
+    }
+}
+
+function listenLiveEvents(url) {
+    liveEvents = new EventSource(url);
+    liveEvents.onmessage = (e) => {
+        const receivedAt = performance.now();
+        const event = JSON.parse(e.data);
+        // Event latency: capture -> sent (server clock) + transit (half the latency POST round trip)
+        // + received -> next paint (browser clock). The MJPEG frame's own paint can't be observed.
+        requestAnimationFrame(() => {
+            liveLatencies.push(event.sent_at - event.captured_at + liveRoundTripMs / 2
+                               + performance.now() - receivedAt);
+        });
+        renderLiveStats(event);
+    };
+    liveEvents.addEventListener('end', () => resetLive());
+    liveEvents.onerror = () => {
+        if (liveEvents && liveEvents.readyState === EventSource.CLOSED) {
+            resetLive();
+        }
+    };
+}
+
+function renderLiveStats(event) {
+    liveStats.innerHTML = '';
+    liveStats.appendChild(createStatCard('Deteksi di Frame', event.detections.length));
+    liveStats.appendChild(createStatCard('Latensi Pipeline', event.pipeline_ms.toFixed(0) + ' ms'));
+    if (liveLatencies.length) {
+        const sorted = [...liveLatencies].sort((a, b) => a - b);
+        liveStats.appendChild(createStatCard('Latensi Event', sorted[Math.floor(sorted.length / 2)].toFixed(0) + ' ms'));
+    }
+    liveStats.appendChild(createStatCard('Frame', event.frame));
+}
+
+async function reportLiveLatency() {
+    if (!liveStreamId || !liveLatencies.length) return;
+    const samples = liveLatencies;
+    liveLatencies = [];
+    const median = samples.sort((a, b) => a - b)[Math.floor(samples.length / 2)];
+    try {
+        const sentAt = performance.now();
+        const response = await fetch(`/api/live/${liveStreamId}/latency`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ latency_ms: median })
+        });
+        liveRoundTripMs = performance.now() - sentAt;
+        if (response.status === 404) {
+            resetLive();
+        }
+    } catch (error) {
+        console.error('Error reporting latency:', error);
+    }
+}
+
+function stopLive() {
+    if (liveStreamId) {
+        // keepalive lets the DELETE finish when the page is closing
+        fetch(`/api/live/${liveStreamId}`, { method: 'DELETE', keepalive: true }).catch(() => {});
+    }
+    resetLive();
+}
+
+function resetLive() {
+    if (liveEvents) {
+        liveEvents.close();
+        liveEvents = null;
+    }
+    clearInterval(liveLatencyTimer);
+    liveStreamId = null;
+    liveLatencies = [];
+    liveRoundTripMs = 0;
+    liveImage.removeAttribute('src');
+    liveImage.style.display = 'none';
+    liveStartBtn.disabled = !liveEnabled;
+    liveStopBtn.disabled = true;
+}
@@ -46,7 +46,8 @@ async function loadAvailableWeights() {
         data.weights.forEach(weight => {
             const option = document.createElement('option');
             option.value = weight.path;
-            option.textContent = weight.name;
+            // Class count read from the checkpoint, e.g. "Custom Model (exp) · 2 kelas"
+            option.textContent = weight.classes ? `${weight.name} · ${weight.classes} kelas` : weight.name;
             weightsSelect.appendChild(option);
         });
     } catch (error) {
@@ -125,7 +126,7 @@ async function processFile(file) {
         return;
     }
     
-    const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 
+    const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/heic', 'image/heif',
                           'video/mp4', 'video/avi', 'video/quicktime', 'video/x-msvideo'];
     if (!allowedTypes.includes(file.type)) {
         showNotification('Format file tidak didukung!', 'error');
@@ -222,7 +223,12 @@ async function runDetection() {
             })
         });
         
-        const data = await response.json();
+        let data = await response.json();
+        
+        // Videos run as a background job, poll until it finishes
+        if (data.success && data.job_id) {
+            data = await pollJob(data.job_id);
+        }
         
         if (data.success) {
             // Update progress
@@ -243,6 +249,41 @@ async function runDetection() {
     }
 }
 
+// Poll a detection job until it finishes, returns the final result
+async function pollJob(jobId) {
+    // Real progress replaces the simulated one
+    if (window.loadingInterval) {
+        clearInterval(window.loadingInterval);
+        window.loadingInterval = null;
+    }
+    
+    // Only new rows are fetched each poll; totals come from the job summary
+    let since = 0;
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}?since=${since}`);
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || 'Job not found');
+        }
+        
+        since = job.detections_next;
+        
+        if (job.progress !== null) {
+            updateProgress(Math.min(99, job.progress * 100));
+        }
+        const fps = job.fps ? ` (${job.fps.toFixed(1)} FPS)` : '';
+        loadingText.textContent = `Memproses frame ${job.frames_done}${job.total_frames ? '/' + job.total_frames : ''}${fps}`;
+        
+        if (job.status === 'done') {
+            return job.result;
+        }
+        if (job.status === 'failed' || job.status === 'cancelled') {
+            throw new Error(job.error || `Job ${job.status}`);
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 // Display detection results
 async function displayResults(data) {
     resultsSection.style.display = 'block';
@@ -259,10 +300,16 @@ async function displayResults(data) {
     const resultUrl = `/api/results/${data.result_path}`;
     
     if (data.type === 'image') {
-        resultImage.src = resultUrl;
+        // Web-sized preview first, the full-resolution result opens on click
+        resultImage.src = `${resultUrl}?size=preview`;
+        resultImage.onclick = () => window.open(resultUrl, '_blank');
+        resultImage.style.cursor = 'zoom-in';
         resultImage.style.display = 'block';
         resultVideo.style.display = 'none';
     } else {
+        // Poster frame right away; the video is fast-start, playback begins while it downloads
+        resultVideo.poster = `${resultUrl}?size=preview`;
+        resultVideo.preload = 'metadata';
         resultVideo.src = resultUrl;
         resultVideo.style.display = 'block';
         resultImage.style.display = 'none';
@@ -286,6 +333,26 @@ function displayStats(data) {
     const totalCard = createStatCard('Total Deteksi', data.detection_count || 0);
     statsGrid.appendChild(totalCard);
     
+    // Tracked videos: each fish counted once
+    if (data.unique_count !== undefined) {
+        statsGrid.appendChild(createStatCard('Ikan Unik', data.unique_count));
+    }
+    
+    // Videos report a per-class summary instead of every detection
+    if (data.summary && Object.keys(data.summary).length > 0) {
+        let total = 0;
+        let confSum = 0;
+        Object.entries(data.summary).forEach(([className, entry]) => {
+            const card = createStatCard(className, `${entry.count} (${(entry.mean_confidence * 100).toFixed(1)}%)`);
+            statsGrid.appendChild(card);
+            total += entry.count;
+            confSum += entry.mean_confidence * entry.count;
+        });
+        const confCard = createStatCard('Confidence Rata-rata', (confSum / total * 100).toFixed(1) + '%');
+        statsGrid.appendChild(confCard);
+        return;
+    }
+    
     // Detection count by class
     if (data.detections && data.detections.length > 0) {
         const classCounts = {};
@@ -330,7 +397,7 @@ function createStatCard(label, value) {
 // Download result
 function downloadResult() {
     const resultUrl = resultImage.style.display !== 'none' 
-        ? resultImage.src 
+        ? resultImage.src.split('?')[0] 
         : resultVideo.src;
     
     const link = document.createElement('a');
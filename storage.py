@@ -0,0 +1,306 @@
+"""
+Storage lifecycle for IKAN Fish Detection
+uploads/ and results/ are kept within a size quota and maximum ages by a
+background sweeper. Each top-level entry (an upload, a results/detect_*
+or bulk_* directory, an archive) is one unit of eviction, least recently
+used first; entries referenced by the result cache or by running jobs,
+and anything written in the last few minutes, are never touched. Result
+directories that have not been used for a while are compacted into
+results/archive/<name>.tar.gz and restored transparently when requested.
+
+Only one server process sweeps at a time (flock on the lock file); the
+last report is written next to it so every worker can serve it.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+from pathlib import Path
+
+ARCHIVE_DIR = 'archive'
+ARCHIVE_SUFFIX = '.tar.gz'
+# Entries younger than this are being written (uploads, running detections)
+MIN_AGE_SECONDS = 600
+
+
+def scan_entry(path):
+    """(bytes, files, newest mtime) of a file or directory tree"""
+    try:
+        st = path.stat()
+    except OSError:
+        return 0, 0, 0.0
+    if not path.is_dir():
+        return st.st_size, 1, st.st_mtime
+    size, files, newest = 0, 0, st.st_mtime
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            stack.append(e.path)
+                            continue
+                        est = e.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    size += est.st_size
+                    files += 1
+                    newest = max(newest, est.st_mtime)
+        except OSError:
+            continue
+    return size, files, newest
+
+
+class StorageManager:
+    """
+    Quotas and retention for the uploads and results folders
+    max_bytes: uploads + results + archives together (0 = no quota)
+    upload_max_age / result_max_age: seconds before an entry is deleted (0 = keep)
+    compact_after: seconds unused before a result directory is archived (0 = never)
+    referenced(): names of entries that must be kept
+    """
+
+    def __init__(self, uploads_dir, results_dir, lock_path, max_bytes=0, upload_max_age=0, result_max_age=0,
+                 compact_after=0, interval=300, referenced=None):
+        self.uploads_dir = Path(uploads_dir)
+        self.results_dir = Path(results_dir)
+        self.archive_dir = self.results_dir / ARCHIVE_DIR
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_path = Path(lock_path)
+        self.report_path = self.lock_path.with_suffix('.json')
+        self.max_bytes = max(0, int(max_bytes))
+        self.upload_max_age = max(0.0, float(upload_max_age))
+        self.result_max_age = max(0.0, float(result_max_age))
+        self.compact_after = max(0.0, float(compact_after))
+        self.interval = max(1.0, float(interval))
+        self.referenced = referenced or set
+        self._thread = None
+        self._pid = None
+        self._restore_lock = threading.Lock()
+
+    # Background sweeper (started lazily so it runs in the serving process, not a pre-fork master)
+
+    def start(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name='ikan-storage', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f'Storage sweep failed: {e}')
+            time.sleep(self.interval)
+
+    # Scanning
+
+    def entries(self):
+        """Every evictable entry as a dict: area, name, path, bytes, files, last_used"""
+        out = []
+        for area, folder in (('uploads', self.uploads_dir), ('results', self.results_dir),
+                             ('archive', self.archive_dir)):
+            try:
+                children = list(os.scandir(folder))
+            except OSError:
+                continue
+            for e in children:
+                if area == 'results' and e.name == ARCHIVE_DIR:
+                    continue
+                if e.name.startswith('.') or e.name.endswith('.tmp'):
+                    continue
+                size, files, newest = scan_entry(Path(e.path))
+                name = e.name[:-len(ARCHIVE_SUFFIX)] if area == 'archive' else e.name
+                out.append({'area': area, 'name': name, 'path': Path(e.path), 'bytes': size, 'files': files,
+                            'last_used': newest})
+        return out
+
+    def touch(self, path):
+        """Mark the entry containing path as used now (LRU order is by newest mtime)"""
+        path = Path(path)
+        for folder in (self.uploads_dir, self.results_dir):
+            try:
+                top = folder / path.relative_to(folder).parts[0]
+            except (ValueError, IndexError):
+                continue
+            try:
+                os.utime(top)
+            except OSError:
+                pass
+            return
+
+    # Sweep
+
+    def sweep(self, dry_run=False):
+        """Expire, compact, then evict LRU down to the quota; returns the report"""
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return {'skipped': 'another process is sweeping'}
+            try:
+                return self._sweep(dry_run)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _sweep(self, dry_run):
+        t0 = time.perf_counter()
+        now = time.time()
+        referenced = set(self.referenced())
+        entries = self.entries()
+        deleted, archived = [], []
+
+        def protected(entry):
+            return entry['name'] in referenced or now - entry['last_used'] < MIN_AGE_SECONDS
+
+        def delete(entry, reason):
+            if not dry_run:
+                if entry['path'].is_dir():
+                    shutil.rmtree(entry['path'], ignore_errors=True)
+                else:
+                    entry['path'].unlink(missing_ok=True)
+            deleted.append({'area': entry['area'], 'name': entry['name'], 'bytes': entry['bytes'],
+                            'reason': reason})
+
+        kept = []
+        for entry in entries:
+            max_age = self.upload_max_age if entry['area'] == 'uploads' else self.result_max_age
+            if max_age and now - entry['last_used'] > max_age and not protected(entry):
+                delete(entry, 'age')
+            else:
+                kept.append(entry)
+
+        if self.compact_after:
+            for entry in kept:
+                if (entry['area'] == 'results' and entry['path'].is_dir()
+                        and now - entry['last_used'] > self.compact_after and not protected(entry)):
+                    archive = self.archive_dir / f"{entry['name']}{ARCHIVE_SUFFIX}"
+                    size = entry['bytes']
+                    if not dry_run:
+                        size = self.compact(entry['path'], archive)
+                        if size is None:
+                            continue
+                    archived.append({'name': entry['name'], 'bytes_before': entry['bytes'], 'bytes_after': size})
+                    entry.update(area='archive', path=archive, bytes=size)
+
+        total = sum(entry['bytes'] for entry in kept)
+        if self.max_bytes and total > self.max_bytes:
+            for entry in sorted(kept, key=lambda e: e['last_used']):
+                if total <= self.max_bytes:
+                    break
+                if protected(entry):
+                    continue
+                delete(entry, 'quota')
+                total -= entry['bytes']
+        removed = {(d['area'], d['name']) for d in deleted}
+        kept = [e for e in kept if (e['area'], e['name']) not in removed]
+
+        report = {
+            'swept_at': now,
+            'seconds': time.perf_counter() - t0,
+            'dry_run': dry_run,
+            'pid': os.getpid(),
+            'deleted': deleted[:100],
+            'deleted_count': len(deleted),
+            'deleted_bytes': sum(d['bytes'] for d in deleted),
+            'archived': archived[:100],
+            'archived_count': len(archived),
+            'archived_bytes_saved': sum(a['bytes_before'] - a['bytes_after'] for a in archived),
+            'protected': len(referenced),
+            'usage': self._usage(kept),
+            'over_quota': bool(self.max_bytes and total > self.max_bytes),
+        }
+        if not dry_run:
+            tmp = self.report_path.with_name(f'{self.report_path.name}.{os.getpid()}.tmp')
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(report, f)
+                os.replace(tmp, self.report_path)
+            except OSError:
+                pass
+        return report
+
+    def _usage(self, entries):
+        usage = {}
+        for area in ('uploads', 'results', 'archive'):
+            items = [e for e in entries if e['area'] == area]
+            usage[area] = {
+                'bytes': sum(e['bytes'] for e in items),
+                'entries': len(items),
+                'files': sum(e['files'] for e in items),
+                'oldest_used': min((e['last_used'] for e in items), default=None),
+            }
+        usage['total_bytes'] = sum(usage[area]['bytes'] for area in ('uploads', 'results', 'archive'))
+        return usage
+
+    # Compaction
+
+    def compact(self, result_dir, archive):
+        """tar.gz a result directory and remove it; returns the archive size, None on failure"""
+        tmp = archive.with_name(f'{archive.name}.{os.getpid()}.tmp')
+        try:
+            with tarfile.open(tmp, 'w:gz', compresslevel=6) as tar:
+                tar.add(result_dir, arcname=result_dir.name)
+            os.replace(tmp, archive)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return None
+        shutil.rmtree(result_dir, ignore_errors=True)
+        return archive.stat().st_size
+
+    def restore(self, name):
+        """Unpack results/archive/<name>.tar.gz back into results/; True if the directory exists afterwards"""
+        target = self.results_dir / name
+        archive = self.archive_dir / f'{name}{ARCHIVE_SUFFIX}'
+        if not name or '/' in name or name.startswith('.'):
+            return False
+        with self._restore_lock:
+            if target.exists():
+                return True
+            if not archive.exists():
+                return False
+            tmp = self.results_dir / f'.restore_{name}_{os.getpid()}'
+            try:
+                with tarfile.open(archive, 'r:gz') as tar:
+                    members = [m for m in tar.getmembers()
+                               if (m.isfile() or m.isdir()) and Path(m.name).parts[0] == name
+                               and '..' not in Path(m.name).parts and not Path(m.name).is_absolute()]
+                    tar.extractall(tmp, members=members)
+                os.replace(tmp / name, target)
+            except (OSError, tarfile.TarError):
+                return target.exists()
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            archive.unlink(missing_ok=True)
+            os.utime(target)
+            return True
+
+    # Stats
+
+    def stats(self):
+        """Settings, disk free space and the last sweep report (from whichever process ran it)"""
+        try:
+            with open(self.report_path) as f:
+                last = json.load(f)
+        except (OSError, ValueError):
+            last = None
+        disk = shutil.disk_usage(self.results_dir)
+        return {
+            'max_bytes': self.max_bytes,
+            'upload_max_age_seconds': self.upload_max_age,
+            'result_max_age_seconds': self.result_max_age,
+            'compact_after_seconds': self.compact_after,
+            'sweep_interval_seconds': self.interval,
+            'disk_total_bytes': disk.total,
+            'disk_free_bytes': disk.free,
+            'usage': last['usage'] if last else None,
+            'last_sweep': last,
+        }
@@ -0,0 +1,73 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The app modules live at the repository root, next to yolov5/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Flask test client with uploads / results in tmp_path, as (client, uploads, results)"""
+    import app as ikan_app
+    from media import MediaCache
+
+    uploads, results = tmp_path / 'uploads', tmp_path / 'results'
+    uploads.mkdir()
+    results.mkdir()
+    monkeypatch.setitem(ikan_app.app.config, 'UPLOAD_FOLDER', uploads)
+    monkeypatch.setitem(ikan_app.app.config, 'RESULTS_FOLDER', results)
+    monkeypatch.setattr(ikan_app, 'media_cache', MediaCache(tmp_path / 'media'))
+    # No warm-up or storage sweeper threads for route tests
+    monkeypatch.setattr(ikan_app.warmup, 'start', lambda: None)
+    monkeypatch.setattr(ikan_app.storage_manager, 'start', lambda: None)
+    return ikan_app.app.test_client(), uploads, results
+
+
+class FakeDetector:
+    """Stands in for the micro-batcher: fixed detections, records each call"""
+
+    def __init__(self):
+        import numpy as np
+
+        # Fish at 0.9 and 0.5, notFish at 0.3 ([x1, y1, x2, y2, conf, cls] in a 64 x 48 image)
+        self.det = np.array([[4, 4, 20, 20, 0.9, 0], [30, 10, 40, 30, 0.5, 0], [40, 20, 60, 40, 0.3, 1]],
+                            dtype=np.float32)
+        self.calls = []
+
+    def detect(self, weights_path, img0, imgsz=640, conf_thres=0.25, iou_thres=0.45, max_det=1000):
+        self.calls.append({'weights': weights_path, 'imgsz': imgsz, 'conf_thres': conf_thres,
+                           'iou_thres': iou_thres, 'max_det': max_det})
+        det = self.det[self.det[:, 4] >= conf_thres]
+        return det, {'queue_wait': 0.0, 'inference': 0.001}
+
+
+@pytest.fixture
+def detect_client(client, tmp_path, monkeypatch):
+    """
+    client with a stand-in model, a result cache and index in tmp_path and
+    side outputs written as plain files: (client, uploads, results, detector)
+    """
+    import app as ikan_app
+    from detection_index import DetectionIndex
+    from detections import CLASS_NAMES
+    from result_cache import ResultCache
+
+    detector = FakeDetector()
+    monkeypatch.setattr(ikan_app, 'batcher', detector)
+    monkeypatch.setattr(ikan_app, 'result_cache', ResultCache(tmp_path / 'cache'))
+    monkeypatch.setattr(ikan_app, 'detection_index', DetectionIndex(tmp_path / 'index.sqlite'))
+    monkeypatch.setattr(ikan_app, 'backend_weights', lambda weights_path, backend=None, imgsz=640: weights_path)
+    monkeypatch.setattr(ikan_app, 'is_coco_weights', lambda weights_path: False)
+    monkeypatch.setattr(ikan_app, 'model_names', lambda weights_path: CLASS_NAMES)
+
+    def save_outputs(img0, det, names, save_dir, name, save_media=True, save_labels=True):
+        if save_media:
+            (save_dir / name).write_bytes(b'annotated')
+        if save_labels:
+            (save_dir / 'labels').mkdir(exist_ok=True)
+            (save_dir / 'labels' / (name.rsplit('.', 1)[0] + '.txt')).write_text(f'{len(det)}\n')
+
+    monkeypatch.setattr(ikan_app, 'save_detection_outputs', save_outputs)
+    return (*client, detector)
@@ -0,0 +1,85 @@
+import threading
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+
+
+class FakeRegistry:
+    """Model registry double: records each forward pass, one detection row per image"""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self._lock = threading.Lock()
+
+    def get(self, weights_path):
+        return weights_path
+
+    def loaded_paths(self):
+        return []
+
+    def prepare(self, loaded, img0, imgsz):
+        # The image's fill value travels with it so results can be matched to requests
+        return np.full((3, 4, 4), img0[0, 0, 0], dtype=np.float32), imgsz
+
+    def forward(self, loaded, batch):
+        if self.fail:
+            raise RuntimeError('out of memory')
+        with self._lock:
+            self.batches.append((loaded, [int(a[0, 0, 0]) for a in batch]))
+        return batch, batch[:, 0, 0, 0]
+
+    def postprocess(self, pred, shape, shapes, conf_thres, iou_thres, max_det):
+        return [np.array([[value, conf]]) for value, conf in zip(pred, conf_thres)]
+
+
+def image(value):
+    return np.full((8, 8, 3), value, dtype=np.uint8)
+
+
+def test_full_batch_is_one_forward_pass_with_per_request_thresholds():
+    registry = FakeRegistry()
+    batcher = MicroBatcher(registry, max_batch_size=4, max_wait_ms=10_000)
+    futures = [batcher.submit('w.pt', image(i), conf_thres=0.1 * (i + 1)) for i in range(4)]
+    results = [f.result(timeout=5) for f in futures]
+    assert registry.batches == [('w.pt', [0, 1, 2, 3])]
+    for i, (det, timings) in enumerate(results):
+        # Each request gets its own row back, filtered at its own confidence
+        assert det[0, 0] == i and det[0, 1] == pytest.approx(0.1 * (i + 1))
+        assert timings['batch_size'] == 4
+    assert batcher.stats()['batches'] == 1 and batcher.stats()['images'] == 4
+
+
+def test_batches_never_mix_weights_or_input_sizes():
+    registry = FakeRegistry()
+    batcher = MicroBatcher(registry, max_batch_size=2, max_wait_ms=10_000)
+    futures = [batcher.submit('a.pt', image(1)), batcher.submit('b.pt', image(2)),
+               batcher.submit('a.pt', image(3), imgsz=320), batcher.submit('b.pt', image(4)),
+               batcher.submit('a.pt', image(5)), batcher.submit('a.pt', image(6), imgsz=320)]
+    for f in futures:
+        f.result(timeout=5)
+    assert sorted(registry.batches) == [('a.pt', [1, 5]), ('a.pt', [3, 6]), ('b.pt', [2, 4])]
+
+
+def test_partial_batch_goes_after_max_wait():
+    registry = FakeRegistry()
+    batcher = MicroBatcher(registry, max_batch_size=2, max_wait_ms=20)
+    futures = [batcher.submit('w.pt', image(i)) for i in range(3)]
+    for f in futures:
+        f.result(timeout=5)
+    assert [values for _, values in registry.batches] == [[0, 1], [2]]
+
+
+def test_forward_error_fails_every_request_of_the_batch():
+    batcher = MicroBatcher(FakeRegistry(fail=True), max_batch_size=2, max_wait_ms=10_000)
+    futures = [batcher.submit('w.pt', image(i)) for i in range(2)]
+    for f in futures:
+        with pytest.raises(RuntimeError, match='out of memory'):
+            f.result(timeout=5)
+    # The worker keeps serving after a failed batch
+    batcher.registry.fail = False
+    batcher.configure(max_batch_size=1)
+    det, timings = batcher.detect('w.pt', image(7), timeout=5)
+    assert det[0, 0] == 7 and timings['cold'] is True
@@ -0,0 +1,114 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from bulk import iter_images, load_done, run_bulk
+
+
+class FakeRegistry:
+    """Model registry double: one detection per image, records what was inferred"""
+
+    def __init__(self):
+        self.batches = []
+
+    def get(self, weights_path):
+        return object()
+
+    def prepare(self, loaded, img0, imgsz):
+        return np.zeros((3, 8, 8), dtype=np.float32), None
+
+    def forward(self, loaded, batch):
+        self.batches.append(len(batch))
+        return np.zeros((len(batch), 3, 8, 8)), None
+
+    def postprocess(self, pred, shape, shapes, conf_thres, iou_thres):
+        return [np.array([[0, 0, 4, 4, 0.9, 0]], dtype=np.float32) for _ in shapes]
+
+
+@pytest.fixture
+def images(tmp_path):
+    root = tmp_path / 'stills'
+    (root / 'sub').mkdir(parents=True)
+    for name in ('a.png', 'b.jpg', 'sub/c.png'):
+        cv2.imwrite(str(root / name), np.full((16, 24, 3), 127, dtype=np.uint8))
+    (root / 'notes.txt').write_text('not an image')
+    return root
+
+
+def test_iter_images_sorted_and_filtered(images):
+    assert [p.relative_to(images).as_posix() for p in iter_images(images)] == ['a.png', 'b.jpg', 'sub/c.png']
+
+
+def test_resume_skips_done_and_partial_last_line(images, tmp_path):
+    output = tmp_path / 'out' / 'detections.jsonl'
+    output.parent.mkdir()
+    # An interrupted run: one finished record, then a line cut off mid-write
+    output.write_text(json.dumps({'source': 'a.png', 'detections': []}) + '\n{"source": "b.j')
+    assert load_done(output) == {'a.png'}
+
+    registry = FakeRegistry()
+    summary = run_bulk(iter_images(images), registry, 'w.pt', output, root=images, batch_size=8)
+    assert summary['images'] == 3
+    assert summary['skipped_done'] == 1
+    assert summary['processed_this_run'] == 2
+    assert sum(registry.batches) == 2
+    assert load_done(output) == {'a.png', 'b.jpg', 'sub/c.png'}
+
+    # Nothing left: a rerun infers nothing
+    again = FakeRegistry()
+    summary = run_bulk(iter_images(images), again, 'w.pt', output, root=images)
+    assert summary['processed_this_run'] == 0 and again.batches == []
+
+
+def test_unreadable_image_is_logged_not_fatal(images, tmp_path):
+    (images / 'broken.png').write_bytes(b'not a png')
+    output = tmp_path / 'detections.jsonl'
+    summary = run_bulk(iter_images(images), FakeRegistry(), 'w.pt', output, root=images, batch_size=2,
+                       formatter=lambda det, shape: [{'class_name': 'Fish'} for _ in det])
+    records = {r['source']: r for r in map(json.loads, output.read_text().splitlines())}
+    assert 'error' in records['broken.png']
+    assert records['a.png']['detection_count'] == 1
+    assert summary['class_counts'] == {'Fish': 3}
+
+
+def test_resumed_run_counts_the_earlier_records(images, tmp_path):
+    from jobs import Job
+
+    output = tmp_path / 'detections.jsonl'
+    fish = {'class': 0, 'class_name': 'Fish', 'confidence': 0.8, 'bbox': [0.5, 0.5, 0.1, 0.1]}
+    not_fish = {'class': 1, 'class_name': 'notFish', 'confidence': 0.6, 'bbox': [0.2, 0.2, 0.1, 0.1]}
+    output.write_text(json.dumps({'source': 'a.png', 'detections': [fish, fish, not_fish]}) + '\n')
+
+    job = Job('bulk_detect')
+    summary = run_bulk(iter_images(images), FakeRegistry(), 'w.pt', output, root=images, job=job,
+                       formatter=lambda det, shape: [dict(fish) for _ in det])
+    assert summary['processed_this_run'] == 2
+    # Two new Fish plus the three detections of the record written before the interruption
+    assert summary['class_counts'] == {'Fish': 4, 'notFish': 1}
+    assert {name: entry['count'] for name, entry in job.summarize().items()} == {'Fish': 4, 'notFish': 1}
+    assert job.frames_done == 3 and job.total_frames == 3
+
+
+def test_bulk_upload_keeps_archive_folders_apart(client, tmp_path):
+    import io
+    import zipfile
+
+    from werkzeug.datastructures import FileStorage
+
+    from app import extract_bulk_upload
+
+    ok, png = cv2.imencode('.png', np.zeros((4, 4, 3), dtype=np.uint8))
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for name in ('site1/img.png', 'site2/img.png', 'site1/../img.png', 'notes.txt'):
+            zf.writestr(name, png.tobytes())
+    archive.seek(0)
+    files = [FileStorage(archive, 'batch.zip'), FileStorage(io.BytesIO(png.tobytes()), 'img.png')]
+
+    target = tmp_path / 'bulk'
+    assert extract_bulk_upload(files, target) == 4
+    # Same file name in different folders each keep their own file; '..' is dropped, not followed
+    assert sorted(p.relative_to(target).as_posix() for p in target.rglob('*.png')) == [
+        'img.png', 'site1/img.png', 'site1/img_1.png', 'site2/img.png']
@@ -0,0 +1,54 @@
+import io
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('flask')
+
+
+def upload(client, name='reef.png'):
+    ok, png = cv2.imencode('.png', np.full((48, 64, 3), 90, dtype=np.uint8))
+    response = client.post('/api/upload', data={'file': (io.BytesIO(png.tobytes()), name)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['filename']
+
+
+def settle(timeout=5):
+    """Wait for the background side-output writer"""
+    import app as ikan_app
+
+    deadline = time.monotonic() + timeout
+    while ikan_app.output_writer.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def detect(client, filename, **options):
+    response = client.post('/api/detect', json={'filename': filename, 'weights': 'best.pt', **options})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+@pytest.mark.parametrize('value, saved', [(False, False), ('false', False), ('0', False), ('no', False),
+                                          (True, True), ('true', True), ('1', True)])
+def test_save_media_parses_json_and_string_flags(detect_client, value, saved):
+    client, _, results, _ = detect_client
+    body = detect(client, upload(client), save_media=value)
+    assert (body['result_path'] is not None) == saved
+    if saved:
+        # Served once the background writer is done with it
+        assert client.get(f"/api/results/{body['result_path']}").data == b'annotated'
+    settle()
+    assert any(results.rglob('*.png')) == saved
+
+
+def test_save_labels_string_false_writes_no_labels(detect_client):
+    client, _, results, _ = detect_client
+    detect(client, upload(client), save_labels='false', save_media='false')
+    settle()
+    assert not any(results.rglob('labels'))
+    detect(client, upload(client, 'other.png'), save_labels='true', save_media='false')
+    settle()
+    assert len(list(results.rglob('labels/*.txt'))) == 1
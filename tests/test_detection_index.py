@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+from detection_index import DetectionIndex, import_results
+
+
+def row(cls, conf, x=0.5, y=0.5, w=0.1, h=0.1, **extra):
+    return {'class': cls, 'class_name': {0: 'Fish', 1: 'notFish'}[cls], 'confidence': conf,
+            'bbox': [x, y, w, h], **extra}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DetectionIndex(tmp_path / 'detections.sqlite')
+
+
+def test_insert_and_query_filters(index):
+    index.begin_source('reef.jpg', 'best.pt', 'image', 640, 480)
+    index.add('reef.jpg', [row(0, 0.9, x=0.2, y=0.2), row(0, 0.5), row(1, 0.8, x=0.8, y=0.8)], 'best.pt')
+    index.begin_source('dive.mp4', 'best.pt', 'video')
+    index.add('dive.mp4', [row(0, 0.7, frame=10, track_id=1), row(0, 0.75, frame=200, track_id=1)], 'best.pt')
+    assert index.flush(timeout=5)
+
+    assert len(index.query()) == 5
+    fish = index.query(class_name='Fish', min_conf=0.6)
+    assert sorted(r['confidence'] for r in fish) == [0.7, 0.75, 0.9]
+    frames = index.query(sources=['dive.mp4'], frame_min=100, frame_max=500)
+    assert [(r['frame'], r['track_id']) for r in frames] == [(200, 1)]
+    # Boxes intersecting the top-left quarter
+    region = index.query(region=(0, 0, 0.3, 0.3))
+    assert [(r['source'], r['confidence']) for r in region] == [('reef.jpg', 0.9)]
+    assert index.query(order='confidence', limit=1)[0]['confidence'] == 0.9
+    assert index.query(weights='other.pt') == []
+
+
+def test_begin_source_replaces_earlier_rows(index):
+    index.begin_source('reef.jpg', 'best.pt')
+    index.add('reef.jpg', [row(0, 0.9), row(0, 0.8)], 'best.pt')
+    index.begin_source('reef.jpg', 'best.pt')
+    index.add('reef.jpg', [row(1, 0.6)], 'best.pt')
+    # Same source under other weights is a separate entry
+    index.begin_source('reef.jpg', 'yolov5s.pt')
+    index.add('reef.jpg', [row(0, 0.4)], 'yolov5s.pt')
+    index.flush(timeout=5)
+
+    assert [r['class_name'] for r in index.query(weights='best.pt')] == ['notFish']
+    assert len(index.query()) == 2
+    index.remove_source('reef.jpg', 'yolov5s.pt')
+    index.flush(timeout=5)
+    assert [s['weights'] for s in index.sources()] == ['best.pt']
+
+
+def test_aggregate_groups(index):
+    index.begin_source('a.mp4', 'best.pt', 'video')
+    index.add('a.mp4', [row(0, 0.8, frame=5, track_id=1), row(0, 0.6, frame=50, track_id=1),
+                        row(0, 0.7, frame=150, track_id=2), row(1, 0.9, frame=160)], 'best.pt')
+    index.begin_source('b.jpg', 'best.pt')
+    index.add('b.jpg', [row(0, 0.5)], 'best.pt')
+    index.flush(timeout=5)
+
+    by_class = {g['class']: g for g in index.aggregate(['class'])}
+    assert by_class['Fish']['count'] == 4
+    assert by_class['Fish']['sources'] == 2
+    assert by_class['Fish']['mean_confidence'] == pytest.approx(0.65)
+    buckets = index.aggregate(['source', 'frame_bucket'], bucket_size=100, sources=['a.mp4'], class_name='Fish')
+    assert [(g['frame_bucket'], g['count'], g['tracks']) for g in buckets] == [(0, 2, 1), (100, 1, 1)]
+    with pytest.raises(ValueError):
+        index.aggregate(['weights'])
+
+
+def write_labels(path, lines):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(''.join(line + '\n' for line in lines))
+
+
+def test_import_results_keys_sources_like_the_live_path(index, tmp_path):
+    results, uploads = tmp_path / 'results', tmp_path / 'uploads'
+    uploads.mkdir()
+    # Image upload: the timestamp suffix must not be read as a frame number
+    image_dir = results / 'detect_20240101_120000' / 'result'
+    write_labels(image_dir / 'labels' / 'fish_20240101_120000.txt',
+                 ['0 0.5 0.5 0.1 0.1 0.9', '1 0.2 0.2 0.1 0.1 0.4'])
+    (image_dir / 'fish_20240101_120000.jpg').write_bytes(b'jpeg')
+    (uploads / 'fish_20240101_120000.jpg').write_bytes(b'jpeg')
+    # Image uploaded as WebP: the result is a .jpg, the index key is the upload name
+    webp_dir = results / 'detect_20240101_130000' / 'result'
+    write_labels(webp_dir / 'labels' / 'coral_20240101_125959.txt', ['0 0.5 0.5 0.1 0.1 0.8'])
+    (webp_dir / 'coral_20240101_125959.jpg').write_bytes(b'jpeg')
+    (uploads / 'coral_20240101_125959.webp').write_bytes(b'webp')
+    # Labels saved without the annotated image
+    write_labels(results / 'detect_20240101_140000' / 'result' / 'labels' / 'ray_20240101_135900.txt',
+                 ['0 0.5 0.5 0.1 0.1 0.7'])
+    # Video: <stem>_<frame>.txt next to the annotated .mp4 (uploaded as .avi)
+    video_dir = results / 'detect_20240101_150000_abc123' / 'result'
+    write_labels(video_dir / 'labels' / 'dive_20240101_145000_3.txt', ['0 0.5 0.5 0.1 0.1 0.6'])
+    write_labels(video_dir / 'labels' / 'dive_20240101_145000_12.txt', ['0 0.5 0.5 0.1 0.1 0.65'])
+    (video_dir / 'dive_20240101_145000.mp4').write_bytes(b'mp4')
+    (uploads / 'dive_20240101_145000.avi').write_bytes(b'avi')
+    # Bulk run
+    bulk = results / 'bulk_1'
+    bulk.mkdir()
+    (bulk / 'detections.jsonl').write_text(
+        json.dumps({'source': 'sub/a.png', 'width': 24, 'height': 16, 'detections': [row(0, 0.9)]}) + '\n'
+        + '{"source": "half-writ')
+
+    assert import_results(index, results, uploads_dir=uploads) == 7
+
+    sources = {s['name']: s for s in index.sources()}
+    assert set(sources) == {'fish_20240101_120000.jpg', 'coral_20240101_125959.webp', 'ray_20240101_135900',
+                            'dive_20240101_145000.avi', 'bulk_1/sub/a.png'}
+    assert sources['fish_20240101_120000.jpg']['kind'] == 'image'
+    assert sources['dive_20240101_145000.avi']['kind'] == 'video'
+    assert sources['bulk_1/sub/a.png']['width'] == 24
+    image_rows = index.query(sources=['fish_20240101_120000.jpg'])
+    assert [(r['frame'], r['class_name'], r['confidence']) for r in image_rows] == [
+        (0, 'Fish', 0.9), (0, 'notFish', 0.4)]
+    assert [r['frame'] for r in index.query(sources=['dive_20240101_145000.avi'])] == [3, 12]
+
+    # Without the uploads folder the result file name is the key
+    other = DetectionIndex(tmp_path / 'other.sqlite')
+    import_results(other, results)
+    names = {s['name'] for s in other.sources()}
+    assert {'fish_20240101_120000.jpg', 'coral_20240101_125959.jpg', 'dive_20240101_145000.mp4'} <= names
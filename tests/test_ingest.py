@@ -0,0 +1,92 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+from ingest import BufferPool, PooledFile, UploadStore, decode_image, sniff_format
+
+
+@pytest.mark.parametrize('header, fmt', [
+    (b'\xff\xd8\xff\xe0\x00\x10JFIF', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR', 'png'),
+    (b'GIF89a\x01\x00', 'gif'),
+    (b'GIF87a\x01\x00', 'gif'),
+    (b'BM6\x00\x00\x00', 'bmp'),
+    (b'II*\x00\x08\x00', 'tiff'),
+    (b'MM\x00*\x00\x00', 'tiff'),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'webp'),
+    (b'RIFF\x00\x00\x00\x00AVI LIST', 'avi'),
+    (b'\x1a\x45\xdf\xa3\x9f\x42\x86\x81', 'mkv'),
+    (b'\x00\x00\x00\x18ftypheic\x00\x00', 'heif'),
+    (b'\x00\x00\x00\x18ftypmif1\x00\x00', 'heif'),
+    (b'\x00\x00\x00\x14ftypqt  \x00\x00', 'mov'),
+    (b'\x00\x00\x00\x20ftypisom\x00\x00', 'mp4'),
+    (b'%PDF-1.7', None),
+    (b'', None),
+])
+def test_sniff_format(header, fmt):
+    assert sniff_format(header) == fmt
+
+
+def test_sniff_format_reads_memoryview():
+    data = bytearray(b'\x89PNG\r\n\x1a\n' + bytes(100))
+    with memoryview(data) as view:
+        assert sniff_format(view[:16]) == 'png'
+
+
+def test_decode_image_roundtrip():
+    img = np.random.default_rng(0).integers(0, 255, (12, 20, 3), dtype=np.uint8)
+    ok, png = cv2.imencode('.png', img)
+    assert ok
+    np.testing.assert_array_equal(decode_image(png.tobytes(), 'png'), img)
+    with pytest.raises(ValueError):
+        decode_image(b'garbage', 'jpeg')
+
+
+def test_buffer_pool_grows_for_large_uploads_and_shrinks_on_release():
+    pool = BufferPool(initial_size=1024, max_buffers=1)
+    buf = pool.acquire()
+    buf, size = pool.read_stream(io.BytesIO(b'x' * 5000), buf)
+    assert size == 5000 and bytes(buf[:size]) == b'x' * 5000
+    pool.release(buf)
+    assert len(pool.acquire()) == 1024
+    # Beyond max_buffers the buffer is dropped
+    pool.release(bytearray(1024))
+    pool.release(bytearray(1024))
+    assert len(pool._free) == 1
+
+
+def test_pooled_file_writes_into_a_pooled_buffer_and_returns_it_on_close():
+    pool = BufferPool(initial_size=1024, max_buffers=2)
+    f = pool.open()
+    assert isinstance(f, PooledFile)
+    # Written in parser-sized chunks, growing past the initial size
+    for _ in range(3):
+        f.write(b'a' * 700)
+    f.seek(0)
+    assert f.read(5) == b'aaaaa'
+    f.seek(-3, io.SEEK_END)
+    assert f.read() == b'aaa' and f.tell() == 2100
+    with f.getbuffer() as view:
+        assert len(view) == 2100
+    f.close()
+    assert f.closed
+    # Handed back shrunk, and reused by the next upload
+    assert len(pool._free) == 1 and len(pool._free[0]) == 1024
+    assert len(pool.open().buf) == 1024
+
+
+def test_upload_store_evicts_least_recently_used():
+    img = np.zeros((10, 10, 3), dtype=np.uint8)  # 300 bytes
+    store = UploadStore(max_bytes=700)
+    store.put('a', img, 'ha', 'png')
+    store.put('b', img, 'hb', 'png')
+    assert store.get('a') is not None  # a is now the most recent
+    store.put('c', img, 'hc', 'png')
+    assert store.get('b') is None
+    assert store.get('a').content_hash == 'ha'
+    assert store.stats()['bytes'] == 600
+    # Larger than the whole store: returned but not kept
+    store.put('big', np.zeros((30, 30, 3), dtype=np.uint8), 'hbig', 'png')
+    assert store.get('big') is None
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from jobs import CANCELLED, DONE, FAILED, RUNNING, Job, JobManager
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+def looping(started, frames=None):
+    """Job function that reports frames until it is cancelled"""
+    def fn(job):
+        started.set()
+        i = 0
+        while True:
+            job.check_cancelled()
+            i += 1
+            job.progress(i, [{'class_name': 'Fish', 'confidence': 0.5}])
+            if frames is not None and i >= frames:
+                return {'frames': i}
+            time.sleep(0.005)
+    return fn
+
+
+def test_cancel_running_job_runs_cleanup_and_drops_partials():
+    manager = JobManager(max_workers=1)
+    started = threading.Event()
+    job = manager.submit('video_detect', looping(started))
+    cleaned = []
+    job.on_cancel(lambda: cleaned.append(True))
+    started.wait(5)
+    wait_for(lambda: job.frames_done > 2)
+    assert job.status == RUNNING
+
+    assert manager.cancel(job.id) is job
+    wait_for(lambda: job.status == CANCELLED)
+    assert cleaned == [True]
+    assert job.detections == [] and job.summarize() == {}
+    assert job.finished_at is not None
+
+
+def test_cancel_queued_job_never_runs():
+    manager = JobManager(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+    blocker = manager.submit('video_detect', lambda job: (started.set(), release.wait(5)))
+    ran = []
+    queued = manager.submit('video_detect', lambda job: ran.append(job.id))
+    started.wait(5)
+    manager.cancel(queued.id)
+    assert queued.status == CANCELLED
+    release.set()
+    wait_for(lambda: blocker.status == DONE)
+    assert ran == []
+
+
+def test_finished_and_failing_jobs():
+    manager = JobManager(max_workers=1)
+    done = manager.submit('video_detect', looping(threading.Event(), frames=3))
+    failed = manager.submit('video_detect', lambda job: 1 / 0)
+    wait_for(lambda: done.status == DONE and failed.status == FAILED)
+    assert done.result == {'frames': 3} and done.summarize()['Fish']['count'] == 3
+    assert 'division' in failed.error
+    # Cancelling a finished job changes nothing
+    assert manager.cancel(done.id).status == DONE
+    assert manager.cancel('missing') is None
+
+
+def test_cancel_through_another_process(tmp_path):
+    owner, other = JobManager(state_dir=tmp_path), JobManager(state_dir=tmp_path)
+    started = threading.Event()
+    job = owner.submit('bulk_detect', looping(started), files=['clip.mp4'])
+    started.wait(5)
+    wait_for(lambda: other.get(job.id) is not None and other.get(job.id).status == RUNNING)
+    assert 'clip.mp4' in other.referenced_files()
+
+    # The other process leaves a marker, the owner picks it up with its next snapshot
+    other.cancel(job.id)
+    wait_for(lambda: job.status == CANCELLED)
+    wait_for(lambda: other.get(job.id).status == CANCELLED)
+    assert other.referenced_files() == set()
+
+
+def test_detection_window_keeps_the_summary_of_dropped_rows():
+    job = Job('video_detect', max_detections=4)
+    for i in range(10):
+        job.progress(i + 1, [{'class_name': 'Fish', 'confidence': 1.0}])
+    data = job.to_dict(since=8)
+    assert data['detections_total'] == 10
+    assert len(data['detections']) == 2
+    assert job.summarize()['Fish'] == {'count': 10, 'mean_confidence': pytest.approx(1.0)}
@@ -0,0 +1,118 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import live
+from live import LiveManager, LiveStream
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+class FailingCapture:
+    """Opens, then never returns a frame (a truncated file)"""
+
+    def __init__(self):
+        self.reads = 0
+        self.released = False
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return 10.0 if prop == cv2.CAP_PROP_FPS else 0
+
+    def set(self, prop, value):
+        return True
+
+    def read(self):
+        self.reads += 1
+        return False, None
+
+    def release(self):
+        self.released = True
+
+
+def test_stream_detects_and_publishes_frames(tmp_path):
+    pytest.importorskip('utils.plots')  # annotation comes from yolov5
+    video = tmp_path / 'clip.avi'
+    writer = cv2.VideoWriter(str(video), cv2.VideoWriter_fourcc(*'MJPG'), 50, (32, 24))
+    for i in range(10):
+        writer.write(np.full((24, 32, 3), i * 20, dtype=np.uint8))
+    writer.release()
+
+    det = np.array([[2, 2, 10, 10, 0.9, 0]], dtype=np.float32)
+    stream = LiveStream(str(video), lambda img0: det, ['Fish']).start()
+    try:
+        wait_for(lambda: stream.frames_processed >= 3)
+        first = next(stream.mjpeg())
+        assert first.startswith(b'--frame\r\nContent-Type: image/jpeg')
+    finally:
+        stream.stop()
+    stats = stream.stats()
+    assert stats['width'] == 32 and stats['height'] == 24
+    assert stats['frames_captured'] >= stats['frames_processed'] >= 3
+    assert stats['pipeline_latency_ms_p50'] is not None
+
+
+def test_unreadable_looping_source_fails_after_backoff(monkeypatch):
+    cap = FailingCapture()
+    monkeypatch.setattr(live, 'open_capture', lambda source: cap)
+    monkeypatch.setattr(live, 'READ_BACKOFF_MAX', 0.01)
+    stream = LiveStream('dive.mp4', lambda img0: None, ['Fish']).start()
+    wait_for(lambda: not stream.running)
+    assert 'unreadable' in stream.error
+    assert cap.reads == live.MAX_READ_FAILURES + 1 and cap.released
+
+
+def test_manager_limits_concurrent_streams(monkeypatch):
+    monkeypatch.setattr(live, 'open_capture', lambda source: FailingCapture())
+    manager = LiveManager(max_streams=1)
+    first = manager.start(LiveStream('a.mp4', lambda img0: None, [], realtime=False))
+    # A stopped stream no longer counts
+    wait_for(lambda: not first.running)
+    second = LiveStream('b.mp4', lambda img0: None, [], realtime=True)
+    monkeypatch.setattr(live, 'READ_BACKOFF_MAX', 5)
+    manager.start(second)
+    try:
+        with pytest.raises(RuntimeError):
+            manager.start(LiveStream('c.mp4', lambda img0: None, []))
+        assert manager.list() == [second]
+    finally:
+        second.stop()
+
+
+def test_live_sources_are_restricted(client, monkeypatch):
+    import app as ikan_app
+
+    _, uploads, _ = client
+    (uploads / 'dive.mp4').write_bytes(b'video')
+    monkeypatch.setitem(ikan_app.app.config, 'LIVE_ALLOWED_HOSTS', {'cam.local'})
+    assert ikan_app.live_source('0') == '0'
+    assert ikan_app.live_source('dive.mp4') == str(uploads / 'dive.mp4')
+    assert ikan_app.live_source('rtsp://cam.local/stream') == 'rtsp://cam.local/stream'
+    for source in ('rtsp://elsewhere/stream', 'file:///etc/passwd', 'missing.mp4', ''):
+        with pytest.raises(ValueError):
+            ikan_app.live_source(source)
+
+
+def test_live_is_disabled_with_several_workers(client, monkeypatch):
+    import app as ikan_app
+
+    client, _, _ = client
+    monkeypatch.setitem(ikan_app.app.config, 'SERVER_WORKERS', 2)
+    response = client.post('/api/live', json={'source': '0'})
+    assert response.status_code == 409 and 'IKAN_LIVE=1' in response.get_json()['error']
+    page = client.get('/').get_data(as_text=True)
+    assert 'data-enabled="false"' in page and 'id="liveDisabledNote"' in page
+
+    monkeypatch.setitem(ikan_app.app.config, 'SERVER_WORKERS', 1)
+    page = client.get('/').get_data(as_text=True)
+    assert 'data-enabled="true"' in page and 'liveDisabledNote' not in page
@@ -0,0 +1,126 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+import media
+from media import MediaCache, faststart
+
+
+def atom(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def chunk_table(kind, offsets):
+    fmt = '>I' if kind == b'stco' else '>Q'
+    return atom(kind, struct.pack('>II', 0, len(offsets)) + b''.join(struct.pack(fmt, o) for o in offsets))
+
+
+def write_mp4(path, kind=b'stco', moov_first=False):
+    """ftyp + mdat with three chunks + moov whose chunk offset table points into mdat"""
+    ftyp = atom(b'ftyp', b'isom\x00\x00\x02\x00isomiso2mp41')
+    chunks = [b'AAAA' * 8, b'BBBB' * 4, b'CCCC' * 16]
+    mdat = atom(b'mdat', b''.join(chunks))
+
+    def moov_for(mdat_offset):
+        offsets, pos = [], mdat_offset + 8
+        for c in chunks:
+            offsets.append(pos)
+            pos += len(c)
+        stbl = atom(b'stbl', chunk_table(kind, offsets))
+        trak = atom(b'trak', atom(b'mdia', atom(b'minf', stbl)))
+        return atom(b'moov', atom(b'mvhd', bytes(100)) + trak)
+
+    if moov_first:
+        moov = moov_for(len(ftyp) + len(moov_for(0)))
+        data = ftyp + moov + mdat
+    else:
+        data = ftyp + mdat + moov_for(len(ftyp))
+    path.write_bytes(data)
+    return chunks
+
+
+def read_chunks(data):
+    """Chunks addressed by the first chunk offset table in the file"""
+    for kind, fmt, width in ((b'stco', '>I', 4), (b'co64', '>Q', 8)):
+        pos = data.find(kind)
+        if pos >= 0:
+            count = struct.unpack_from('>I', data, pos + 8)[0]
+            offsets = [struct.unpack_from(fmt, data, pos + 12 + i * width)[0] for i in range(count)]
+            return [data[o:o + 4] for o in offsets]
+    raise AssertionError('no chunk offset table')
+
+
+def top_level(data):
+    return [kind for kind, _, _, _ in media._atoms(data, 0, len(data))]
+
+
+@pytest.mark.parametrize('kind', [b'stco', b'co64'])
+def test_faststart_moves_moov_and_patches_offsets(tmp_path, kind):
+    path = tmp_path / 'result.mp4'
+    chunks = write_mp4(path, kind)
+    before = path.read_bytes()
+    assert top_level(before) == [b'ftyp', b'mdat', b'moov']
+
+    assert faststart(path) is True
+    after = path.read_bytes()
+    assert len(after) == len(before)
+    assert top_level(after) == [b'ftyp', b'moov', b'mdat']
+    assert read_chunks(after) == [c[:4] for c in chunks]
+
+
+def test_faststart_leaves_streamable_and_non_mp4_files_alone(tmp_path):
+    path = tmp_path / 'ok.mp4'
+    write_mp4(path, moov_first=True)
+    before = path.read_bytes()
+    assert faststart(path) is True
+    assert path.read_bytes() == before
+
+    other = tmp_path / 'no_moov.mp4'
+    other.write_bytes(atom(b'ftyp', b'isom') + atom(b'mdat', b'x' * 10))
+    assert faststart(other) is False
+
+
+def test_faststart_rejects_corrupt_atoms(tmp_path):
+    path = tmp_path / 'bad.mp4'
+    path.write_bytes(atom(b'ftyp', b'isom') + struct.pack('>I4s', 1000, b'mdat') + b'short')
+    with pytest.raises(ValueError):
+        faststart(path)
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_make_streamable_without_ffmpeg_falls_back_to_faststart(tmp_path):
+    path = tmp_path / 'result.mp4'
+    write_mp4(path)
+    assert media.make_streamable(path, ffmpeg='') == 'faststart'
+    assert media.make_streamable(tmp_path / 'missing.mp4', ffmpeg='') is None
+
+
+def test_media_cache_renders_once_and_evicts_lru(tmp_path):
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 255, (600, 900, 3), dtype=np.uint8) for _ in range(3)]
+    cache = MediaCache(tmp_path / 'media', max_bytes=10 ** 9)
+    first = cache.variant_of_array(images[0], 'h0', 'thumb')
+    assert cache.variant_of_array(images[0], 'h0', 'thumb') == first
+    assert cache.stats()['renders'] == 1 and cache.stats()['hits'] == 1
+    assert max(cv2.imread(str(first)).shape[:2]) == 320
+
+    # Budget for about two thumbnails: the least recently used one goes
+    cache.max_bytes = first.stat().st_size * 2 + 100
+    cache.variant_of_array(images[1], 'h1', 'thumb')
+    cache.variant_of_array(images[2], 'h2', 'thumb')
+    assert not first.exists()
+    assert cache.stats()['evictions'] >= 1
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    with pytest.raises(ValueError):
+        cache.variant_of_array(images[0], 'h0', 'huge')
+
+
+def test_media_cache_counts_variants_rendered_by_another_process(tmp_path):
+    img = np.zeros((400, 400, 3), dtype=np.uint8)
+    worker_a, worker_b = MediaCache(tmp_path), MediaCache(tmp_path)
+    path = worker_a.variant_of_array(img, 'h', 'preview')
+    assert worker_b.variant_of_array(img, 'h', 'preview') == path
+    assert worker_b.stats()['renders'] == 0
+    assert worker_b.stats()['files'] == 1 and worker_b.stats()['bytes'] == path.stat().st_size
@@ -0,0 +1,56 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('flask')
+
+
+def test_range_request_returns_partial_content(client):
+    client, uploads, _ = client
+    data = bytes(range(256)) * 40
+    (uploads / 'clip.mp4').write_bytes(data)
+
+    full = client.get('/api/uploads/clip.mp4')
+    assert full.status_code == 200
+    assert full.headers['Accept-Ranges'] == 'bytes'
+    assert full.data == data
+
+    part = client.get('/api/uploads/clip.mp4', headers={'Range': 'bytes=100-199'})
+    assert part.status_code == 206
+    assert part.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+    assert part.data == data[100:200]
+
+    tail = client.get('/api/uploads/clip.mp4', headers={'Range': 'bytes=-10'})
+    assert tail.status_code == 206 and tail.data == data[-10:]
+
+    beyond = client.get('/api/uploads/clip.mp4', headers={'Range': f'bytes={len(data) + 10}-'})
+    assert beyond.status_code == 416
+
+
+def test_etag_revalidation(client):
+    client, uploads, _ = client
+    (uploads / 'a.jpg').write_bytes(b'\xff\xd8\xff' + bytes(64))
+    first = client.get('/api/uploads/a.jpg')
+    assert first.headers['ETag']
+    again = client.get('/api/uploads/a.jpg', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_size_variants(client):
+    client, uploads, _ = client
+    cv2.imwrite(str(uploads / 'big.png'), np.full((900, 1600, 3), 80, dtype=np.uint8))
+    thumb = client.get('/api/uploads/big.png?size=thumb')
+    assert thumb.status_code == 200 and thumb.mimetype == 'image/jpeg'
+    img = cv2.imdecode(np.frombuffer(thumb.data, np.uint8), cv2.IMREAD_COLOR)
+    assert max(img.shape[:2]) == 320
+    assert client.get('/api/uploads/big.png?size=huge').status_code == 400
+
+
+def test_missing_result_returns_404_without_waiting(client):
+    client, _, results = client
+    (results / 'detect_1' / 'result').mkdir(parents=True)
+    t0 = time.monotonic()
+    assert client.get('/api/results/detect_1/result/nothing.jpg').status_code == 404
+    assert time.monotonic() - t0 < 1
@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+
+import pytest
+
+from metrics import MetricsRegistry, Trace
+
+
+def build(shared_dir=None, queue_depth=0):
+    registry = MetricsRegistry(shared_dir=shared_dir)
+    requests = registry.counter('ikan_requests_total', 'Requests', ('endpoint',))
+    latency = registry.histogram('ikan_latency_seconds', 'Latency', ('endpoint',), buckets=(0.1, 1.0))
+    registry.gauge('ikan_queue_depth', 'Queue', lambda: queue_depth, per_process=True)
+    registry.gauge('ikan_disk_bytes', 'Disk', lambda: {('uploads',): 10}, ('area',))
+    return registry, requests, latency
+
+
+def lines(text, prefix):
+    return sorted(line for line in text.splitlines() if line.startswith(prefix))
+
+
+def test_render_prometheus_text():
+    registry, requests, latency = build(queue_depth=3)
+    requests.inc(endpoint='detect')
+    requests.inc(2, endpoint='detect')
+    latency.observe(0.05, endpoint='detect')
+    latency.observe(0.5, endpoint='detect')
+    latency.observe(5, endpoint='detect')
+    text = registry.render()
+
+    assert '# TYPE ikan_requests_total counter' in text
+    assert 'ikan_requests_total{endpoint="detect"} 3.0' in text
+    assert lines(text, 'ikan_latency_seconds_bucket') == [
+        'ikan_latency_seconds_bucket{endpoint="detect",le="+Inf"} 3',
+        'ikan_latency_seconds_bucket{endpoint="detect",le="0.1"} 1',
+        'ikan_latency_seconds_bucket{endpoint="detect",le="1.0"} 2',
+    ]
+    assert 'ikan_latency_seconds_count{endpoint="detect"} 3' in text
+    assert 'ikan_queue_depth 3.0' in text
+    assert 'ikan_disk_bytes{area="uploads"} 10.0' in text
+
+
+def test_failing_gauge_does_not_break_the_scrape():
+    registry = MetricsRegistry()
+    registry.gauge('ikan_broken', 'Broken', lambda: 1 / 0)
+    registry.counter('ikan_ok_total', 'Ok').inc()
+    assert 'ikan_ok_total 1.0' in registry.render()
+
+
+def worker(shared_dir, count, queue_depth, hold):
+    registry, requests, latency = build(shared_dir, queue_depth)
+    requests.inc(count, endpoint='detect')
+    latency.observe(0.5, endpoint='detect')
+    registry.flush()
+    if hold is not None:
+        hold.wait(10)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_workers_are_summed_and_exited_workers_still_count(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    exited = ctx.Process(target=worker, args=(tmp_path, 5, 7, None))
+    exited.start()
+    exited.join(10)
+    hold = ctx.Event()
+    live = ctx.Process(target=worker, args=(tmp_path, 2, 4, hold))
+    live.start()
+    try:
+        deadline = 50
+        while not (tmp_path / f'{live.pid}.json').exists() and deadline:
+            live.join(0.1)
+            deadline -= 1
+        registry, requests, latency = build(tmp_path, queue_depth=1)
+        requests.inc(endpoint='detect')
+        text = registry.render()
+    finally:
+        hold.set()
+        live.join(10)
+
+    assert 'ikan_requests_total{endpoint="detect"} 8.0' in text
+    assert 'ikan_latency_seconds_count{endpoint="detect"} 2' in text
+    # Per-process gauges of live processes only, one series per pid
+    assert lines(text, 'ikan_queue_depth{') == sorted([f'ikan_queue_depth{{pid="{os.getpid()}"}} 1.0',
+                                                       f'ikan_queue_depth{{pid="{live.pid}"}} 4.0'])
+    # Shared gauges once, not per process
+    assert lines(text, 'ikan_disk_bytes{') == ['ikan_disk_bytes{area="uploads"} 10.0']
+    # The exited worker was folded away, its counts kept
+    assert not (tmp_path / f'{exited.pid}.json').exists()
+    # Once the other worker has exited too, its counts stay and its gauges go
+    text = registry.render()
+    assert 'ikan_requests_total{endpoint="detect"} 8.0' in text
+    assert lines(text, 'ikan_queue_depth{') == [f'ikan_queue_depth{{pid="{os.getpid()}"}} 1.0']
+
+
+def test_reset_drops_counts_inherited_from_the_master(tmp_path):
+    registry, requests, latency = build(tmp_path)
+    requests.inc(3, endpoint='warmup')
+    latency.observe(0.2, endpoint='warmup')
+    registry.reset()
+    text = registry.render()
+    assert 'ikan_requests_total{' not in text
+    assert 'ikan_latency_seconds_count{' not in text
+
+
+def test_trace_records_stages_into_the_histogram():
+    registry = MetricsRegistry()
+    stages = registry.histogram('ikan_stage_seconds', 'Stages', ('endpoint', 'stage'))
+    trace = Trace('detect', 'abc')
+    with trace.stage('decode'):
+        pass
+    trace.record_timings({'inference': 0.02, 'cache': 'miss', 'nms': True})
+    trace.finish(stages)
+    assert [s['stage'] for s in trace.to_dict()['stages']] == ['decode', 'inference']
+    assert 'ikan_stage_seconds_count{endpoint="detect",stage="inference"} 1' in registry.render()
+
+
+def test_detect_trace_and_metrics_endpoint(detect_client):
+    from test_detect_routes import upload
+
+    import app as ikan_app
+
+    client, _, _, _ = detect_client
+    counts = {tuple(key): value for key, value in ikan_app.DETECT_CACHE.snapshot()}
+    before = {result: counts.get((result,), 0) for result in ('miss', 'refilter')}
+    filename = upload(client)
+    response = client.post('/api/detect?trace=1', json={'filename': filename, 'weights': 'best.pt',
+                                                        'save_media': False},
+                           headers={'X-Trace-Id': 'req-42'})
+    assert response.headers['X-Trace-Id'] == 'req-42'
+    stages = [s['stage'] for s in response.get_json()['trace']['stages']]
+    assert {'hash', 'cache_lookup', 'inference', 'cache_store', 'format'} <= set(stages)
+    # Without asking for it the response carries no trace
+    assert 'trace' not in client.post('/api/detect', json={'filename': filename, 'weights': 'best.pt',
+                                                           'save_media': False}).get_json()
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'ikan_request_seconds_count{endpoint="detect",status="200"}' in text
+    assert 'ikan_stage_seconds_count{endpoint="detect",stage="inference"}' in text
+    # Nothing was saved for the first run's threshold, so the repeat is a re-filter
+    assert f'ikan_detect_cache_total{{result="miss"}} {before["miss"] + 1}' in text
+    assert f'ikan_detect_cache_total{{result="refilter"}} {before["refilter"] + 1}' in text
+    # The scrape itself isn't timed
+    assert 'endpoint="get_metrics"' not in text
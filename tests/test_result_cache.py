@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from result_cache import ResultCache, hash_bytes
+
+DET = np.array([[0, 0, 5, 5, 0.9, 0], [5, 5, 9, 9, 0.4, 1], [1, 1, 3, 3, 0.15, 0]], dtype=np.float32)
+
+
+@pytest.fixture
+def weights(tmp_path):
+    path = tmp_path / 'best.pt'
+    path.write_bytes(b'weights v1')
+    return path
+
+
+def test_key_covers_content_weights_and_pre_nms_settings(tmp_path, weights):
+    cache = ResultCache(tmp_path / 'cache')
+    base = cache.make_key(hash_bytes(b'img'), weights, 640, 0.45, 1000)
+    assert cache.make_key(hash_bytes(b'img'), weights, 640, 0.45, 1000) == base
+    changed = [
+        cache.make_key(hash_bytes(b'other'), weights, 640, 0.45, 1000),
+        cache.make_key(hash_bytes(b'img'), weights, 320, 0.45, 1000),
+        cache.make_key(hash_bytes(b'img'), weights, 640, 0.5, 1000),
+        cache.make_key(hash_bytes(b'img'), weights, 640, 0.45, 10),
+        cache.make_key(hash_bytes(b'img'), weights, 640, 0.45, 1000, mode='tiled:640:0.2'),
+    ]
+    assert base not in changed and len(set(changed)) == len(changed)
+
+    # Retrained weights under the same file name are a different model
+    weights.write_bytes(b'weights v2, retrained')
+    assert cache.make_key(hash_bytes(b'img'), weights, 640, 0.45, 1000) != base
+
+
+def test_refilter_answers_thresholds_above_the_floor_only(tmp_path):
+    cache = ResultCache(tmp_path / 'cache', conf_floor=0.1)
+    cache.put('k', DET, 0.1, (48, 64, 3))
+    entry = cache.get('k', 0.5)
+    assert entry.filter(0.5).tolist() == DET[:1].tolist()
+    assert len(entry.filter(0.1)) == 3
+    # Below the floor the cached predictions may be missing boxes
+    assert cache.get('k', 0.05) is None
+    stats = cache.stats()
+    assert stats['memory_hits'] == 1 and stats['refilter_hits'] == 1 and stats['misses'] == 1
+
+
+def test_entries_survive_a_restart_and_disk_is_bounded(tmp_path):
+    cache = ResultCache(tmp_path / 'cache', max_memory_entries=1)
+    cache.put('a', DET, 0.1, (48, 64, 3))
+    size = cache.stats()['disk_bytes']
+
+    reopened = ResultCache(tmp_path / 'cache')
+    entry = reopened.get('a', 0.3)
+    assert entry.shape == (48, 64, 3) and len(entry.filter(0.3)) == 2
+    assert reopened.stats()['disk_hits'] == 1
+
+    small = ResultCache(tmp_path / 'small', max_disk_bytes=size * 2)
+    for key in 'abc':
+        small.put(key, DET, 0.1, (48, 64, 3))
+    assert small.stats()['disk_entries'] == 2 and small.stats()['disk_evictions'] == 1
+    assert not (tmp_path / 'small' / 'a.npz').exists()
+
+
+def test_threshold_change_is_served_without_inference(detect_client):
+    from test_detect_routes import detect, upload
+
+    client, _, _, detector = detect_client
+    filename = upload(client)
+    first = detect(client, filename, conf_thres=0.25, save_media=False)
+    assert first['timings']['cache'] == 'miss' and first['detection_count'] == 3
+    # Inferred once at the cache floor, whatever the requested threshold
+    assert [call['conf_thres'] for call in detector.calls] == [0.1]
+
+    second = detect(client, filename, conf_thres=0.6, save_media=False)
+    assert second['timings']['cache'] == 'refilter'
+    assert second['detection_count'] == 1 and second['detections'][0]['confidence'] == pytest.approx(0.9)
+    assert len(detector.calls) == 1
+
+    # Pre-NMS settings are part of the key, a threshold below the floor can't be re-filtered
+    detect(client, filename, conf_thres=0.6, iou_thres=0.7, save_media=False)
+    detect(client, filename, conf_thres=0.05, save_media=False)
+    assert [call['conf_thres'] for call in detector.calls] == [0.1, 0.1, 0.05]
@@ -0,0 +1,121 @@
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from startup import Warmup, snapshot_path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+def test_stages_run_in_order_with_timings():
+    ran = []
+    warmup = Warmup(started_at=time.time() - 1)
+    for name in ('imports', 'weights_catalog', 'models'):
+        warmup.stage(name, lambda name=name: ran.append(name))
+    assert not warmup.ready and warmup.status()['stages'] == {'imports': None, 'weights_catalog': None,
+                                                              'models': None}
+    warmup.run()
+    assert ran == ['imports', 'weights_catalog', 'models']
+    status = warmup.status()
+    assert status['ready'] and status['state'] == 'ready'
+    assert all(seconds is not None for seconds in status['stages'].values())
+    assert status['time_to_ready_seconds'] >= 1
+
+
+def test_optional_stage_failure_is_recorded_required_one_stops():
+    def broken():
+        raise RuntimeError('no weights')
+
+    optional = Warmup()
+    optional.stage('models', broken, required=False)
+    optional.stage('first_inference', lambda: None, required=False)
+    optional.run()
+    assert optional.ready and optional.errors == {'models': 'no weights'}
+
+    ran = []
+    required = Warmup()
+    required.stage('imports', broken)
+    required.stage('models', lambda: ran.append('models'))
+    required.run()
+    assert required.state == 'failed' and not required.ready and ran == []
+
+
+def test_start_runs_once_in_the_background():
+    calls, release = [], threading.Event()
+    warmup = Warmup()
+    warmup.stage('imports', lambda: (calls.append(1), release.wait(5)))
+    warmup.start()
+    warmup.start()  # every request calls it, only the first one starts the stages
+    assert warmup.state == 'running'
+    release.set()
+    wait_for(lambda: warmup.ready)
+    warmup.start()
+    assert calls == [1]
+
+
+def test_first_detection_is_timed_once():
+    warmup = Warmup(started_at=time.time() - 2)
+    assert warmup.time_to_first_detection() is None
+    warmup.mark_first_detection()
+    first = warmup.time_to_first_detection()
+    warmup.mark_first_detection()
+    assert first >= 2 and warmup.time_to_first_detection() == first
+
+
+def test_snapshot_is_named_after_the_weights_content(tmp_path):
+    sha = 'ab' * 32
+    assert snapshot_path(tmp_path, sha) == tmp_path / f'{sha[:32]}.pt'
+
+
+def test_app_imports_without_torch():
+    code = 'import sys, app; print(sorted(m for m in ("torch", "torchvision") if m in sys.modules))'
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip().splitlines()[-1] == '[]'
+
+
+def test_ready_reports_503_until_warm(client, monkeypatch):
+    import app as ikan_app
+
+    client, _, _ = client
+    release = threading.Event()
+    warmup = Warmup()
+    warmup.stage('imports', lambda: release.wait(5))
+    # The first request starts the warm-up in the background
+    monkeypatch.setattr(ikan_app, 'warmup', warmup)
+    pending = client.get('/api/ready')
+    assert pending.status_code == 503 and pending.get_json()['state'] == 'running'
+    assert client.get('/api/health').get_json()['ready'] is False
+
+    release.set()
+    wait_for(lambda: warmup.ready)
+    body = client.get('/api/ready').get_json()
+    assert body['ready'] and body['stages']['imports'] is not None
+
+
+@pytest.mark.parametrize('built', [True, False])
+def test_warm_snapshot_only_for_built_snapshots(client, tmp_path, monkeypatch, built):
+    import app as ikan_app
+
+    sha = 'cd' * 32
+    monkeypatch.setitem(ikan_app.app.config, 'SNAPSHOT_FOLDER', tmp_path / 'snapshots')
+    monkeypatch.setattr(ikan_app.weights_catalog, 'get',
+                        lambda path: {'sha256': sha} if path == 'best.pt' else None)
+    if built:
+        (tmp_path / 'snapshots').mkdir()
+        snapshot_path(tmp_path / 'snapshots', sha).write_bytes(b'fused')
+    expected = str(snapshot_path(tmp_path / 'snapshots', sha)) if built else None
+    assert ikan_app.warm_snapshot('best.pt') == expected
+    assert ikan_app.warm_snapshot('other.pt') is None
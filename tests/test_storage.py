@@ -0,0 +1,161 @@
+import os
+import time
+
+import pytest
+
+from storage import MIN_AGE_SECONDS, StorageManager
+
+HOUR = 3600
+
+
+def age(path, seconds):
+    """Set the mtime of path (and everything under it) to `seconds` ago"""
+    stamp = time.time() - seconds
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            os.utime(os.path.join(root, name), (stamp, stamp))
+    os.utime(path, (stamp, stamp))
+
+
+def upload(manager, name, size, seconds):
+    path = manager.uploads_dir / name
+    path.write_bytes(b'u' * size)
+    age(path, seconds)
+    return path
+
+
+def result(manager, name, size, seconds):
+    path = manager.results_dir / name
+    (path / 'result').mkdir(parents=True)
+    (path / 'result' / 'out.jpg').write_bytes(b'r' * size)
+    (path / 'detections.json').write_text('{"detections": []}')
+    age(path, seconds)
+    return path
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    def make(**kwargs):
+        uploads, results = tmp_path / 'uploads', tmp_path / 'results'
+        uploads.mkdir(exist_ok=True)
+        return StorageManager(uploads, results, tmp_path / 'cache' / 'storage.lock', **kwargs)
+    return make
+
+
+def deleted(report):
+    return {(d['area'], d['name'], d['reason']) for d in report['deleted']}
+
+
+def test_age_pass_uses_per_area_limits(make_manager):
+    manager = make_manager(upload_max_age=HOUR, result_max_age=24 * HOUR)
+    old_upload = upload(manager, 'old.jpg', 10, 2 * HOUR)
+    new_upload = upload(manager, 'new.jpg', 10, 0.5 * HOUR)
+    kept_result = result(manager, 'detect_1', 10, 2 * HOUR)
+    old_result = result(manager, 'detect_2', 10, 48 * HOUR)
+
+    report = manager.sweep()
+
+    assert deleted(report) == {('uploads', 'old.jpg', 'age'), ('results', 'detect_2', 'age')}
+    assert not old_upload.exists() and not old_result.exists()
+    assert new_upload.exists() and kept_result.exists()
+    assert manager.stats()['last_sweep']['deleted_count'] == 2
+
+
+def test_quota_evicts_least_recently_used_first(make_manager):
+    manager = make_manager(max_bytes=2500)
+    upload(manager, 'a.jpg', 1000, 5 * HOUR)
+    upload(manager, 'b.jpg', 1000, 3 * HOUR)
+    upload(manager, 'c.jpg', 1000, 2 * HOUR)
+    upload(manager, 'd.jpg', 1000, 1 * HOUR)
+
+    report = manager.sweep()
+
+    assert deleted(report) == {('uploads', 'a.jpg', 'quota'), ('uploads', 'b.jpg', 'quota')}
+    assert sorted(p.name for p in manager.uploads_dir.iterdir()) == ['c.jpg', 'd.jpg']
+    assert report['usage']['total_bytes'] == 2000
+    assert not report['over_quota']
+
+
+def test_touch_moves_an_entry_to_the_back_of_the_queue(make_manager):
+    manager = make_manager(max_bytes=1500)
+    old = result(manager, 'detect_old', 1000, 5 * HOUR)
+    result(manager, 'detect_new', 1000, 2 * HOUR)
+    manager.touch(old / 'result' / 'out.jpg')
+    assert time.time() - old.stat().st_mtime < 60
+    # Used a little longer ago than the recency guard, but well after detect_new
+    stamp = time.time() - MIN_AGE_SECONDS - 60
+    os.utime(old, (stamp, stamp))
+
+    report = manager.sweep()
+
+    assert deleted(report) == {('results', 'detect_new', 'quota')}
+    assert old.exists()
+
+
+def test_referenced_and_recent_entries_are_protected(make_manager):
+    manager = make_manager(max_bytes=100, upload_max_age=HOUR, result_max_age=HOUR,
+                           referenced=lambda: {'detect_cached'})
+    cached = result(manager, 'detect_cached', 1000, 48 * HOUR)
+    fresh = upload(manager, 'fresh.jpg', 1000, MIN_AGE_SECONDS / 2)
+    stale = upload(manager, 'stale.jpg', 1000, 48 * HOUR)
+
+    report = manager.sweep()
+
+    assert deleted(report) == {('uploads', 'stale.jpg', 'age')}
+    assert not stale.exists()
+    assert cached.exists() and fresh.exists()
+    # Still over quota, but everything left is protected
+    assert report['over_quota']
+
+
+def test_dry_run_reports_without_deleting(make_manager):
+    manager = make_manager(max_bytes=500, upload_max_age=HOUR, compact_after=HOUR)
+    stale = upload(manager, 'stale.jpg', 1000, 48 * HOUR)
+    old_result = result(manager, 'detect_1', 1000, 2 * HOUR)
+
+    report = manager.sweep(dry_run=True)
+
+    assert report['dry_run']
+    assert ('uploads', 'stale.jpg', 'age') in deleted(report)
+    assert [a['name'] for a in report['archived']] == ['detect_1']
+    assert stale.exists() and old_result.exists()
+    assert not list(manager.archive_dir.iterdir())
+    assert not manager.report_path.exists()
+
+
+def test_compaction_archives_and_restores(make_manager):
+    manager = make_manager(compact_after=HOUR)
+    path = result(manager, 'detect_7', 4000, 2 * HOUR)
+    recent = result(manager, 'detect_8', 4000, 0.5 * HOUR)
+
+    report = manager.sweep()
+
+    assert [a['name'] for a in report['archived']] == ['detect_7']
+    assert report['archived_bytes_saved'] > 0
+    assert not path.exists() and recent.exists()
+    assert (manager.archive_dir / 'detect_7.tar.gz').exists()
+
+    assert manager.restore('detect_7')
+    assert (path / 'result' / 'out.jpg').read_bytes() == b'r' * 4000
+    assert not (manager.archive_dir / 'detect_7.tar.gz').exists()
+    # Restored entries count as just used
+    assert time.time() - path.stat().st_mtime < 60
+
+
+def test_restore_rejects_unknown_and_unsafe_names(make_manager):
+    manager = make_manager()
+    assert not manager.restore('detect_missing')
+    assert not manager.restore('../uploads')
+    assert not manager.restore('')
+
+
+def test_only_one_process_sweeps_at_a_time(make_manager):
+    import fcntl
+
+    manager = make_manager()
+    manager.lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manager.lock_path, 'a') as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        # flock locks are per open file description, so a second open contends like another process
+        assert manager.sweep() == {'skipped': 'another process is sweeping'}
+    assert 'deleted' in manager.sweep()
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from tiling import merge_detections, tile_windows
+
+
+def covered(windows, h, w):
+    mask = np.zeros((h, w), dtype=bool)
+    for x0, y0, x1, y1 in windows:
+        mask[y0:y1, x0:x1] = True
+    return mask.all()
+
+
+def test_small_image_is_one_window():
+    assert tile_windows(480, 600, tile_size=640) == [(0, 0, 600, 480)]
+
+
+@pytest.mark.parametrize('h, w, tile, overlap', [(1080, 1920, 640, 0.2), (2160, 3840, 640, 0.25),
+                                                  (700, 641, 640, 0.0), (1000, 1000, 320, 0.5)])
+def test_windows_cover_image_with_overlap_and_fixed_size(h, w, tile, overlap):
+    windows = tile_windows(h, w, tile, overlap)
+    assert covered(windows, h, w)
+    for x0, y0, x1, y1 in windows:
+        assert 0 <= x0 < x1 <= w and 0 <= y0 < y1 <= h
+        # Every tile is full size, the last one in a row / column is flush with the edge
+        assert x1 - x0 == min(tile, w) and y1 - y0 == min(tile, h)
+    xs = sorted({x0 for x0, _, _, _ in windows})
+    step = max(1, int(tile * (1 - overlap)))
+    assert all(b - a <= step for a, b in zip(xs, xs[1:]))
+    assert xs[-1] == max(0, w - tile)
+
+
+def test_merge_keeps_best_of_cross_tile_duplicates():
+    pytest.importorskip('torchvision')
+    left = np.array([[100, 100, 200, 200, 0.9, 0], [10, 10, 20, 20, 0.5, 1]], dtype=np.float32)
+    # Same fish seen by the neighbouring tile, slightly shifted and less confident
+    right = np.array([[102, 101, 201, 199, 0.7, 0]], dtype=np.float32)
+    merged = merge_detections([left, right, np.zeros((0, 6), dtype=np.float32)], iou_thres=0.45)
+    assert merged.shape == (2, 6)
+    assert merged[0].tolist() == pytest.approx(left[0].tolist())
+
+
+def test_merge_is_class_aware_and_bounded():
+    pytest.importorskip('torchvision')
+    same_box = np.array([[0, 0, 50, 50, 0.8, 0], [0, 0, 50, 50, 0.6, 1]], dtype=np.float32)
+    assert len(merge_detections([same_box])) == 2
+    many = np.array([[i * 100, 0, i * 100 + 50, 50, 0.5, 0] for i in range(10)], dtype=np.float32)
+    assert len(merge_detections([many], max_det=3)) == 3
+    assert merge_detections([]).shape == (0, 6)
+
+
+class FakeRegistry:
+    """Records the size tiles are prepared at; one detection in the top-left corner of every tile"""
+
+    def __init__(self):
+        self.prepared = []
+
+    def get(self, weights_path):
+        return object()
+
+    def prepare(self, loaded, img0, imgsz):
+        self.prepared.append((img0.shape[:2], imgsz))
+        return np.zeros((3, imgsz, imgsz), dtype=np.uint8), imgsz
+
+    def forward(self, loaded, batch):
+        return np.zeros(batch.shape), None
+
+    def postprocess(self, pred, input_shape, shapes, conf_thres, iou_thres, max_det):
+        return [np.array([[0, 0, 10, 10, 0.9, 0]], dtype=np.float32) for _ in shapes]
+
+
+@pytest.mark.parametrize('input_size, expected', [(None, 320), (640, 640)])
+def test_tiles_are_fed_at_the_models_fixed_input_size(input_size, expected):
+    pytest.importorskip('torchvision')
+    from tiling import run_tiled
+
+    registry = FakeRegistry()
+    img0 = np.zeros((600, 900, 3), dtype=np.uint8)
+    det, timings = run_tiled(registry, 'w.torchscript', img0, tile_size=320, overlap=0.0, include_full=False,
+                             input_size=input_size)
+    windows = tile_windows(600, 900, 320, 0.0)
+    # Crops are still tile_size pixels of the original, only the model input size changes
+    assert registry.prepared == [((320, 320), expected)] * len(windows)
+    assert timings['tile_input_size'] == expected
+    # Boxes come back in original image coordinates
+    assert sorted(det[:, :2].tolist()) == sorted([[x0, y0] for x0, y0, _, _ in windows])
+
+
+def test_fixed_input_size_by_backend():
+    import backends
+
+    assert backends.fixed_input_size(backends.TORCHSCRIPT, 1280) == 1280
+    for backend in (backends.PYTORCH, backends.ONNX, backends.ONNX_INT8):
+        assert backends.fixed_input_size(backend, 1280) is None
+    with pytest.raises(ValueError):
+        backends.fixed_input_size('tensorrt', 640)
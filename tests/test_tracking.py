@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from tracking import KalmanBox, Tracker, iou_matrix
+
+pytest.importorskip('scipy')
+
+
+def box(x, y, size=40, conf=0.9, cls=0):
+    return [x, y, x + size, y + size, conf, cls]
+
+
+def test_iou_matrix():
+    a = np.array([[0, 0, 10, 10], [20, 20, 30, 30]], dtype=np.float32)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10]], dtype=np.float32)
+    iou = iou_matrix(a, b)
+    assert iou.shape == (2, 2)
+    assert iou[0, 0] == pytest.approx(1.0)
+    assert iou[0, 1] == pytest.approx(50 / 150)
+    assert iou[1].tolist() == [0, 0]
+    assert iou_matrix(a, np.zeros((0, 4))).shape == (2, 0)
+
+
+def test_kalman_learns_constant_velocity():
+    kf = KalmanBox(np.array([0, 0, 20, 20], dtype=np.float64))
+    for step in range(1, 15):
+        kf.predict()
+        kf.update(np.array([5 * step, 0, 5 * step + 20, 20], dtype=np.float64))
+    predicted = kf.predict()
+    assert predicted[0] == pytest.approx(75, abs=1.5)
+    assert predicted[2] - predicted[0] == pytest.approx(20, abs=1.5)
+
+
+def test_moving_fish_keeps_its_id():
+    tracker = Tracker(iou_thres=0.3, min_hits=3, names={0: 'Fish'})
+    ids = set()
+    for frame in range(20):
+        out = tracker.update(np.array([box(10 + 3 * frame, 50)]), frame)
+        ids.add(int(out[0, 6]))
+    assert ids == {1}
+    summary = tracker.summary()
+    assert summary['unique_counts'] == {'Fish': 1}
+    assert summary['tracks'][0]['hits'] == 20
+
+
+def test_two_fish_crossing_paths_get_two_ids():
+    tracker = Tracker(iou_thres=0.2, min_hits=1)
+    for frame in range(10):
+        out = tracker.update(np.array([box(10 + 10 * frame, 10), box(300 - 10 * frame, 200)]), frame)
+        assert out[:, 6].tolist() == [1, 2]  # rows keep the input order
+    assert tracker.summary()['unique_count'] == 2
+
+
+def test_short_tracks_and_class_changes():
+    tracker = Tracker(min_hits=3, max_age=2, names={0: 'Fish', 1: 'notFish'})
+    tracker.update(np.array([box(0, 0)]), 0)  # seen once: noise, never counted
+    for frame in range(1, 5):
+        tracker.update(np.zeros((0, 6)), frame)
+    assert tracker.tracks == []
+    assert tracker.summary()['unique_count'] == 0
+
+    # Class-aware matching: a different class at the same place is a new track
+    tracker.update(np.array([box(100, 100, cls=0)]), 10)
+    out = tracker.update(np.array([box(100, 100, cls=1)]), 11)
+    assert out[0, 6] != 1
+
+
+def test_predict_carries_confirmed_tracks_between_inferred_frames():
+    tracker = Tracker(min_hits=2)
+    for frame in range(3):
+        tracker.update(np.array([box(10 * frame, 0)]), frame)
+    predicted = tracker.predict(3)
+    assert predicted.shape == (1, 7)
+    assert predicted[0, 6] == 1
+    assert predicted[0, 0] > 20  # moved on with the estimated velocity
+    tracker.close()
+    assert tracker.tracks == [] and tracker.summary()['unique_count'] == 1
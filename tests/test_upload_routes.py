@@ -0,0 +1,66 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('flask')
+
+
+def png_bytes(h=600, w=800):
+    # Noise, so the PNG is well over Werkzeug's 500 KB in-memory limit
+    img = np.random.default_rng(0).integers(0, 255, (h, w, 3), dtype=np.uint8)
+    ok, data = cv2.imencode('.png', img)
+    assert ok
+    return data.tobytes()
+
+
+def test_image_upload_is_parsed_into_a_pooled_buffer(client, monkeypatch):
+    import app as ikan_app
+
+    client, uploads, _ = client
+    data = png_bytes()
+    assert len(data) > 500 * 1024
+
+    def no_temp_files(*args, **kwargs):
+        raise AssertionError('upload spooled to a temporary file')
+
+    monkeypatch.setattr('werkzeug.formparser.default_stream_factory', no_temp_files)
+    monkeypatch.setattr('werkzeug.wrappers.request.default_stream_factory', no_temp_files)
+    from ingest import BufferPool
+
+    monkeypatch.setattr(ikan_app, 'upload_buffers', BufferPool())
+    response = client.post('/api/upload', data={'file': (io.BytesIO(data), 'reef.png')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert body['format'] == 'png' and body['persisted']
+    assert (uploads / body['filename']).read_bytes() == data
+    assert ikan_app.upload_store.get(body['filename']).image.shape == (600, 800, 3)
+    # The buffer went back to the pool when the request closed
+    assert len(ikan_app.upload_buffers._free) == 1
+
+
+def test_unreadable_image_upload_is_rejected(client):
+    client, _, _ = client
+    response = client.post('/api/upload', data={'file': (io.BytesIO(b'\x89PNG\r\n\x1a\n' + b'\0' * 64), 'x.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_persist_0_is_ignored_with_several_workers(client, monkeypatch):
+    import app as ikan_app
+
+    client, uploads, _ = client
+    data = png_bytes(32, 32)
+    monkeypatch.setitem(ikan_app.app.config, 'SERVER_WORKERS', 1)
+    single = client.post('/api/upload', data={'file': (io.BytesIO(data), 'a.png'), 'persist': '0'},
+                         content_type='multipart/form-data').get_json()
+    assert not single['persisted'] and not (uploads / single['filename']).exists()
+
+    monkeypatch.setitem(ikan_app.app.config, 'SERVER_WORKERS', 2)
+    several = client.post('/api/upload', data={'file': (io.BytesIO(data), 'b.png'), 'persist': '0'},
+                          content_type='multipart/form-data').get_json()
+    # Another worker may serve the detect, it can only find the upload on disk
+    assert several['persisted'] and (uploads / several['filename']).read_bytes() == data
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+import weights_catalog
+from weights_catalog import WeightsCatalog
+
+FISH = {0: 'Fish', 1: 'notFish'}
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Replace checkpoint unpickling with a recorder; set reads.gate to block a read"""
+    class Reads(list):
+        gate = None
+
+    calls = Reads()
+
+    def fake_read(path):
+        calls.append(path.name)
+        if calls.gate is not None:
+            calls.gate.wait(5)
+        return {'names': dict(FISH), 'classes': 2, 'imgsz': 640, 'params': 7, 'stride': 32,
+                'epoch': 1, 'date': None}
+
+    monkeypatch.setattr(weights_catalog, 'read_checkpoint_metadata', fake_read)
+    return calls
+
+
+@pytest.fixture
+def base(tmp_path):
+    base = tmp_path / 'app'
+    (base / 'yolov5' / 'runs' / 'train' / 'exp' / 'weights').mkdir(parents=True)
+    (base / 'yolov5s.pt').write_bytes(b'coco')
+    (base / 'yolov5' / 'runs' / 'train' / 'exp' / 'weights' / 'best.pt').write_bytes(b'fish')
+    return base
+
+
+def test_discovers_weights_and_reuses_sidecars(base, reads, tmp_path):
+    catalog = WeightsCatalog(base, tmp_path / 'meta', poll_interval=60)
+    entries = catalog.entries()
+    assert [e['name'] for e in entries] == ['YOLOv5s (Pre-trained)', 'Custom Model (exp)']
+    assert entries[1]['names'] == FISH and entries[1]['imgsz'] == 640 and not entries[1]['is_coco']
+    assert sorted(reads) == ['best.pt', 'yolov5s.pt']
+
+    # Another process / a restart reads the sidecars instead of the checkpoints
+    other = WeightsCatalog(base, tmp_path / 'meta', poll_interval=60)
+    assert other.names(base / 'yolov5' / 'runs' / 'train' / 'exp' / 'weights' / 'best.pt') == FISH
+    assert len(reads) == 2
+
+
+def test_rescans_only_when_weights_change(base, reads, tmp_path):
+    catalog = WeightsCatalog(base, tmp_path / 'meta', poll_interval=0)
+    catalog.entries()
+    catalog.entries()
+    assert catalog.scans == 1
+    best = base / 'yolov5' / 'runs' / 'train' / 'exp' / 'weights' / 'best.pt'
+    best.write_bytes(b'fish, retrained')
+    catalog.entries()
+    assert catalog.scans == 2
+    assert reads.count('best.pt') == 2 and reads.count('yolov5s.pt') == 1
+
+
+def test_get_refuses_paths_outside_the_catalog(base, reads, tmp_path):
+    catalog = WeightsCatalog(base, tmp_path / 'meta', poll_interval=60)
+    outside = tmp_path / 'elsewhere' / 'payload.pt'
+    outside.parent.mkdir()
+    outside.write_bytes(b'not to be unpickled')
+    catalog.entries()
+    reads.clear()
+
+    assert catalog.get(outside) is None
+    assert catalog.names(outside) is None
+    assert not catalog.is_coco(outside)
+    # Release names not downloaded yet are still known to be COCO
+    assert catalog.is_coco(tmp_path / 'yolov5m.pt')
+    assert reads == []
+
+
+def test_lookups_are_not_blocked_by_a_rescan(base, reads, tmp_path):
+    catalog = WeightsCatalog(base, tmp_path / 'meta', poll_interval=0)
+    catalog.entries()
+    (base / 'yolov5m.pt').write_bytes(b'slow to read')
+    reads.gate = threading.Event()
+    scanner = threading.Thread(target=catalog.refresh, kwargs={'force': True})
+    scanner.start()
+    try:
+        deadline = time.monotonic() + 5
+        while 'yolov5m.pt' not in reads and time.monotonic() < deadline:
+            time.sleep(0.01)
+        t0 = time.monotonic()
+        names = [e['name'] for e in catalog.entries()]
+        assert time.monotonic() - t0 < 1
+        # Answered from the previous scan while the new checkpoint is being read
+        assert 'Pre-trained (yolov5m.pt)' not in names
+        assert catalog.get(base / 'yolov5s.pt')['path'] == str((base / 'yolov5s.pt').resolve())
+    finally:
+        reads.gate.set()
+        scanner.join(5)
+    assert 'Pre-trained (yolov5m.pt)' in [e['name'] for e in catalog.entries()]
@@ -0,0 +1,102 @@
+"""
+Sliced (tiled) inference for IKAN Fish Detection
+Large camera frames are split into overlapping tiles that are detected
+at full resolution in batches, then merged back with cross-tile NMS so
+small, distant fish are not lost to downscaling
+"""
+
+import time
+
+import numpy as np
+
+
+def tile_windows(h, w, tile_size=640, overlap=0.2):
+    """Overlapping (x0, y0, x1, y1) windows covering an h x w image"""
+    step = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)  # last tile flush with the edge
+        return positions
+
+    return [(x, y, min(x + tile_size, w), min(y + tile_size, h)) for y in starts(h) for x in starts(w)]
+
+
+def merge_detections(dets, iou_thres=0.45, max_det=1000):
+    """Class-aware NMS over detections gathered from several tiles"""
+    import torch
+    import torchvision
+
+    dets = [d for d in dets if len(d)]
+    if not dets:
+        return np.zeros((0, 6), dtype=np.float32)
+    det = torch.from_numpy(np.concatenate(dets).astype(np.float32))
+    keep = torchvision.ops.batched_nms(det[:, :4], det[:, 4], det[:, 5].long(), iou_thres)[:max_det]
+    return det[keep].numpy()
+
+
+def run_tiled(registry, weights_path, img0, tile_size=640, overlap=0.2, max_tiles_per_batch=8,
+              conf_thres=0.25, iou_thres=0.45, max_det=1000, include_full=True, imgsz=640, input_size=None):
+    """
+    Detect on overlapping tiles of img0 (BGR), returns (det, timings)
+    det is (n, 6) [x1, y1, x2, y2, conf, cls] in original coordinates
+    include_full also runs the whole image at imgsz so fish larger than a
+    tile are still found
+    input_size: size the model only accepts (traced TorchScript), tiles are
+    scaled to it instead of fed at tile_size
+    """
+    h, w = img0.shape[:2]
+    t_start = time.perf_counter()
+    loaded = registry.get(weights_path)
+    windows = tile_windows(h, w, tile_size, overlap)
+    tile_input = input_size or tile_size
+
+    t0 = time.perf_counter()
+    # Crops are views into img0, only the letterboxed tiles are copied
+    arrays = [registry.prepare(loaded, img0[y0:y1, x0:x1], tile_input)[0] for x0, y0, x1, y1 in windows]
+    preprocess = time.perf_counter() - t0
+
+    found = []
+    inference = nms = 0.0
+    for start in range(0, len(windows), max(1, max_tiles_per_batch)):
+        chunk = windows[start:start + max_tiles_per_batch]
+        t0 = time.perf_counter()
+        im, pred = registry.forward(loaded, np.stack(arrays[start:start + len(chunk)]))
+        inference += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        shapes = [(y1 - y0, x1 - x0, 3) for x0, y0, x1, y1 in chunk]
+        for (x0, y0, _, _), det in zip(chunk, registry.postprocess(pred, im.shape[2:], shapes, conf_thres,
+                                                                   iou_thres, max_det)):
+            if len(det):
+                det[:, [0, 2]] += x0
+                det[:, [1, 3]] += y0
+                found.append(det)
+        nms += time.perf_counter() - t0
+
+    if include_full and len(windows) > 1:
+        full, full_timings = registry.infer(weights_path, [img0], imgsz=imgsz, conf_thres=conf_thres,
+                                            iou_thres=iou_thres, max_det=max_det)
+        found.extend(full)
+        inference += full_timings['inference']
+
+    t0 = time.perf_counter()
+    det = merge_detections(found, iou_thres, max_det)
+    merge = time.perf_counter() - t0
+
+    total = time.perf_counter() - t_start
+    megapixels = h * w / 1e6
+    return det, {
+        'tiles': len(windows),
+        'tile_size': tile_size,
+        'tile_input_size': tile_input,
+        'overlap': overlap,
+        'preprocess': preprocess,
+        'inference': inference,
+        'nms': nms,
+        'merge': merge,
+        'total': total,
+        'megapixels': megapixels,
+        'seconds_per_megapixel': total / megapixels if megapixels else None,
+    }
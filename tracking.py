@@ -0,0 +1,228 @@
+"""
+Online multi-object tracking for IKAN Fish Detection
+SORT-style tracker: a constant-velocity Kalman filter per fish and IoU
+association (Hungarian assignment) between predicted tracks and new
+detections. Frames are processed one at a time; finished tracks are
+folded into per-class counts and a bounded list of summaries, so memory
+stays flat on long videos. Frames without inference advance the tracks
+with the Kalman prediction instead of reusing stale boxes.
+"""
+
+from collections import deque
+
+import numpy as np
+
+# Summaries kept for finished tracks (counts stay exact beyond this)
+MAX_TRACK_SUMMARIES = 10000
+
+
+def iou_matrix(a, b):
+    """Pairwise IoU of (n, 4) and (m, 4) xyxy boxes"""
+    if not len(a) or not len(b):
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def _to_z(box):
+    """xyxy -> [cx, cy, area, aspect]"""
+    w, h = box[2] - box[0], box[3] - box[1]
+    return np.array([box[0] + w / 2, box[1] + h / 2, w * h, w / max(h, 1e-6)], dtype=np.float64)
+
+
+def _to_box(x):
+    """[cx, cy, area, aspect, ...] -> xyxy"""
+    area = max(x[2], 1e-6)
+    w = np.sqrt(area * max(x[3], 1e-6))
+    h = area / w
+    return np.array([x[0] - w / 2, x[1] - h / 2, x[0] + w / 2, x[1] + h / 2])
+
+
+class KalmanBox:
+    """Constant-velocity Kalman filter over [cx, cy, area, aspect, vx, vy, varea] (SORT constants)"""
+
+    F = np.eye(7)
+    F[0, 4] = F[1, 5] = F[2, 6] = 1
+    H = np.eye(4, 7)
+    R = np.diag([1.0, 1.0, 10.0, 10.0])
+    Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+
+    def __init__(self, box):
+        self.x = np.zeros(7)
+        self.x[:4] = _to_z(box)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4])
+
+    def predict(self):
+        if self.x[2] + self.x[6] <= 0:
+            self.x[6] = 0  # area can't shrink below zero
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        return _to_box(self.x)
+
+    def update(self, box):
+        y = _to_z(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(7) - K @ self.H) @ self.P
+
+    @property
+    def box(self):
+        return _to_box(self.x)
+
+
+class Track:
+    def __init__(self, track_id, det, frame):
+        self.id = track_id
+        self.kf = KalmanBox(det[:4])
+        self.hits = 1
+        self.misses = 0
+        self.first_frame = self.last_frame = frame
+        self.conf = float(det[4])
+        self.conf_sum = self.conf_max = float(det[4])
+        self.class_votes = {int(det[5]): 1}
+
+    @property
+    def cls(self):
+        return max(self.class_votes, key=self.class_votes.get)
+
+    def update(self, det, frame):
+        self.kf.update(det[:4])
+        self.hits += 1
+        self.misses = 0
+        self.last_frame = frame
+        self.conf = float(det[4])
+        self.conf_sum += self.conf
+        self.conf_max = max(self.conf_max, self.conf)
+        cls = int(det[5])
+        self.class_votes[cls] = self.class_votes.get(cls, 0) + 1
+
+    def summary(self, names=None):
+        return {
+            'track_id': self.id,
+            'class': self.cls,
+            'class_name': names.get(self.cls, str(self.cls)) if names else self.cls,
+            'first_frame': self.first_frame,
+            'last_frame': self.last_frame,
+            'hits': self.hits,
+            'mean_confidence': self.conf_sum / self.hits,
+            'max_confidence': self.conf_max,
+        }
+
+
+class Tracker:
+    """
+    Assigns stable ids to detections across frames
+    iou_thres: minimum IoU between a predicted track and a detection to match
+    max_age: frames a track survives without a match
+    min_hits: matches before a track counts as a unique fish
+    """
+
+    def __init__(self, iou_thres=0.3, max_age=30, min_hits=3, names=None, class_aware=True):
+        self.iou_thres = iou_thres
+        self.max_age = max(1, int(max_age))
+        self.min_hits = max(1, int(min_hits))
+        self.names = names
+        self.class_aware = class_aware
+        self.tracks = []
+        self.next_id = 1
+        self.unique_counts = {}
+        self.finished = deque(maxlen=MAX_TRACK_SUMMARIES)
+        self.frames = 0
+        self.last_update_frame = None
+
+    def _predict(self):
+        return np.array([t.kf.predict() for t in self.tracks]).reshape(-1, 4)
+
+    def _retire(self):
+        alive = []
+        for track in self.tracks:
+            if track.misses > self.max_age:
+                self._finish(track)
+            else:
+                alive.append(track)
+        self.tracks = alive
+
+    def _finish(self, track):
+        if track.hits >= self.min_hits:
+            name = self.names.get(track.cls, str(track.cls)) if self.names else track.cls
+            self.unique_counts[name] = self.unique_counts.get(name, 0) + 1
+            self.finished.append(track.summary(self.names))
+
+    def update(self, det, frame):
+        """
+        Match a frame's (n, 6) detections to tracks
+        Returns (n, 7) [x1, y1, x2, y2, conf, cls, track_id], rows in input order
+        """
+        from scipy.optimize import linear_sum_assignment
+
+        self.frames += 1
+        self.last_update_frame = frame
+        det = np.asarray(det, dtype=np.float64).reshape(-1, 6)
+        predicted = self._predict()
+        ids = np.zeros(len(det))
+        matched_tracks = set()
+        if len(det) and len(self.tracks):
+            iou = iou_matrix(predicted, det[:, :4])
+            if self.class_aware:
+                same = np.array([t.cls for t in self.tracks])[:, None] == det[None, :, 5].astype(int)
+                iou = iou * same
+            rows, cols = linear_sum_assignment(-iou)
+            for r, c in zip(rows, cols):
+                if iou[r, c] >= self.iou_thres:
+                    self.tracks[r].update(det[c], frame)
+                    ids[c] = self.tracks[r].id
+                    matched_tracks.add(r)
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.misses += 1
+        for c in np.flatnonzero(ids == 0):
+            track = Track(self.next_id, det[c], frame)
+            self.next_id += 1
+            self.tracks.append(track)
+            ids[c] = track.id
+        self._retire()
+        return np.concatenate([det, ids[:, None]], axis=1)
+
+    def predict(self, frame):
+        """
+        Advance tracks through a frame without inference
+        Returns (m, 7) predicted boxes of the confirmed tracks matched at the
+        last inferred frame
+        """
+        self.frames += 1
+        boxes = self._predict()
+        out = []
+        for track, box in zip(self.tracks, boxes):
+            track.misses += 1
+            if track.hits >= self.min_hits and track.last_frame == self.last_update_frame:
+                out.append([*box, track.conf, track.cls, track.id])
+        self._retire()
+        return np.array(out, dtype=np.float64).reshape(-1, 7)
+
+    def close(self):
+        """Finish all open tracks (end of video)"""
+        for track in self.tracks:
+            self._finish(track)
+        self.tracks = []
+
+    def summary(self):
+        """Unique counts per class plus per-track summaries (open tracks included)"""
+        counts = dict(self.unique_counts)
+        tracks = list(self.finished)
+        for track in self.tracks:
+            if track.hits >= self.min_hits:
+                s = track.summary(self.names)
+                counts[s['class_name']] = counts.get(s['class_name'], 0) + 1
+                tracks.append(s)
+        return {
+            'unique_count': sum(counts.values()),
+            'unique_counts': counts,
+            'tracks': tracks,
+            'tracks_truncated': len(self.finished) == self.finished.maxlen,
+            'frames': self.frames,
+        }
@@ -0,0 +1,247 @@
+"""
+Streaming video detection for IKAN Fish Detection
+Decode, preprocess (letterbox), inference and annotated-frame encoding
+run as separate threads connected by bounded queues, so every stage
+works on a different frame at the same time and memory stays flat
+regardless of video length
+
+    decode -> preprocess -> infer (batched) -> encode (+ tracking)
+"""
+
+import queue
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from inference import draw_detections, format_label_lines
+
+# Frames buffered between two stages
+QUEUE_SIZE = 8
+# Marks the end of the stream between stages
+_END = object()
+
+
+class _PipelineStopped(Exception):
+    """A stage noticed the pipeline was stopped (error elsewhere or cancel)"""
+
+
+class VideoPipeline:
+    """
+    One streaming run over a video
+    vid_stride keeps every Nth decoded frame (the output video is written
+    at fps / vid_stride); detect_every runs the model on every Nth kept
+    frame and reuses the last boxes for the frames in between; with a
+    tracker the boxes get stable ids and frames in between show the
+    tracks' Kalman predictions instead
+    """
+
+    def __init__(self, job, registry, weights_path, source, save_dir, imgsz=640, conf_thres=0.25,
+                 iou_thres=0.45, batch_size=4, vid_stride=1, detect_every=1, formatter=None,
+                 save_labels=False, tracker=None, queue_size=QUEUE_SIZE):
+        self.job = job
+        self.registry = registry
+        self.weights_path = weights_path
+        self.source = Path(source)
+        self.save_dir = Path(save_dir)
+        self.imgsz = imgsz
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.batch_size = max(1, int(batch_size))
+        self.vid_stride = max(1, int(vid_stride))
+        self.detect_every = max(1, int(detect_every))
+        self.formatter = formatter
+        self.save_labels = save_labels
+        self.tracker = tracker
+        self.queue_size = queue_size
+        self._stop = threading.Event()
+        self._errors = []
+
+    # Queue helpers: never block forever, so a failed stage can't deadlock the others
+    def _put(self, q, item):
+        while True:
+            if self._stop.is_set():
+                raise _PipelineStopped()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while True:
+            if self._stop.is_set():
+                raise _PipelineStopped()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _stage(self, name, fn, *args):
+        def target():
+            try:
+                fn(*args)
+            except _PipelineStopped:
+                pass
+            except Exception as e:
+                self._errors.append(e)
+                self._stop.set()
+        return threading.Thread(target=target, name=f'ikan-video-{name}', daemon=True)
+
+    def _decode(self, cap, q_out):
+        index = 0  # 1-based frame numbers like detect.py
+        while True:
+            if self.job is not None and self.job.cancelled:
+                self._stop.set()
+                raise _PipelineStopped()
+            ok = cap.grab()
+            if not ok:
+                break
+            index += 1
+            if (index - 1) % self.vid_stride:
+                continue  # grab() skips decoding of dropped frames
+            ok, frame = cap.retrieve()
+            if not ok:
+                break
+            self._put(q_out, (index, frame))
+        self._put(q_out, _END)
+
+    def _preprocess(self, loaded, q_in, q_out):
+        kept = 0
+        while True:
+            item = self._get(q_in)
+            if item is _END:
+                break
+            index, frame = item
+            array = None
+            if kept % self.detect_every == 0:
+                array, _ = self.registry.prepare(loaded, frame, self.imgsz)
+            kept += 1
+            self._put(q_out, (index, frame, array))
+        self._put(q_out, _END)
+
+    def _infer(self, loaded, q_in, q_out):
+        ended = False
+        while not ended:
+            # Block for one frame, then take whatever else is ready up to batch_size
+            pending = [self._get(q_in)]
+            while len([p for p in pending if p is not _END and p[2] is not None]) < self.batch_size:
+                if pending[-1] is _END:
+                    break
+                try:
+                    pending.append(q_in.get_nowait())
+                except queue.Empty:
+                    break
+            if pending[-1] is _END:
+                pending.pop()
+                ended = True
+
+            to_run = [p for p in pending if p[2] is not None]
+            dets = {}
+            if to_run:
+                im, pred = self.registry.forward(loaded, np.stack([p[2] for p in to_run]))
+                results = self.registry.postprocess(pred, im.shape[2:], [p[1].shape for p in to_run],
+                                                    self.conf_thres, self.iou_thres)
+                dets = {p[0]: det for p, det in zip(to_run, results)}
+            for index, frame, _ in pending:
+                # None = not inferred, the encoder reuses the previous boxes
+                self._put(q_out, (index, frame, dets.get(index)))
+        self._put(q_out, _END)
+
+    def _encode(self, writer, names, labels_dir, q_in):
+        frames_done = 0
+        last_det = np.zeros((0, 6), dtype=np.float32)
+        while True:
+            item = self._get(q_in)
+            if item is _END:
+                break
+            index, frame, det = item
+            inferred = det is not None
+            track_ids = None
+            if self.tracker is not None:
+                # Frames run in order here, so the tracker sees them sequentially
+                tracked = self.tracker.update(det, index) if inferred else self.tracker.predict(index)
+                track_ids = tracked[:, 6]
+                if inferred:
+                    det = tracked
+                writer.write(draw_detections(frame, tracked, names, track_ids))
+            else:
+                if inferred:
+                    last_det = det
+                writer.write(draw_detections(frame, last_det, names))
+            frames_done += 1
+
+            rows = []
+            if inferred and len(det):
+                if self.save_labels:
+                    # detect.py names video labels <stem>_<frame>.txt
+                    with open(labels_dir / f'{self.source.stem}_{index}.txt', 'w') as f:
+                        f.write('\n'.join(format_label_lines(det[:, :6], frame.shape)) + '\n')
+                if self.formatter is not None:
+                    rows = self.formatter(det, frame.shape, index)
+            if self.job is not None:
+                self.job.progress(frames_done, rows)
+        self.frames_done = frames_done
+
+    def run(self):
+        """Run all stages to completion, returns a dict describing the annotated video"""
+        labels_dir = self.save_dir / 'labels'
+        (labels_dir if self.save_labels else self.save_dir).mkdir(parents=True, exist_ok=True)
+
+        cap = cv2.VideoCapture(str(self.source))
+        if not cap.isOpened():
+            raise ValueError(f'Video not readable: {self.source.name}')
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.job is not None:
+            self.job.total_frames = -(-total // self.vid_stride) if total > 0 else None
+
+        save_path = self.save_dir / (self.source.stem + '.mp4')
+        out_fps = fps / self.vid_stride
+        writer = cv2.VideoWriter(str(save_path), cv2.VideoWriter_fourcc(*'mp4v'), out_fps, (w, h))
+        self.frames_done = 0
+        try:
+            loaded = self.registry.get(self.weights_path)
+            decoded, prepared, inferred = (queue.Queue(self.queue_size) for _ in range(3))
+            stages = [
+                self._stage('decode', self._decode, cap, decoded),
+                self._stage('preprocess', self._preprocess, loaded, decoded, prepared),
+                self._stage('infer', self._infer, loaded, prepared, inferred),
+                self._stage('encode', self._encode, writer, loaded.names, labels_dir, inferred),
+            ]
+            for stage in stages:
+                stage.start()
+            for stage in stages:
+                stage.join()
+        finally:
+            cap.release()
+            writer.release()
+
+        if self._errors:
+            raise self._errors[0]
+        if self.job is not None:
+            self.job.check_cancelled()
+        result = {'save_path': save_path, 'frames': self.frames_done, 'source_fps': fps,
+                  'output_fps': out_fps, 'width': w, 'height': h}
+        if self.tracker is not None:
+            self.tracker.close()
+            result['tracking'] = self.tracker.summary()
+        return result
+
+
+def run_video_detection(job, registry, weights_path, source, save_dir, imgsz=640, conf_thres=0.25,
+                        iou_thres=0.45, batch_size=4, vid_stride=1, detect_every=1, formatter=None,
+                        save_labels=False, tracker=None):
+    """
+    Detect on a video with the streaming pipeline, reporting progress on `job`
+    formatter(det, shape, frame) turns one frame's detections into JSON
+    rows for the job's partial results; with a tracker det has a 7th
+    column holding the track id
+    """
+    return VideoPipeline(job, registry, weights_path, source, save_dir, imgsz=imgsz, conf_thres=conf_thres,
+                         iou_thres=iou_thres, batch_size=batch_size, vid_stride=vid_stride,
+                         detect_every=detect_every, formatter=formatter, save_labels=save_labels,
+                         tracker=tracker).run()
@@ -0,0 +1,224 @@
+"""
+Weights catalog for IKAN Fish Detection
+Weights are discovered once (pre-trained files next to the app and in
+yolov5/, training runs in yolov5/runs/train/*/weights/best.pt) and the
+folders are re-checked at most every poll_interval seconds, only by
+their mtimes. Each checkpoint's metadata (class names, training image
+size, parameter count, stride) is read once and stored in a sidecar
+JSON under the cache directory, keyed by the file's sha256, so restarts
+and other workers don't load the checkpoint again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# Official YOLOv5 releases, trained on COCO (used when a checkpoint isn't readable yet)
+COCO_RELEASES = {f'yolov5{size}{p6}.pt' for size in 'nsmlx' for p6 in ('', '6')}
+COCO_FIRST_NAMES = ('person', 'bicycle', 'car')
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_checkpoint_metadata(path):
+    """Class names, image size, parameter count and stride from a YOLOv5 .pt checkpoint"""
+    import torch
+
+    try:
+        ckpt = torch.load(path, map_location='cpu', weights_only=False)
+    except TypeError:  # torch < 1.13 has no weights_only
+        ckpt = torch.load(path, map_location='cpu')
+    model = ckpt.get('ema') or ckpt['model']
+    names = model.names
+    names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else {int(k): v for k, v in names.items()}
+    opt = ckpt.get('opt') or {}
+    imgsz = opt.get('imgsz') or opt.get('img_size')
+    if isinstance(imgsz, (list, tuple)):
+        imgsz = max(imgsz)
+    return {
+        'names': names,
+        'classes': len(names),
+        'imgsz': int(imgsz) if imgsz else None,
+        'params': int(sum(p.numel() for p in model.parameters())),
+        'stride': int(max(model.stride)) if hasattr(model, 'stride') else None,
+        'epoch': ckpt.get('epoch'),
+        'date': ckpt.get('date'),
+    }
+
+
+def is_coco_names(names):
+    """True for the 80 COCO classes YOLOv5 releases are trained on"""
+    return len(names) == 80 and tuple(names.get(i) for i in range(3)) == COCO_FIRST_NAMES
+
+
+class WeightsCatalog:
+    """
+    Discovered weights with their checkpoint metadata
+    base_dir: app directory (yolov5/ below it); meta_dir: sidecar JSON files
+    """
+
+    def __init__(self, base_dir, meta_dir, poll_interval=30):
+        self.base_dir = Path(base_dir)
+        self.meta_dir = Path(meta_dir)
+        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = max(0.0, float(poll_interval))
+        self._entries = None  # resolved path -> entry dict, in display order
+        self._signature = None
+        self._checked_at = 0.0
+        self._stamps = {}  # path -> ((size, mtime_ns), sha256)
+        self._meta = {}  # sha256 -> metadata (failed reads too, so they aren't retried per request)
+        self._lock = threading.Lock()  # guards _entries / _signature, never held while reading files
+        self._scan_lock = threading.Lock()  # one rescan at a time, guards _stamps / _meta
+        self.scans = 0
+
+    # Discovery
+
+    def _watched_dirs(self):
+        runs = self.base_dir / 'yolov5' / 'runs' / 'train'
+        dirs = [self.base_dir, self.base_dir / 'yolov5', runs]
+        if runs.is_dir():
+            dirs += [d / 'weights' for d in runs.iterdir() if d.is_dir()]
+        return dirs
+
+    def _signature_now(self):
+        sig = []
+        for d in self._watched_dirs():
+            try:
+                sig.append((str(d), d.stat().st_mtime_ns))
+            except OSError:
+                pass
+        for path in self._entries or {}:
+            # best.pt is rewritten in place during training, the folder mtime wouldn't change
+            try:
+                st = os.stat(path)
+                sig.append((path, st.st_size, st.st_mtime_ns))
+            except OSError:
+                sig.append((path, None))
+        return tuple(sig)
+
+    def _discover(self):
+        found = []
+        for name in sorted(p.name for p in self.base_dir.glob('*.pt')):
+            label = 'YOLOv5s (Pre-trained)' if name == 'yolov5s.pt' else f'Pre-trained ({name})'
+            found.append((label, self.base_dir / name))
+        for path in sorted((self.base_dir / 'yolov5').glob('*.pt')):
+            if not (self.base_dir / path.name).exists():
+                found.append((f'Pre-trained ({path.name})', path))
+        runs = self.base_dir / 'yolov5' / 'runs' / 'train'
+        if runs.is_dir():
+            for exp_dir in sorted(runs.iterdir(), key=lambda d: d.stat().st_mtime):
+                weights_file = exp_dir / 'weights' / 'best.pt'
+                if weights_file.exists():
+                    found.append((f'Custom Model ({exp_dir.name})', weights_file))
+        return found
+
+    def refresh(self, force=False):
+        """Rescan if the watched folders changed (checked at most every poll_interval)"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._entries is not None and now - self._checked_at < self.poll_interval:
+                return
+            self._checked_at = now
+            signature = self._signature_now()
+            if not force and self._entries is not None and signature == self._signature:
+                return
+            first = self._entries is None
+        # Hashing and unpickling checkpoints takes seconds: done outside the lock so lookups keep
+        # answering from the previous entries; only the first scan (nothing to answer from) is waited for
+        if not self._scan_lock.acquire(blocking=first or force):
+            return
+        try:
+            if first and not force and self._entries is not None:
+                return  # scanned by the thread we waited for
+            entries = {}
+            for label, path in self._discover():
+                key = str(path.resolve())
+                entries[key] = {'name': label, 'path': key, **self._metadata(path)}
+            with self._lock:
+                self._entries = entries
+                self._signature = self._signature_now()
+                self.scans += 1
+        finally:
+            self._scan_lock.release()
+
+    # Metadata
+
+    def _metadata(self, path):
+        st = path.stat()
+        stamp = (st.st_size, st.st_mtime_ns)
+        cached = self._stamps.get(str(path))
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, file_sha256(path))
+            self._stamps[str(path)] = cached
+        sha = cached[1]
+        if sha in self._meta:
+            return {**self._meta[sha], 'size_bytes': st.st_size}
+        sidecar = self.meta_dir / f'{sha[:32]}.json'
+        meta = None
+        try:
+            with open(sidecar) as f:
+                meta = json.load(f)
+            meta['names'] = {int(k): v for k, v in meta['names'].items()}
+        except (OSError, ValueError, KeyError, AttributeError):
+            meta = None
+        if meta is None:
+            try:
+                meta = read_checkpoint_metadata(path)
+            except Exception as e:
+                # Not a YOLOv5 checkpoint (or yolov5/ missing): listed without metadata, no sidecar written
+                self._meta[sha] = {'sha256': sha, 'names': None, 'classes': None, 'imgsz': None, 'params': None,
+                                   'stride': None, 'is_coco': path.name in COCO_RELEASES,
+                                   'metadata_error': str(e)[:200]}
+                return {**self._meta[sha], 'size_bytes': st.st_size}
+            tmp = sidecar.with_name(f'{sidecar.name}.{os.getpid()}.tmp')
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump({**meta, 'source': str(path)}, f, default=str)
+                os.replace(tmp, sidecar)
+            except OSError:
+                pass
+        meta.pop('source', None)
+        self._meta[sha] = {**meta, 'sha256': sha, 'is_coco': is_coco_names(meta['names'])}
+        return {**self._meta[sha], 'size_bytes': st.st_size}
+
+    # Lookups
+
+    def entries(self):
+        self.refresh()
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def get(self, weights_path):
+        """
+        Catalog entry of a weights file, None for files outside the discovered folders
+        Checkpoints are pickles: a path a client names is never loaded just to read its metadata
+        """
+        self.refresh()
+        key = str(Path(weights_path).resolve()) if Path(weights_path).exists() else str(weights_path)
+        with self._lock:
+            return self._entries.get(key)
+
+    def is_coco(self, weights_path):
+        """COCO-trained, from the checkpoint's class names (release name if not downloaded yet)"""
+        entry = self.get(weights_path)
+        if entry is not None:
+            return entry['is_coco']
+        return Path(weights_path).name in COCO_RELEASES
+
+    def names(self, weights_path):
+        entry = self.get(weights_path)
+        return entry['names'] if entry is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {'weights': len(self._entries or {}), 'scans': self.scans, 'poll_interval': self.poll_interval}